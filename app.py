@@ -9,20 +9,30 @@ app.py — Точка входа: один процесс, 4 порта, общ
     python app.py send_media   — только send_media (порт 5023)
     python app.py leave_chat   — только leave_chat (порт 5024)
     python app.py dashboard    — только дашборд (порт 5099)
+
+Порты открываются сразу при старте; пока у сервиса нет здорового bridge'а,
+запросы получают 503 {"status": "starting"} + Retry-After. GET /ready на
+каждом порту (и на дашборде — по всем сервисам) показывает готовность.
+
+Graceful reload: kill -HUP <pid> (или systemctl reload telethon-platform) —
+новый процесс наследует сокеты, прогревается и забирает трафик, старый
+дорабатывает in-flight запросы и выходит. См. core/reload.py.
 """
 import sys
+import signal
 import asyncio
 import threading
 import logging
 import time
 
-from flask import Flask
+from flask import Flask, jsonify, request
 from werkzeug.serving import make_server
 
 import config
 from core.pool import AccountPool
 from core.registry import ChatRegistry
-from core.router import AccountRouter
+from core.router import AccountRouter, BridgeStarting
+from core import bot_fallback, delivery, idempotency, media_cache, metrics, reload, spool, tracing
 
 from services import create_chat as svc_create_chat
 from services import send_text as svc_send_text
@@ -43,6 +53,18 @@ _pool: AccountPool = None
 _registry: ChatRegistry = None
 _router: AccountRouter = None
 
+# Объекты pool/registry/router созданы (bridge'и ещё могут стартовать)
+_initialized = threading.Event()
+# pool.start_all() завершён
+_pool_started = threading.Event()
+
+# HTTP-серверы и их слушающие сокеты (для graceful reload)
+_servers = {}
+_sockets = {}
+
+# Фоновые asyncio-воркеры (фоновые выходы, пул заготовок) — для остановки при reload
+_worker_tasks = []
+
 
 # === Telethon thread ==========================================================
 
@@ -54,22 +76,46 @@ def telethon_thread():
     # 1. Registry (SQLite)
     _registry = ChatRegistry()
 
-    # 2. Account pool
-    _pool = AccountPool(_loop)
-    _loop.run_until_complete(_pool.start_all())
+    # 2. Account pool (bridge'и создаём сразу, подключаем ниже в фоне)
+    _pool = AccountPool(_loop, _registry)
+    _pool.create_bridges()
 
     # 3. Router
     _router = AccountRouter(_pool, _registry)
 
     # 4. Init services (inject dependencies)
+    idempotency.init(_registry)
+    media_cache.init(_registry)
+    spool.init(_registry)
+    delivery.init(_registry)
     svc_create_chat.init(_router, _loop)
     svc_send_text.init(_router, _loop)
     svc_send_media.init(_router, _loop)
     svc_leave_chat.init(_router, _loop)
-
-    logger.info("All bridges started, router ready")
-
-    # 5. Periodic cleanup (old logs)
+    _initialized.set()
+
+    # 5. Start bridges — сервисы открываются по мере готовности (см. _install_startup_gate)
+    async def _start_pool():
+        await _pool.start_all(snapshot_sessions=reload.is_successor())
+        logger.info("All bridges started, router ready")
+        _pool_started.set()
+
+    # Фоновые воркеры. Преемник при reload запускает их только после выхода
+    # предшественника, чтобы два процесса не разбирали одни очереди.
+    async def _start_workers():
+        if reload.is_successor():
+            await _loop.run_in_executor(None, reload.wait_predecessor_exit)
+            logger.info("Predecessor exited, starting background workers")
+        delivery.start()
+        _worker_tasks.append(_loop.create_task(svc_create_chat.run_pool_provisioner()))
+        await _loop.run_in_executor(None, _pool_started.wait)
+        if reload.is_successor():
+            # .session файлы освободились — снимки сессий обратно на диск
+            _pool.persist_sessions()
+        # Фоновые выходы из чатов (в т.ч. недоделанные до рестарта)
+        _worker_tasks.append(_loop.create_task(svc_leave_chat.run_leave_worker()))
+
+    # 6. Periodic cleanup (old logs)
     async def _periodic_cleanup():
         while True:
             await asyncio.sleep(86400)  # раз в сутки
@@ -79,33 +125,129 @@ def telethon_thread():
             except Exception as e:
                 logger.error("Cleanup failed: %s", e)
 
+    _loop.create_task(_start_pool())
+    _loop.create_task(_start_workers())
     _loop.create_task(_periodic_cleanup())
+    _loop.create_task(metrics.run_loop_lag_probe())
     _loop.run_forever()
 
 
 # === Flask apps ===============================================================
 
+# Read-only эндпоинты отвечают и во время старта
+_STARTUP_EXEMPT_PATHS = ("/health", "/stats", "/ready")
+
+
+def _starting_response(service: str):
+    resp = jsonify({
+        "status": "starting",
+        "service": service,
+        "error": "service is starting, retry later",
+        "retry_after": config.STARTUP_RETRY_AFTER,
+    })
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(config.STARTUP_RETRY_AFTER)
+    return resp
+
+
+def _install_startup_gate(app: Flask, service: str):
+    """503 starting, пока у сервиса нет здорового bridge'а, + /ready."""
+
+    @app.before_request
+    def _startup_gate():
+        if request.path in _STARTUP_EXEMPT_PATHS:
+            return None
+        if not _pool.is_service_ready(service):
+            return _starting_response(service)
+        return None
+
+    @app.errorhandler(BridgeStarting)
+    def _bridge_starting(e):
+        # Сервис уже открыт, но аккаунт, к которому привязан чат, ещё стартует
+        return _starting_response(service)
+
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        info = _pool.readiness().get(service, {"ready": False, "healthy": 0, "total": 0})
+        body = {"service": service, "starting": not _pool.started, **info}
+        if info["ready"]:
+            return jsonify(body)
+        resp = jsonify(body)
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(config.STARTUP_RETRY_AFTER)
+        return resp
+
+
+def _install_metrics(app: Flask, service: str):
+    """Латентность каждого запроса → http_request_duration_seconds."""
+
+    @app.before_request
+    def _metrics_start():
+        request.environ["metrics.started"] = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(response):
+        started = request.environ.get("metrics.started")
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            metrics.HTTP_DURATION.observe(
+                service, endpoint, str(response.status_code),
+                value=time.perf_counter() - started,
+            )
+        return response
+
+
+def _install_tracing(app: Flask, service: str):
+    """Трейс фаз запроса (core/tracing.py) → заголовок Server-Timing."""
+
+    @app.before_request
+    def _trace_start():
+        if request.path not in _STARTUP_EXEMPT_PATHS:
+            request.environ["trace.token"] = tracing.start(service, request.path)
+
+    @app.after_request
+    def _trace_end(response):
+        token = request.environ.pop("trace.token", None)
+        if token is not None:
+            trace = tracing.end(token, response.status_code)
+            if trace is not None:
+                response.headers["Server-Timing"] = trace.server_timing()
+        return response
+
+
 def make_create_chat_app() -> Flask:
     app = Flask("create_chat")
     app.register_blueprint(svc_create_chat.bp)
+    _install_metrics(app, "create_chat")
+    _install_tracing(app, "create_chat")
+    _install_startup_gate(app, "create_chat")
     return app
 
 
 def make_send_text_app() -> Flask:
     app = Flask("send_text")
     app.register_blueprint(svc_send_text.bp)
+    _install_metrics(app, "send_text")
+    _install_tracing(app, "send_text")
+    _install_startup_gate(app, "send_text")
     return app
 
 
 def make_send_media_app() -> Flask:
     app = Flask("send_media")
     app.register_blueprint(svc_send_media.bp)
+    _install_metrics(app, "send_media")
+    _install_tracing(app, "send_media")
+    _install_startup_gate(app, "send_media")
     return app
 
 
 def make_leave_chat_app() -> Flask:
     app = Flask("leave_chat")
     app.register_blueprint(svc_leave_chat.bp)
+    _install_metrics(app, "leave_chat")
+    _install_tracing(app, "leave_chat")
+    _install_startup_gate(app, "leave_chat")
     return app
 
 
@@ -121,22 +263,64 @@ def make_dashboard_app() -> Flask:
 
 # === Server threads ===========================================================
 
-def run_flask(app: Flask, port: int, name: str):
-    """Запустить Flask на указанном порту в отдельном потоке."""
-    server = make_server("0.0.0.0", port, app, threaded=True)
+def run_flask(server, port: int, name: str):
+    """Обслуживать запросы сервера до shutdown()."""
     logger.info("Starting %s on port %d", name, port)
     server.serve_forever()
 
 
 def start_server_thread(app: Flask, port: int, name: str):
+    # Сокет создаём сами (или берём у предшественника), чтобы его можно
+    # было передать преемнику при graceful reload.
+    sock = reload.listen_socket(name, port)
+    server = make_server(
+        "0.0.0.0", port, reload.tracker.wrap(app),
+        threaded=True, fd=sock.fileno(),
+    )
+    _sockets[name] = sock
+    _servers[name] = server
     t = threading.Thread(
-        target=run_flask, args=(app, port, name),
+        target=run_flask, args=(server, port, name),
         name=f"flask-{name}", daemon=True,
     )
     t.start()
     return t
 
 
+# === Graceful reload ==========================================================
+
+def _drain_and_stop():
+    """Преемник готов: перестаём принимать, дорабатываем и освобождаем ресурсы."""
+    # Воркеры — сразу: преемник запустит свои, как только мы выйдем.
+    # Начатые фоновые выходы и заготовка пула дорабатывают.
+    logger.info("Successor ready, stopping background workers")
+    for task in _worker_tasks:
+        _loop.call_soon_threadsafe(task.cancel)
+    delivery.stop()
+
+    logger.info("Stopping HTTP servers")
+    for server in _servers.values():
+        server.shutdown()
+
+    logger.info("Draining %d in-flight requests...", reload.tracker.count)
+    if not reload.tracker.drain(config.RELOAD_DRAIN_TIMEOUT):
+        logger.warning(
+            "Drain timeout (%ds), %d requests still running",
+            config.RELOAD_DRAIN_TIMEOUT, reload.tracker.count,
+        )
+
+    try:
+        asyncio.run_coroutine_threadsafe(_pool.stop_all(), _loop).result(timeout=30)
+    except Exception as e:
+        logger.error("Failed to disconnect clients: %s", e)
+    try:
+        _registry.close()
+    except Exception as e:
+        logger.error("Failed to flush registry: %s", e)
+    bot_fallback.close()
+    logger.info("Predecessor shut down cleanly")
+
+
 # === Main =====================================================================
 
 def main():
@@ -146,18 +330,25 @@ def main():
     )
     tg_thread.start()
 
-    # Ждём пока pool стартанёт (16 bridges с flood wait ~30s each, but parallel)
-    logger.info("Waiting for Telethon bridges to start...")
-    for _ in range(300):  # max 300 секунд (5 мин)
-        if _router is not None:
-            break
-        time.sleep(1)
-
-    if _router is None:
-        logger.error("Telethon bridges failed to start within 300s, exiting")
+    # Объекты pool/router создаются за доли секунды, bridge'и стартуют в фоне.
+    # Порты открываем сразу: до готовности сервиса клиенты получают
+    # 503 starting вместо connection refused.
+    if not _initialized.wait(timeout=60):
+        logger.error("Registry/pool failed to initialize, exiting")
         sys.exit(1)
 
-    logger.info("Router ready, starting HTTP servers...")
+    # При graceful reload трафик обслуживает предшественник — забираем его
+    # только с полностью прогретым пулом.
+    if reload.is_successor():
+        logger.info("Reload mode: waiting for Telethon bridges to start...")
+        if not _pool_started.wait(timeout=config.STARTUP_TIMEOUT):
+            logger.error(
+                "Telethon bridges failed to start within %ds, exiting",
+                config.STARTUP_TIMEOUT,
+            )
+            sys.exit(1)
+
+    logger.info("Starting HTTP servers (bridges continue starting in background)...")
 
     # Определяем какие сервисы запускать
     args = set(sys.argv[1:])
@@ -203,11 +394,52 @@ def main():
         sys.exit(1)
 
     logger.info("All services started. Press Ctrl+C to stop.")
+    reload.notify_ready()
+
+    # SIGHUP — запустить преемника, SIGUSR2 — преемник готов, уходим
+    reload_requested = threading.Event()
+    handoff_requested = threading.Event()
+    signal.signal(signal.SIGHUP, lambda *_: reload_requested.set())
+    signal.signal(signal.SIGUSR2, lambda *_: handoff_requested.set())
+
+    successor = None
+    successor_started = 0.0
 
     # Держим основной поток живым
     try:
         while True:
-            time.sleep(60)
+            time.sleep(1)
+
+            if handoff_requested.is_set():
+                _drain_and_stop()
+                return
+
+            if reload_requested.is_set():
+                reload_requested.clear()
+                reason = reload.can_reload()
+                if successor is not None:
+                    logger.warning("Reload already in progress (pid=%d)", successor.pid)
+                elif reason:
+                    logger.error("Graceful reload unavailable: %s", reason)
+                else:
+                    successor = reload.spawn_successor(_sockets)
+                    successor_started = time.time()
+
+            if successor is not None:
+                if successor.poll() is not None:
+                    logger.error(
+                        "Successor pid=%d exited with code %s, keep serving",
+                        successor.pid, successor.returncode,
+                    )
+                    successor = None
+                elif time.time() - successor_started > config.RELOAD_SUCCESSOR_TIMEOUT:
+                    logger.error(
+                        "Successor pid=%d not ready in %ds, killing",
+                        successor.pid, config.RELOAD_SUCCESSOR_TIMEOUT,
+                    )
+                    successor.kill()
+                    successor.wait()
+                    successor = None
     except KeyboardInterrupt:
         logger.info("Shutting down...")
 
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+bot_api_stub.py — Локальная заглушка Telegram Bot API для проверки fallback.
+
+Отвечает на методы, которые использует core/bot_fallback.py, в формате
+Bot API ({"ok": true, "result": {...}}) и ведёт журнал вызовов.
+Лимиты как у настоящего Bot API: ~1 сообщение/сек в чат и 30/сек всего,
+сверх — 429 с parameters.retry_after.
+
+Запуск:    python bot_api_stub.py          (порт 8081)
+Платформа: BOT_API_BASE=http://127.0.0.1:8081 python app.py
+
+Переменные окружения:
+  STUB_PORT        — порт (8081)
+  STUB_LATENCY_MS  — задержка ответа, мс (0)
+  STUB_NO_LIMITS=1 — не отдавать 429
+
+GET  /_calls  — журнал вызовов (method, chat_id, поля, файлы)
+POST /_reset  — очистить журнал и счётчики
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+STUB_PORT = int(os.environ.get("STUB_PORT", "8081"))
+LATENCY = int(os.environ.get("STUB_LATENCY_MS", "0")) / 1000
+LIMITS = os.environ.get("STUB_NO_LIMITS") != "1"
+
+PER_CHAT_PER_SEC = 1
+GLOBAL_PER_SEC = 30
+
+MEDIA_FIELDS = ("photo", "video", "document", "audio", "animation")
+
+_lock = threading.Lock()
+_calls = []
+_message_id = 0
+_sent_global = deque()
+_sent_chat = defaultdict(deque)
+
+
+def _params() -> dict:
+    if request.is_json:
+        return dict(request.get_json(silent=True) or {})
+    return request.form.to_dict()
+
+
+def _retry_after(chat_id: str, now: float):
+    """None — можно отправлять, иначе сколько секунд ждать."""
+    for q in (_sent_global, _sent_chat[chat_id]):
+        while q and now - q[0] >= 1:
+            q.popleft()
+    if len(_sent_chat[chat_id]) >= PER_CHAT_PER_SEC:
+        return max(1, int(1 - (now - _sent_chat[chat_id][0]) + 0.999))
+    if len(_sent_global) >= GLOBAL_PER_SEC:
+        return 1
+    return None
+
+
+def _message(chat_id, params: dict) -> dict:
+    global _message_id
+    _message_id += 1
+    msg = {"message_id": _message_id, "date": int(time.time()),
+           "chat": {"id": chat_id}}
+    if params.get("text"):
+        msg["text"] = params["text"]
+    if params.get("caption"):
+        msg["caption"] = params["caption"]
+    return msg
+
+
+@app.route("/bot<token>/<method>", methods=["POST", "GET"])
+def bot_method(token, method):
+    if LATENCY:
+        time.sleep(LATENCY)
+    params = _params()
+    chat_id = params.get("chat_id")
+    if chat_id is None:
+        return jsonify({"ok": False, "error_code": 400,
+                        "description": "Bad Request: chat_id is empty"}), 400
+
+    with _lock:
+        now = time.time()
+        retry_after = _retry_after(str(chat_id), now) if LIMITS else None
+        _calls.append({
+            "ts": now, "method": method, "chat_id": chat_id,
+            "params": {k: v for k, v in params.items() if k != "media"},
+            "media": params.get("media"),
+            "files": {k: (f.filename, len(f.read())) for k, f in request.files.items()},
+            "status": 429 if retry_after else 200,
+        })
+        if retry_after:
+            return jsonify({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }), 429
+        _sent_global.append(now)
+        _sent_chat[str(chat_id)].append(now)
+
+        if method == "sendMessage":
+            return jsonify({"ok": True, "result": _message(chat_id, params)})
+        if method == "sendMediaGroup":
+            media = params.get("media")
+            items = json.loads(media) if isinstance(media, str) else (media or [])
+            return jsonify({"ok": True, "result": [
+                _message(chat_id, item) for item in items
+            ]})
+        if method.startswith("send") and any(
+            f in params or f in request.files for f in MEDIA_FIELDS
+        ):
+            return jsonify({"ok": True, "result": _message(chat_id, params)})
+
+    return jsonify({"ok": False, "error_code": 400,
+                    "description": f"Bad Request: unsupported method {method}"}), 400
+
+
+@app.route("/_calls", methods=["GET"])
+def calls():
+    with _lock:
+        return jsonify(_calls)
+
+
+@app.route("/_reset", methods=["POST"])
+def reset():
+    global _message_id
+    with _lock:
+        _calls.clear()
+        _sent_global.clear()
+        _sent_chat.clear()
+        _message_id = 0
+    return jsonify({"ok": True})
+
+
+if __name__ == "__main__":
+    print(f"Bot API stub on http://127.0.0.1:{STUB_PORT}")
+    app.run(host="127.0.0.1", port=STUB_PORT, threaded=True)
@@ -94,14 +94,130 @@ RETRY_DELAY = 2  # секунд между попытками
 # === Кэш диалогов ===========================================================
 CACHE_WARMUP_INTERVAL = 1800    # полный прогрев каждые 30 мин
 MINI_REFRESH_COOLDOWN = 30      # мини-прогрев не чаще раз в 30 сек
+USERNAME_CACHE_TTL = 86400      # username → (id, access_hash) в реестре, сек
 
 # === FloodWait ===============================================================
 FLOOD_WAIT_AUTO_SWITCH = 60     # если FloodWait > N сек, переключаем на резерв
 
+# === Failover: общий дедлайн запроса =========================================
+# Все попытки (основной аккаунт + резервы) укладываются в один дедлайн,
+# последние BOT_FALLBACK_RESERVE секунд оставляются под Bot API fallback.
+REQUEST_DEADLINE = {
+    "send_text": 120,
+    "send_media": 180,
+}
+FAILOVER_PROBE_TIMEOUT = 15     # resolve entity на резервах (параллельно)
+BOT_FALLBACK_RESERVE = 20       # секунд дедлайна, оставляемых под Bot API
+
+# === Batch endpoints (/send_text/batch, /send_media/batch) ===================
+BATCH_MAX_ITEMS = 500               # максимум элементов в одном батче
+BATCH_ACCOUNT_CONCURRENCY = 3       # одновременных отправок на один аккаунт
+BATCH_ACCOUNT_INTERVAL = 0.3        # мин. пауза между стартами отправок аккаунта (сек)
+BATCH_TIMEOUT = 900                 # общий таймаут обработки батча (сек)
+# /leave_chat/batch: выход тяжёлый (кики), на аккаунт — по одному чату
+LEAVE_BATCH_CONCURRENCY = 1
+LEAVE_BATCH_INTERVAL = 2.0          # пауза между чатами одного аккаунта (сек)
+LEAVE_BATCH_JOB_TTL = 86400         # сколько хранить результаты задания (сек)
+
+# === leave_chat: удаление участников =========================================
+# Пауза между киками подстраивается под FloodWait: растёт вдвое при флуде,
+# плавно уменьшается при успехах (в пределах MIN..MAX).
+LEAVE_KICK_INTERVAL_MIN = 0.1
+LEAVE_KICK_INTERVAL_MAX = 5.0
+LEAVE_KICK_MAX_FLOOD = 60           # FloodWait дольше — прерываем (сек)
+# Чат, созданный нашим аккаунтом, удалять одним DeleteChannelRequest
+# вместо киков (в запросе можно переопределить "delete_if_creator")
+LEAVE_DELETE_IF_CREATOR = os.environ.get("LEAVE_DELETE_IF_CREATOR", "0") == "1"
+# Синхронный /leave_chat ждёт LEAVE_SYNC_TIMEOUT + LEAVE_SYNC_PER_MEMBER на
+# участника; чат больше LEAVE_SYNC_MAX_PARTICIPANTS уходит в фоновый выход (202)
+LEAVE_SYNC_TIMEOUT = 60             # сек
+LEAVE_SYNC_PER_MEMBER = 1.0         # сек на кик (с паузами и FloodWait)
+LEAVE_SYNC_MAX_PARTICIPANTS = 200
+
+# === leave_chat: фоновый выход ===============================================
+# "background": true в запросе (или LEAVE_BACKGROUND=1 по умолчанию) —
+# чат сразу помечается 'leaving', ответ 202, кики и выход идут в фоне.
+LEAVE_BACKGROUND = os.environ.get("LEAVE_BACKGROUND", "0") == "1"
+LEAVE_TASK_MAX_ATTEMPTS = 6
+LEAVE_TASK_BACKOFF_BASE = 30        # сек, удваивается с каждой попыткой
+LEAVE_TASK_BACKOFF_MAX = 1800
+LEAVE_TASK_POLL = 5.0               # как часто проверять очередь (сек)
+LEAVE_TASK_HEARTBEAT = 30           # выполняющаяся задача обновляет updated_at (сек)
+LEAVE_TASK_STALE_AFTER = 120        # без heartbeat'а дольше — задача снова в очередь
+
+# === Idempotency-Key ========================================================
+IDEMPOTENCY_TTL = 86400             # сколько хранить ответ по ключу (сек)
+IDEMPOTENCY_CACHE_SIZE = 5000       # размер LRU в памяти
+IDEMPOTENCY_WAIT_TIMEOUT = 300      # сколько дубль ждёт in-flight запрос (сек)
+
+# === Кэш загруженных медиа (send_media) ======================================
+# Файл, уже отправленный аккаунтом, повторно не качается и не загружается:
+# переиспользуем InputPhoto/InputDocument (id, access_hash, file_reference).
+MEDIA_CACHE_TTL = 30 * 86400        # сколько хранить хэндл (сек); ключ url: — не дольше MEDIA_SPOOL_REVALIDATE_AFTER
+MEDIA_CACHE_SIZE = 2000             # записей в памяти
+TG_POST_CACHE_TTL = 3600            # медиа поста t.me/<канал>/<id> — без GetMessages (сек)
+TG_POST_CACHE_SIZE = 1000
+MEDIA_PREPARE_CONCURRENCY = 4       # файлов, готовящихся одновременно на одном аккаунте
+
+# === Загрузка медиа по URL (стриминг в Telegram) ============================
+UPLOAD_PART_SIZE = 512 * 1024       # размер части SaveFilePart (макс. у Telegram)
+UPLOAD_BUFFER_PARTS = 8             # кусков в очереди скачивание→загрузка (~4 MB)
+DOWNLOAD_CONNECT_TIMEOUT = 10       # сек
+DOWNLOAD_READ_TIMEOUT = 60          # сек между байтами
+UPLOAD_WORKERS = 4                  # доп. соединений на аккаунт для файлов > 10 MB (1 — выкл.)
+UPLOAD_PART_TIMEOUT = 60            # таймаут одной части на доп. соединении (сек)
+UPLOAD_DOWNLOAD_THREADS = 16        # потоков чтения HTTP-тел (отдельно от default executor)
+
+# === Дисковый кэш скачанных медиа (spool) ====================================
+# Файлы по URL хранятся по sha256 содержимого; повторная отправка того же URL
+# не качает файл заново (ETag / Last-Modified ревалидация). 0 — выключено.
+# По умолчанию — рядом с БД реестра (абсолютный путь, не зависит от cwd)
+MEDIA_SPOOL_DIR = os.environ.get(
+    "MEDIA_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "media_spool"),
+)
+MEDIA_SPOOL_MAX_BYTES = int(os.environ.get("MEDIA_SPOOL_MAX_BYTES", 5 * 1024 ** 3))
+MEDIA_SPOOL_REVALIDATE_AFTER = 600  # сек: свежая запись используется без запроса к хосту
+
+# === Старт процесса ==========================================================
+# Порты открываются сразу; пока у сервиса нет ни одного здорового bridge'а,
+# запросы получают 503 {"status": "starting"} с этим Retry-After.
+STARTUP_RETRY_AFTER = 10            # сек
+STARTUP_TIMEOUT = 300               # преемник при reload ждёт старта пула (сек)
+
+# === Graceful reload (SIGHUP / systemctl reload) ============================
+RELOAD_DRAIN_TIMEOUT = 200          # ждём in-flight запросы старого процесса (сек)
+RELOAD_SUCCESSOR_TIMEOUT = 600      # преемник должен стать готовым за N сек
+
+# === Пул заготовленных групп (create_chat) ===================================
+# Фоновый провизионер держит у каждого аккаунта CREATE_POOL_SIZE готовых
+# супергрупп (история открыта, участники из CREATE_POOL_MEMBERS добавлены,
+# боты повышены, AMO observer приглашён, invite-ссылка выгружена).
+# /create_chat тогда только переименовывает группу и приглашает клиента.
+CREATE_POOL_SIZE = int(os.environ.get("CREATE_POOL_SIZE", "0"))   # 0 — выключено
+CREATE_POOL_MEMBERS = [
+    u.strip() for u in os.environ.get("CREATE_POOL_MEMBERS", "@alex_rumhelp_bot").split(",")
+    if u.strip()
+]
+CREATE_POOL_TITLE = "Новый чат"        # название заготовки до переименования
+# Пул не пополняется, если аккаунт за 24 часа уже создал столько супергрупп
+# (считаются и заготовки, и обычные create_chat)
+CREATE_POOL_DAILY_QUOTA = 10
+CREATE_POOL_INTERVAL = 120             # период проверки пула (сек)
+CREATE_POOL_IDLE = 120                 # «тихо» — столько сек без create_chat на аккаунте
+CREATE_POOL_HOURS = os.environ.get("CREATE_POOL_HOURS", "")  # "1-7" — только в эти часы
+
 # === Dashboard ===============================================================
 DASHBOARD_USER = os.environ.get("MONITOR_USER", "admin")
 DASHBOARD_PASS = os.environ.get("MONITOR_PASS", "telethon2026")
 
+# === Metrics (GET /metrics на порту дашборда) ================================
+METRICS_LOOP_LAG_INTERVAL = 1.0     # как часто мерить задержку event loop (сек)
+METRICS_LOOP_LAG_WARN = 0.5         # лаг больше — warning в лог (сек)
+
+# === Tracing (Server-Timing + медленные запросы в дашборде) ==================
+TRACE_KEEP_SLOWEST = 50             # сколько самых медленных трейсов хранить
+TRACE_MAX_SPANS = 300               # span'ов на трейс (батчи), остальное — dropped
+
 # === AMO CRM Observer ========================================================
 # Этот аккаунт добавляется во ВСЕ чаты (даже созданные бэкапами),
 # чтобы AmoCRM видела переписки.
@@ -114,10 +230,31 @@ SALEBOT_CALLBACK_URL = os.environ.get(
 )
 SALEBOT_GROUP_ID = os.environ.get("SALEBOT_GROUP_ID", "alex_rumhelp_bot")
 
+# === Доставка исходящих webhook'ов (core/delivery.py) ========================
+DELIVERY_WORKERS = 4            # потоков-отправителей
+DELIVERY_PER_DESTINATION = 2    # одновременных запросов на один хост
+DELIVERY_TIMEOUT = 15           # таймаут запроса (сек)
+DELIVERY_MAX_ATTEMPTS = 8       # после — в failed_requests (ручной повтор)
+DELIVERY_BACKOFF_BASE = 2       # сек, пауза растёт как 2^n с jitter
+DELIVERY_BACKOFF_MAX = 600      # сек
+
 # === Bot API Fallback ========================================================
 # Токен бота @alex_rumhelp_bot — используется как fallback для отправки
 # сообщений, когда все Telethon-аккаунты недоступны (бан, FloodWait и т.д.)
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "8509333133:AAGYhLFHc1YYl5uyLB1gui5rDHzkYOE0nS4")
+# Адрес Bot API (для локальной заглушки: BOT_API_BASE=http://127.0.0.1:8081,
+# см. bot_api_stub.py)
+BOT_API_BASE = os.environ.get("BOT_API_BASE", "https://api.telegram.org")
+BOT_API_POOL_SIZE = 16          # keep-alive соединений к Bot API
+BOT_API_CONNECT_TIMEOUT = 5     # сек
+BOT_API_READ_TIMEOUT = 30       # сек (загрузка файлов — BOT_API_UPLOAD_TIMEOUT)
+BOT_API_UPLOAD_TIMEOUT = 120    # сек
+BOT_API_CONNECT_RETRIES = 2     # повторы только при ошибке соединения
+# Лимиты Bot API: сверх них сообщения ждут своей очереди, а не падают в 429
+BOT_API_GLOBAL_PER_SEC = 30     # сообщений в секунду на бота
+BOT_API_CHAT_INTERVAL = 1.0     # мин. пауза между сообщениями в один чат (сек)
+BOT_API_GROUP_PER_MINUTE = 20   # сообщений в минуту в одну группу
+BOT_API_MAX_QUEUE_WAIT = 15     # дольше ждать слот/retry_after не будем (сек)
 
 # === Logging =================================================================
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+core/batch.py — Пакетное выполнение задач, сгруппированных по аккаунту.
+
+Задачи разных bridge'ей идут параллельно. Внутри одного bridge —
+не больше BATCH_ACCOUNT_CONCURRENCY одновременно и не чаще одного
+старта в BATCH_ACCOUNT_INTERVAL секунд, чтобы батч не ловил FloodWait.
+Лимиты общие для всех одновременных батчей (ключ = имя bridge).
+
+timeout — дедлайн всего батча: элементы, не успевшие стартовать, не
+выполняются вовсе, выполняющиеся отменяются; вместо результата у них
+DeadlineExceeded (started показывает, мог ли элемент успеть отработать).
+Так батч всегда возвращает частичные результаты, а не висит в loop'е.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger("core.batch")
+
+# (индекс элемента в батче, фабрика корутины)
+Job = Tuple[int, Callable[[], Awaitable[Any]]]
+
+
+class DeadlineExceeded(Exception):
+    """Элемент не уложился в дедлайн батча."""
+
+    def __init__(self, started: bool):
+        self.started = started
+        super().__init__(
+            "batch deadline exceeded, result unknown" if started
+            else "batch deadline exceeded, not started"
+        )
+
+
+class _Pacer:
+    """Минимальный интервал между стартами задач одного bridge."""
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self._interval <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            if start > now:
+                await asyncio.sleep(start - now)
+            self._next_start = start + self._interval
+
+
+class _AccountLimit:
+    def __init__(self, concurrency: int, interval: float):
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.pacer = _Pacer(interval)
+
+
+_limits: Dict[str, _AccountLimit] = {}
+
+
+def _get_limit(key: str, concurrency: int, interval: float) -> _AccountLimit:
+    limit = _limits.get(key)
+    if limit is None:
+        limit = _AccountLimit(concurrency, interval)
+        _limits[key] = limit
+    return limit
+
+
+async def run_grouped(groups: Dict[str, List[Job]],
+                      concurrency: Optional[int] = None,
+                      interval: Optional[float] = None,
+                      timeout: Optional[float] = None) -> Dict[int, Any]:
+    """
+    Выполнить задачи, сгруппированные по ключу bridge'а.
+    Возвращает {index: результат}; исключение задачи кладётся вместо результата.
+    """
+    if concurrency is None:
+        concurrency = config.BATCH_ACCOUNT_CONCURRENCY
+    if interval is None:
+        interval = config.BATCH_ACCOUNT_INTERVAL
+    deadline = time.monotonic() + timeout if timeout else None
+
+    results: Dict[int, Any] = {}
+
+    async def _run_item(limit: _AccountLimit, index: int, factory, started: List[bool]):
+        async with limit.semaphore:
+            await limit.pacer.wait()
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            started[0] = True
+            try:
+                results[index] = await factory()
+            except Exception as e:
+                logger.warning("Batch item %d failed: %s: %s", index, type(e).__name__, e)
+                results[index] = e
+
+    async def _one(limit: _AccountLimit, index: int, factory):
+        started = [False]
+        if deadline is None:
+            await _run_item(limit, index, factory, started)
+            return
+        try:
+            await asyncio.wait_for(_run_item(limit, index, factory, started),
+                                   max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        if index not in results:
+            results[index] = DeadlineExceeded(started[0])
+
+    tasks = []
+    for key, jobs in groups.items():
+        limit = _get_limit(key, concurrency, interval)
+        for index, factory in jobs:
+            tasks.append(_one(limit, index, factory))
+
+    logger.info("Batch: %d items across %d accounts", len(tasks), len(groups))
+    await asyncio.gather(*tasks)
+    return results
@@ -5,18 +5,180 @@ core/bot_fallback.py — Fallback через Telegram Bot API.
 Когда все Telethon-аккаунты недоступны (бан, FloodWait, ошибки),
 отправляем сообщение через @alex_rumhelp_bot, который всегда есть в группах.
 
-Используется стандартный HTTP Bot API: https://api.telegram.org/bot<token>/...
+Используется стандартный HTTP Bot API: <BOT_API_BASE>/bot<token>/...
+
+Все вызовы идут через одну requests.Session с пулом keep-alive соединений:
+TCP/TLS-рукопожатие делается один раз, а не на каждый вызов. Повторяются
+только ошибки установки соединения — запрос до сервера не дошёл, дубля
+сообщения не будет.
+
+Отправки проходят через RateLimiter: общий лимит бота, пауза между
+сообщениями в один чат и лимит в минуту для групп. Лишние вызовы ждут
+свой слот (FIFO), 429 с retry_after блокирует чат на указанное время и
+запрос повторяется. Дольше BOT_API_MAX_QUEUE_WAIT не ждём — BotApiError.
 """
+import bisect
+import json
 import logging
-from typing import Any, Dict, List, Optional
+import math
+import mimetypes
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Dict, List, NamedTuple, Optional
 
 import requests as http_requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import config
+from core import metrics
 
 logger = logging.getLogger("core.bot_fallback")
 
-_BASE = "https://api.telegram.org/bot{token}"
+_session: Optional[http_requests.Session] = None
+_session_lock = threading.Lock()
+
+# Лимиты Bot API на загрузку файла через multipart
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+MAX_PHOTO_SIZE = 10 * 1024 * 1024
+MAX_GROUP_SIZE = 10   # элементов в sendMediaGroup
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".webm", ".mkv")
+
+
+class BotApiError(RuntimeError):
+    """Ошибка Bot API (ok=false). retry_after — для 429."""
+
+    def __init__(self, description: str, error_code: int = 0,
+                 retry_after: Optional[float] = None):
+        super().__init__(f"Bot API error: {description}")
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+# === Лимиты Bot API ===========================================================
+
+class RateLimiter:
+    """
+    Резервирование слотов отправки. Каждый вызов получает ближайшее время,
+    при котором не нарушен ни один лимит, и спит до него — очередь FIFO
+    без отдельного потока.
+    """
+
+    WINDOW = 60.0  # сколько истории слотов хранить (сек)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global: List[float] = []
+        self._chats: Dict[str, List[float]] = defaultdict(list)
+        self._blocked: Dict[str, float] = {}
+
+    @staticmethod
+    def _fit(slots: List[float], t: float, limit: int, window: float,
+             need: int) -> float:
+        """Сдвинуть t, пока хоть в одном окне длиной window, содержащем t,
+        нет места под need слотов.
+
+        Проверяются окна (e - window, e] с концом в t и в каждом уже
+        забронированном слоте из (t, t + window): слоты, выданные раньше,
+        могут лежать позже t (блокировка чата, интервал чата).
+        """
+        if limit <= 0:
+            return t
+        need = min(need, limit)
+        while True:
+            ends = [t] + slots[bisect.bisect_right(slots, t):
+                               bisect.bisect_left(slots, t + window)]
+            for e in ends:
+                lo = bisect.bisect_right(slots, e - window)
+                hi = bisect.bisect_right(slots, e)
+                if hi - lo + need <= limit:
+                    continue
+                if e == t:
+                    # Ждём, пока из окна выйдет достаточно старых слотов
+                    t = slots[hi - limit + need - 1] + window
+                else:
+                    # Окно с концом в e полное при любом t из (e - window, e]
+                    t = math.nextafter(e, math.inf)
+                break
+            else:
+                return t
+
+    def _slot(self, chat: str, now: float, weight: int) -> float:
+        chat_slots = self._chats[chat]
+        is_group = chat.startswith("-")
+        t = max(now, self._blocked.get(chat, 0.0))
+        while True:
+            start = t
+            if chat_slots and config.BOT_API_CHAT_INTERVAL > 0:
+                t = max(t, chat_slots[-1] + config.BOT_API_CHAT_INTERVAL)
+            if is_group:
+                t = self._fit(chat_slots, t, config.BOT_API_GROUP_PER_MINUTE, 60.0, weight)
+            t = self._fit(self._global, t, config.BOT_API_GLOBAL_PER_SEC, 1.0, weight)
+            if t == start:
+                return t
+
+    def _prune(self, now: float):
+        edge = now - self.WINDOW
+        del self._global[:bisect.bisect_right(self._global, edge)]
+        for chat in list(self._chats):
+            slots = self._chats[chat]
+            del slots[:bisect.bisect_right(slots, edge)]
+            if not slots:
+                del self._chats[chat]
+        for chat, until in list(self._blocked.items()):
+            if until <= now:
+                del self._blocked[chat]
+
+    def acquire(self, chat_id: Any, weight: int = 1,
+                max_wait: Optional[float] = None) -> float:
+        """Дождаться слота для weight сообщений (альбом) в чат. Возвращает ожидание."""
+        if max_wait is None:
+            max_wait = config.BOT_API_MAX_QUEUE_WAIT
+        chat = str(chat_id)
+        weight = max(1, weight)
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            t = self._slot(chat, now, weight)
+            if t - now > max_wait:
+                raise BotApiError(
+                    f"rate limit queue for {chat} is full (wait {t - now:.1f}s)", 429,
+                )
+            for _ in range(weight):
+                bisect.insort(self._global, t)
+                bisect.insort(self._chats[chat], t)
+        wait = t - now
+        if wait > 0:
+            logger.info("Bot API rate limit: %s queued for %.2fs", chat, wait)
+            time.sleep(wait)
+        return wait
+
+    def block(self, chat_id: Any, seconds: float):
+        """429 от сервера: не слать в чат seconds секунд."""
+        chat = str(chat_id)
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._blocked[chat] = max(self._blocked.get(chat, 0.0), until)
+
+    def queued(self) -> int:
+        """Сколько зарезервированных слотов ещё впереди."""
+        with self._lock:
+            now = time.monotonic()
+            return len(self._global) - bisect.bisect_right(self._global, now)
+
+
+limiter = RateLimiter()
+
+# Вызовы из event loop'а идут сюда, а не в default executor: ожидание слота
+# (time.sleep в acquire) не должно занимать потоки, нужные остальному коду
+executor = ThreadPoolExecutor(max_workers=config.BOT_API_POOL_SIZE,
+                              thread_name_prefix="bot-fallback")
 
 
 def is_configured() -> bool:
@@ -25,21 +187,111 @@ def is_configured() -> bool:
 
 
 def _api_url(method: str) -> str:
-    return f"{_BASE.format(token=config.BOT_TOKEN)}/{method}"
-
-
-def _call(method: str, data: dict, timeout: int = 30) -> Dict[str, Any]:
-    """Вызов Bot API метода. Возвращает response JSON."""
+    return f"{config.BOT_API_BASE.rstrip('/')}/bot{config.BOT_TOKEN}/{method}"
+
+
+def _get_session() -> http_requests.Session:
+    """Общая сессия с пулом соединений (создаётся при первом вызове)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=config.BOT_API_CONNECT_RETRIES,
+                connect=config.BOT_API_CONNECT_RETRIES,
+                read=0, status=0, other=0,
+                backoff_factor=0.3,
+                respect_retry_after_header=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=config.BOT_API_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = http_requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def close():
+    """Закрыть keep-alive соединения (остановка процесса)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _post(method: str, read_timeout: float, **kwargs) -> Dict[str, Any]:
     url = _api_url(method)
-    resp = http_requests.post(url, json=data, timeout=timeout)
-    result = resp.json()
+    resp = _get_session().post(
+        url, timeout=(config.BOT_API_CONNECT_TIMEOUT, read_timeout), **kwargs,
+    )
+    try:
+        result = resp.json()
+    except ValueError:
+        raise BotApiError(f"HTTP {resp.status_code} (non-JSON response)", resp.status_code)
     if not result.get("ok"):
         desc = result.get("description", "Unknown error")
+        retry_after = (result.get("parameters") or {}).get("retry_after")
         logger.error("Bot API %s failed: %s", method, desc)
-        raise RuntimeError(f"Bot API error: {desc}")
+        raise BotApiError(desc, result.get("error_code", resp.status_code), retry_after)
     return result
 
 
+def _send(method: str, chat_id: Any, read_timeout: float, weight: int = 1,
+          **kwargs) -> Dict[str, Any]:
+    """_post через лимитер; 429 — ждём retry_after и повторяем, пока влезаем в очередь."""
+    started = time.monotonic()
+    try:
+        result = _send_limited(method, chat_id, read_timeout, weight, started, **kwargs)
+    except Exception:
+        metrics.BOT_API_TOTAL.inc(method, "error")
+        raise
+    finally:
+        metrics.BOT_API_DURATION.observe(method, value=time.monotonic() - started)
+    metrics.BOT_API_TOTAL.inc(method, "ok")
+    return result
+
+
+def _send_limited(method: str, chat_id: Any, read_timeout: float, weight: int,
+                  started: float, **kwargs) -> Dict[str, Any]:
+    while True:
+        left = config.BOT_API_MAX_QUEUE_WAIT - (time.monotonic() - started)
+        limiter.acquire(chat_id, weight, max_wait=max(0.0, left))
+        try:
+            return _post(method, read_timeout, **kwargs)
+        except BotApiError as e:
+            if e.error_code != 429 or not e.retry_after:
+                raise
+            logger.warning("Bot API 429 for %s: retry after %ss", chat_id, e.retry_after)
+            limiter.block(chat_id, float(e.retry_after))
+            files = kwargs.get("files") or {}
+            for f in files.values():  # multipart — перечитать файл заново
+                if isinstance(f, tuple) and hasattr(f[1], "seek"):
+                    f[1].seek(0)
+
+
+def _call(method: str, data: dict, timeout: Optional[float] = None,
+          weight: int = 1) -> Dict[str, Any]:
+    """Вызов Bot API метода. Возвращает response JSON."""
+    return _send(
+        method, data.get("chat_id"), timeout or config.BOT_API_READ_TIMEOUT,
+        weight, json=data,
+    )
+
+
+def _call_multipart(method: str, data: dict, files: dict,
+                    timeout: Optional[float] = None,
+                    weight: int = 1) -> Dict[str, Any]:
+    """Вызов Bot API метода с загрузкой файла (multipart/form-data)."""
+    return _send(
+        method, data.get("chat_id"), timeout or config.BOT_API_UPLOAD_TIMEOUT,
+        weight, data=data, files=files,
+    )
+
+
 def send_text(
     chat_id: Any,
     text: str,
@@ -158,12 +410,189 @@ def send_media_by_url(
     Универсальная отправка медиа по URL.
     Пытаемся определить тип по расширению, если не получается — отправляем как документ.
     """
-    url_lower = file_url.lower().split("?")[0]
+    kind = _media_kind(file_url, force_document=force_document)
+    if kind == "photo":
+        return send_photo(chat_id, file_url, caption, parse_mode)
+    if kind == "video":
+        return send_video(chat_id, file_url, caption, parse_mode)
+    return send_document(chat_id, file_url, caption, parse_mode)
 
-    if not force_document:
-        if any(url_lower.endswith(ext) for ext in (".jpg", ".jpeg", ".png", ".gif", ".webp")):
-            return send_photo(chat_id, file_url, caption, parse_mode)
-        if any(url_lower.endswith(ext) for ext in (".mp4", ".mov", ".m4v", ".webm", ".mkv")):
-            return send_video(chat_id, file_url, caption, parse_mode)
 
-    return send_document(chat_id, file_url, caption, parse_mode)
+def send_media_file(
+    chat_id: Any,
+    path: str,
+    filename: str,
+    mime_type: str = "",
+    caption: str = "",
+    parse_mode: str = "HTML",
+    force_document: bool = False,
+) -> Dict[str, Any]:
+    """
+    Отправить локальный файл (например, из дискового спула) через Bot API.
+    Нужна, когда Telegram не может сам скачать URL. Тип — по mime_type.
+    """
+    if not is_configured():
+        raise RuntimeError("Bot token not configured")
+
+    kind = _media_kind(filename, mime_type, force_document, os.path.getsize(path))
+    method = {"photo": "sendPhoto", "video": "sendVideo"}.get(kind, "sendDocument")
+
+    data = {"chat_id": str(chat_id)}
+    if caption:
+        data["caption"] = caption
+        data["parse_mode"] = parse_mode.upper() if parse_mode else "HTML"
+
+    logger.info(
+        "Bot fallback %s (upload) to %s: %s (%d bytes)",
+        method, chat_id, filename, os.path.getsize(path),
+    )
+    with open(path, "rb") as f:
+        result = _call_multipart(
+            method, data, {kind: (filename, f, mime_type or "application/octet-stream")},
+        )
+    msg = result.get("result", {})
+    logger.info("Bot fallback %s OK: message_id=%s", method, msg.get("message_id"))
+    return msg
+
+
+# === Альбомы ==================================================================
+
+class MediaItem(NamedTuple):
+    """Файл для send_media: url (Telegram скачает сам) или path (загрузка).
+
+    path с url — файл из спула; если его успели вытеснить, уходит url.
+    """
+    url: Optional[str] = None
+    path: Optional[str] = None
+    filename: str = ""
+    mime_type: str = ""
+    force_document: bool = False
+
+
+def _media_kind(name: str, mime_type: str = "", force_document: bool = False,
+                size: Optional[int] = None) -> str:
+    """photo / video / document — по расширению, затем по MIME."""
+    if force_document:
+        return "document"
+    low = name.lower().split("?")[0]
+    mime_type = mime_type or mimetypes.guess_type(low)[0] or ""
+    if low.endswith(PHOTO_EXTENSIONS) or (mime_type.startswith("image/")
+                                          and mime_type != "image/gif"):
+        if size is not None and size > MAX_PHOTO_SIZE:
+            return "document"
+        return "photo"
+    if low.endswith(VIDEO_EXTENSIONS) or mime_type.startswith("video/"):
+        return "video"
+    return "document"
+
+
+def _item_kind(item: MediaItem) -> str:
+    if item.path:
+        return _media_kind(item.filename or item.path, item.mime_type,
+                           item.force_document, os.path.getsize(item.path))
+    return _media_kind(item.url, item.mime_type, item.force_document)
+
+
+def _group_items(items: List[MediaItem]) -> List[List[MediaItem]]:
+    """Соседние совместимые файлы — в альбомы до MAX_GROUP_SIZE.
+
+    Фото и видео смешиваются, документы идут только с документами.
+    """
+    groups: List[List[MediaItem]] = []
+    last_visual = None
+    for item in items:
+        visual = _item_kind(item) != "document"
+        if groups and visual == last_visual and len(groups[-1]) < MAX_GROUP_SIZE:
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+        last_visual = visual
+    return groups
+
+
+def send_media_group(
+    chat_id: Any,
+    items: List[MediaItem],
+    caption: str = "",
+    parse_mode: str = "HTML",
+) -> List[Dict[str, Any]]:
+    """
+    Альбом одним вызовом sendMediaGroup (2–10 файлов). Локальные файлы
+    уходят multipart'ом (attach://), URL — как есть. Подпись — у первого.
+    """
+    if not is_configured():
+        raise RuntimeError("Bot token not configured")
+
+    chat = int(chat_id) if str(chat_id).lstrip("-").isdigit() else chat_id
+    with ExitStack() as stack:
+        media, files = [], {}
+        for i, item in enumerate(items):
+            entry = {"type": _item_kind(item)}
+            if item.path:
+                field = f"file{i}"
+                files[field] = (
+                    item.filename or os.path.basename(item.path),
+                    stack.enter_context(open(item.path, "rb")),
+                    item.mime_type or "application/octet-stream",
+                )
+                entry["media"] = f"attach://{field}"
+            else:
+                entry["media"] = item.url
+            if i == 0 and caption:
+                entry["caption"] = caption
+                entry["parse_mode"] = parse_mode.upper() if parse_mode else "HTML"
+            media.append(entry)
+
+        logger.info(
+            "Bot fallback sendMediaGroup to %s: %d items (%d uploads)",
+            chat_id, len(items), len(files),
+        )
+        if files:
+            result = _call_multipart(
+                "sendMediaGroup", {"chat_id": str(chat), "media": json.dumps(media)},
+                files, weight=len(items),
+            )
+        else:
+            result = _call(
+                "sendMediaGroup", {"chat_id": chat, "media": media}, weight=len(items),
+            )
+    msgs = result.get("result", [])
+    logger.info(
+        "Bot fallback sendMediaGroup OK: message_ids=%s",
+        [m.get("message_id") for m in msgs],
+    )
+    return msgs
+
+
+def send_media(
+    chat_id: Any,
+    items: List[MediaItem],
+    caption: str = "",
+    parse_mode: str = "HTML",
+) -> List[Dict[str, Any]]:
+    """
+    Отправить набор файлов минимальным числом вызовов: совместимые соседние
+    файлы — альбомами (sendMediaGroup), одиночные — sendPhoto/Video/Document.
+    """
+    items = [
+        item._replace(path=None)
+        if item.path and item.url and not os.path.isfile(item.path) else item
+        for item in items
+    ]
+    msgs: List[Dict[str, Any]] = []
+    for n, group in enumerate(_group_items(items)):
+        cap = caption if n == 0 else ""
+        if len(group) > 1:
+            msgs.extend(send_media_group(chat_id, group, cap, parse_mode))
+            continue
+        item = group[0]
+        if item.path:
+            msgs.append(send_media_file(
+                chat_id, item.path, item.filename or os.path.basename(item.path),
+                item.mime_type, cap, parse_mode, item.force_document,
+            ))
+        else:
+            msgs.append(send_media_by_url(
+                chat_id, item.url, cap, parse_mode, item.force_document,
+            ))
+    return msgs
@@ -8,20 +8,85 @@ core/bridge.py — TelethonBridge: обёртка над TelegramClient.
  - кэш диалогов (warmup + mini-refresh)
  - отслеживание здоровья (status, flood_until, error_count)
  - resolve entity по ID / username / chat_id
+ - таблица username → (id, access_hash) в реестре (USERNAME_CACHE_TTL):
+   ResolveUsernameRequest сильно лимитирован, горячие username'ы
+   резолвятся раз в сутки, а не на каждый запрос; если RPC с таким entity
+   падает "peer не найден", run_with_retry инвалидирует запись и повторяет
+   попытку один раз (см. username_hits)
+ - метрики RPC (InstrumentedClient) и источников resolve (core/metrics.py)
 """
 import asyncio
+import os
+import re
 import time
 import logging
-from typing import Any, Dict, Optional
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
 
-from telethon import TelegramClient, functions, types
+from telethon import TelegramClient, errors as tl_errors, functions, types
+from telethon.sessions import SQLiteSession, StringSession
 from telethon.tl.types import PeerChannel, PeerChat, PeerUser
 from telethon.utils import get_peer_id
 
 import config
+from core import metrics, tracing
 
 logger = logging.getLogger("core.bridge")
 
+_USERNAME_RE = re.compile(r"^@?([A-Za-z][A-Za-z0-9_]{3,31})$")
+
+# (bridge, username), отданные из таблицы resolved_usernames в текущей
+# попытке run_with_retry (core/retry.py); None — никто не отслеживает
+username_hits: ContextVar[Optional[List[Tuple["TelethonBridge", str]]]] = ContextVar(
+    "username_hits", default=None,
+)
+
+
+def _username_key(ref: Any) -> Optional[str]:
+    """'@Name' / 'name' → 'name'; для ID, ссылок и прочего — None."""
+    if not isinstance(ref, str):
+        return None
+    m = _USERNAME_RE.match(ref.strip())
+    return m.group(1).lower() if m else None
+
+
+def _request_name(request: Any) -> str:
+    if isinstance(request, list):
+        return "batch"
+    name = type(request).__name__
+    return name[:-7] if name.endswith("Request") else name
+
+
+class InstrumentedClient(TelegramClient):
+    """TelegramClient, считающий каждый RPC: число, латентность, FloodWait.
+
+    Высокоуровневые методы (send_message, get_entity, ...) тоже идут через
+    __call__, так что метка method — реальный TL-запрос.
+    """
+
+    bridge_name = ""
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        method = _request_name(request)
+        result = "ok"
+        started = time.perf_counter()
+        try:
+            with tracing.span("rpc." + method):
+                return await super().__call__(
+                    request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold,
+                )
+        except tl_errors.FloodWaitError as e:
+            result = "flood_wait"
+            metrics.FLOOD_WAIT_SECONDS.inc(self.bridge_name, amount=e.seconds)
+            raise
+        except BaseException:
+            result = "error"
+            raise
+        finally:
+            metrics.RPC_TOTAL.inc(self.bridge_name, method, result)
+            metrics.RPC_DURATION.observe(self.bridge_name, method,
+                                         value=time.perf_counter() - started)
+
 
 class TelethonBridge:
     """Обёртка над одним TelegramClient с кэшем и здоровьем."""
@@ -38,7 +103,8 @@ class TelethonBridge:
     def __init__(self, name: str, session: str, priority: int,
                  loop: asyncio.AbstractEventLoop,
                  api_id: int = None, api_hash: str = None,
-                 account_name: str = "", service: str = ""):
+                 account_name: str = "", service: str = "",
+                 registry=None):
         self.name = name                  # "main:create_chat"
         self.account_name = account_name  # "main"
         self.service = service            # "create_chat"
@@ -47,6 +113,7 @@ class TelethonBridge:
         self._loop = loop
         self.api_id = api_id
         self.api_hash = api_hash
+        self._registry = registry  # ChatRegistry: таблица resolved_usernames
 
         self.client: Optional[TelegramClient] = None
         self.self_user_id: Optional[int] = None
@@ -60,21 +127,30 @@ class TelethonBridge:
         self.operations_count: int = 0
         self.last_active: float = 0.0
 
+        # Доп. соединения для параллельной загрузки файлов (core/uploader.py)
+        self.upload_senders = None
+
         # Dialog cache
         self._dialogs: Dict[int, Any] = {}
         self._last_mini_refresh: float = 0.0
 
     # === Lifecycle ============================================================
 
-    async def start(self):
-        """Подключить клиент и прогреть кэш."""
+    async def start(self, snapshot_session: bool = False):
+        """Подключить клиент и прогреть кэш.
+
+        snapshot_session=True — работать с копией сессии в памяти, не открывая
+        .session файл на запись (его держит предыдущий процесс при reload).
+        """
         self.status = self.STATUS_STARTING
         logger.info("Starting bridge %s (session=%s)", self.name, self.session)
         try:
-            self.client = TelegramClient(
-                self.session, self.api_id, self.api_hash,
+            session = self._snapshot_session() if snapshot_session else self.session
+            self.client = InstrumentedClient(
+                session, self.api_id, self.api_hash,
                 loop=self._loop, catch_up=False,
             )
+            self.client.bridge_name = self.name
             started = self.client.start()
             if asyncio.iscoroutine(started):
                 await started
@@ -96,7 +172,48 @@ class TelethonBridge:
             logger.error("Bridge %s failed to start: %s", self.name, e)
             raise
 
+    def _snapshot_session(self):
+        """StringSession с auth_key из .session файла (или имя файла, если его нет)."""
+        if not os.path.exists(self.session + ".session"):
+            return self.session
+        disk = SQLiteSession(self.session)
+        try:
+            return StringSession(StringSession.save(disk))
+        finally:
+            disk.close()
+
+    def persist_session(self):
+        """Снимок сессии (reload) → в .session файл; клиент переходит на файл.
+
+        Вызывать после выхода предшественника — до этого файл держит он.
+        Ключ/DC, состояние обновлений и накопленные сущности переносятся,
+        иначе следующий рестарт начнёт с устаревшего файла.
+        """
+        mem = self.client.session if self.client is not None else None
+        if not isinstance(mem, StringSession):
+            return
+        disk = SQLiteSession(self.session)
+        disk.set_dc(mem.dc_id, mem.server_address, mem.port)
+        disk.auth_key = mem.auth_key
+        disk.takeout_id = mem.takeout_id
+        # Как SQLiteSession.process_entities: строки (id, hash, username, phone, name, date)
+        now = int(time.time())
+        c = disk._cursor()
+        try:
+            c.executemany("insert or replace into entities values (?,?,?,?,?,?)",
+                          [row + (now,) for row in mem._entities])
+        finally:
+            c.close()
+        for entity_id, state in mem._update_states.items():
+            disk.set_update_state(entity_id, state)
+        disk.save()
+        self.client.session = disk
+        logger.info("Bridge %s: session snapshot saved to %s.session", self.name, self.session)
+
     async def stop(self):
+        if self.upload_senders is not None:
+            await self.upload_senders.close()
+            self.upload_senders = None
         if self.client:
             try:
                 await self.client.disconnect()
@@ -200,9 +317,10 @@ class TelethonBridge:
         self._last_mini_refresh = now
         added = 0
         try:
-            async for d in self.client.iter_dialogs(limit=100):
-                self._add_to_cache(d.entity)
-                added += 1
+            with tracing.span("dialogs_refresh"):
+                async for d in self.client.iter_dialogs(limit=100):
+                    self._add_to_cache(d.entity)
+                    added += 1
             logger.info(
                 "Bridge %s: mini refresh +%d, total=%d",
                 self.name, added, len(self._dialogs),
@@ -240,32 +358,59 @@ class TelethonBridge:
          - str ("@username" / "username" / "-1001234567890")
         С fallback на кэш и mini-refresh.
         """
+        with tracing.span("get_entity"):
+            return await self._get_entity(ref)
+
+    async def _get_entity(self, ref: Any) -> Any:
+        # Уже готовый entity (например, после failover-probe) — не резолвим повторно
+        if isinstance(ref, (types.User, types.Chat, types.Channel)):
+            return ref
+
         # Нормализуем строковый ID в int
         if isinstance(ref, str):
             s = ref.strip()
             if s.lstrip("-").isdigit():
                 ref = int(s)
 
+        # 0. Username из таблицы реестра — без ResolveUsernameRequest
+        uname = _username_key(ref)
+        if uname:
+            known = self._known_username(uname)
+            if known is not None:
+                metrics.ENTITY_RESOLVE.inc(self.name, "username_table")
+                hits = username_hits.get()
+                if hits is not None:
+                    hits.append((self, uname))
+                return known
+
         # 1. Прямой API-вызов
         try:
-            return await self.client.get_entity(ref)
+            ent = await self.client.get_entity(ref)
+            if uname:
+                self._remember_username(uname, ent)
+            metrics.ENTITY_RESOLVE.inc(self.name, "api")
+            return ent
         except (ValueError, KeyError):
             pass
 
         # 2. Кэш
         cached = self._find_in_cache(ref)
         if cached is not None:
+            metrics.ENTITY_RESOLVE.inc(self.name, "cache")
             return cached
 
         # 3. Mini-refresh + кэш
         await self.mini_refresh_cache()
         cached = self._find_in_cache(ref)
         if cached is not None:
+            metrics.ENTITY_RESOLVE.inc(self.name, "refresh")
             return cached
 
         # 4. Ещё раз API (после mini-refresh Telethon знает больше)
         try:
-            return await self.client.get_entity(ref)
+            ent = await self.client.get_entity(ref)
+            metrics.ENTITY_RESOLVE.inc(self.name, "refresh")
+            return ent
         except (ValueError, KeyError):
             pass
 
@@ -279,12 +424,71 @@ class TelethonBridge:
                 mapped = transform(ref)
                 if mapped is not None:
                     try:
-                        return await self.client.get_entity(peer_cls(mapped))
+                        ent = await self.client.get_entity(peer_cls(mapped))
+                        metrics.ENTITY_RESOLVE.inc(self.name, "peer")
+                        return ent
                     except Exception:
                         continue
 
+        metrics.ENTITY_RESOLVE.inc(self.name, "miss")
         raise ValueError(f"Cannot resolve entity {ref} (cache={len(self._dialogs)})")
 
+    # === Username → entity (реестр) ==========================================
+
+    def _known_username(self, uname: str) -> Optional[Any]:
+        if self._registry is None:
+            return None
+        try:
+            row = self._registry.get_resolved_username(
+                self.account_name, uname, max_age=config.USERNAME_CACHE_TTL,
+            )
+        except Exception as e:
+            logger.warning("Bridge %s: username lookup failed: %s", self.name, e)
+            return None
+        if row is None:
+            return None
+        if row["kind"] == "channel":
+            return types.Channel(
+                id=row["entity_id"], title=row["title"], photo=types.ChatPhotoEmpty(),
+                date=None, access_hash=row["access_hash"], username=uname,
+                megagroup=bool(row["megagroup"]), broadcast=not row["megagroup"],
+            )
+        return types.User(
+            id=row["entity_id"], access_hash=row["access_hash"], username=uname,
+            first_name=row["first_name"] or None, last_name=row["last_name"] or None,
+            bot=bool(row["is_bot"]),
+        )
+
+    def _remember_username(self, uname: str, ent: Any):
+        if self._registry is None or getattr(ent, "min", False):
+            return
+        access_hash = getattr(ent, "access_hash", None)
+        if access_hash is None:
+            return
+        if isinstance(ent, types.User):
+            kind = "user"
+        elif isinstance(ent, types.Channel):
+            kind = "channel"
+        else:
+            return
+        try:
+            self._registry.save_resolved_username(
+                self.account_name, uname, kind, ent.id, access_hash,
+                is_bot=bool(getattr(ent, "bot", False)),
+                first_name=getattr(ent, "first_name", "") or "",
+                last_name=getattr(ent, "last_name", "") or "",
+                title=getattr(ent, "title", "") or "",
+                megagroup=bool(getattr(ent, "megagroup", False)),
+            )
+        except Exception as e:
+            logger.warning("Bridge %s: failed to store username %s: %s", self.name, uname, e)
+
+    def forget_username(self, ref: str):
+        """Инвалидировать username (сменил владельца, access_hash не подходит)."""
+        uname = _username_key(ref)
+        if uname and self._registry is not None:
+            self._registry.delete_resolved_username(uname, self.account_name)
+
     def _find_in_cache(self, ref) -> Optional[Any]:
         if isinstance(ref, int):
             ent = self._dialogs.get(ref)
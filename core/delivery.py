@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+core/delivery.py — Надёжная доставка исходящих webhook'ов (Salebot callback).
+
+enqueue() кладёт задачу в таблицу outbound_queue реестра и сразу
+возвращается. Фиксированный пул из DELIVERY_WORKERS потоков забирает
+задачи по next_attempt_at:
+ - у каждого потока своя requests.Session (keep-alive к получателю);
+ - не больше DELIVERY_PER_DESTINATION одновременных запросов на один хост;
+ - 2xx — задача удаляется; 408/429/5xx/сетевые ошибки — повтор через
+   экспоненциальную паузу с jitter; прочие 4xx и исчерпанные попытки —
+   запись в failed_requests (ручной повтор из дашборда, как раньше).
+
+Очередь переживает рестарт и graceful reload: задачи, зависшие в
+'inflight' у умершего процесса, возвращаются в работу по таймауту.
+При reload воркеры преемника стартуют только после выхода предшественника
+(см. app.py), поэтому два процесса не разбирают очередь одновременно.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests as http_requests
+
+import config
+from core.registry import ChatRegistry
+
+logger = logging.getLogger("core.delivery")
+
+
+def _destination(url: str) -> str:
+    return urlparse(url).netloc or url
+
+
+def backoff_delay(attempt: int) -> float:
+    """Пауза перед попыткой attempt (1, 2, ...): full jitter поверх 2^n."""
+    cap = min(config.DELIVERY_BACKOFF_MAX, config.DELIVERY_BACKOFF_BASE * (2 ** (attempt - 1)))
+    return random.uniform(cap / 2, cap)
+
+
+class DeliveryQueue:
+    """Пул воркеров поверх таблицы outbound_queue."""
+
+    def __init__(self, registry: ChatRegistry, workers: Optional[int] = None):
+        self._registry = registry
+        self._workers_count = workers or config.DELIVERY_WORKERS
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._local = threading.local()
+        # Занятость по хостам (ограничение одновременных запросов)
+        self._busy: Dict[str, int] = defaultdict(int)
+        self._busy_lock = threading.Lock()
+
+    # === Lifecycle ============================================================
+
+    def start(self):
+        recovered = self._registry.requeue_stale_deliveries(
+            time.time() - 2 * config.DELIVERY_TIMEOUT,
+        )
+        if recovered:
+            logger.info("Delivery: %d stale in-flight jobs requeued", recovered)
+        for i in range(self._workers_count):
+            t = threading.Thread(target=self._worker, name=f"delivery-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 20):
+        """Дождаться текущих запросов; невзятые задачи остаются в таблице."""
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+
+    # === Очередь ==============================================================
+
+    def enqueue(self, url: str, payload: Dict[str, Any], service: str = "") -> int:
+        job_id = self._registry.enqueue_delivery(
+            service, url, _destination(url), json.dumps(payload, ensure_ascii=False),
+        )
+        self._wakeup.set()
+        return job_id
+
+    def _full_destinations(self) -> List[str]:
+        return [d for d, n in self._busy.items() if n >= config.DELIVERY_PER_DESTINATION]
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        with self._busy_lock:
+            full = self._full_destinations()
+            job = self._registry.claim_delivery(time.time(), exclude_destinations=full)
+            if job is not None:
+                self._busy[job["destination"]] += 1
+        return job
+
+    def _release(self, destination: str):
+        with self._busy_lock:
+            self._busy[destination] -= 1
+            if self._busy[destination] <= 0:
+                del self._busy[destination]
+        self._wakeup.set()  # освободился слот хоста — кто-то может брать задачу
+
+    # === Воркер ===============================================================
+
+    def _session(self) -> http_requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = http_requests.Session()
+            self._local.session = session
+        return session
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error("Delivery: claim failed: %s", e)
+                job = None
+            if job is None:
+                # Готовые задачи занятых хостов не в счёт: их разбудит _release()
+                with self._busy_lock:
+                    full = self._full_destinations()
+                wait = self._registry.next_delivery_in(time.time(), exclude_destinations=full)
+                self._wakeup.wait(timeout=min(wait, 5.0) if wait is not None else 5.0)
+                self._wakeup.clear()
+                continue
+            try:
+                self._deliver(job)
+            except Exception as e:
+                logger.error("Delivery #%d crashed: %s", job["id"], e)
+            finally:
+                self._release(job["destination"])
+
+    def _deliver(self, job: Dict[str, Any]):
+        attempt = job["attempts"] + 1
+        payload = json.loads(job["payload"])
+        error, retriable = None, True
+        try:
+            resp = self._session().post(
+                job["url"], json=payload, timeout=config.DELIVERY_TIMEOUT,
+            )
+            if resp.status_code < 300:
+                self._registry.complete_delivery(job["id"])
+                logger.info(
+                    "Delivery #%d (%s) OK: status=%s attempt=%d body=%s",
+                    job["id"], job["service"], resp.status_code, attempt, resp.text[:200],
+                )
+                return
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            retriable = resp.status_code in (408, 429) or resp.status_code >= 500
+        except http_requests.RequestException as e:
+            error = str(e)
+
+        if retriable and attempt < config.DELIVERY_MAX_ATTEMPTS:
+            delay = backoff_delay(attempt)
+            self._registry.retry_delivery(job["id"], attempt, time.time() + delay, error)
+            logger.warning(
+                "Delivery #%d (%s) failed (attempt %d/%d), retry in %.0fs: %s",
+                job["id"], job["service"], attempt, config.DELIVERY_MAX_ATTEMPTS, delay, error,
+            )
+            return
+
+        logger.error("Delivery #%d (%s) gave up after %d attempts: %s",
+                     job["id"], job["service"], attempt, error)
+        self._registry.complete_delivery(job["id"])
+        try:
+            self._registry.save_failed_request(
+                service=job["service"], endpoint=job["url"],
+                request_payload=payload, error=error,
+                direction="outbound",
+            )
+        except Exception:
+            pass
+
+
+_queue: Optional[DeliveryQueue] = None
+
+
+def init(registry: ChatRegistry):
+    """Очередь без воркеров: enqueue() уже работает, разбор — после start()."""
+    global _queue
+    _queue = DeliveryQueue(registry)
+
+
+def start():
+    if _queue is not None:
+        _queue.start()
+
+
+def enqueue(url: str, payload: Dict[str, Any], service: str = "") -> int:
+    if _queue is None:
+        raise RuntimeError("delivery queue is not initialized")
+    return _queue.enqueue(url, payload, service)
+
+
+def stop():
+    if _queue is not None:
+        _queue.stop()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+core/failover.py — Failover с общим дедлайном запроса.
+
+Вместо последовательных попыток по 120 сек на каждый резервный аккаунт:
+  1. Идемпотентный шаг (resolve entity) запускается сразу на ВСЕХ кандидатах.
+  2. Неидемпотентный шаг (сама отправка) выполняется на первом кандидате,
+     который успешно ответил на probe; если он упал — на следующем.
+  3. Каждая попытка ограничена остатком общего дедлайна (Deadline).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import config
+from core.bridge import TelethonBridge
+
+logger = logging.getLogger("core.failover")
+
+
+class Deadline:
+    """Общий бюджет времени одного запроса (monotonic)."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, cap: Optional[float] = None, reserve: float = 0.0) -> float:
+        """Сколько можно дать очередной попытке: min(cap, остаток - резерв)."""
+        left = self.remaining() - reserve
+        if cap is not None:
+            left = min(left, cap)
+        return max(0.0, left)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class FailoverExhausted(Exception):
+    """Ни один кандидат не смог выполнить операцию в пределах дедлайна."""
+
+    def __init__(self, message: str, last_error: Optional[Exception] = None):
+        super().__init__(message)
+        self.last_error = last_error
+
+
+async def probe_and_commit(
+    candidates: List[TelethonBridge],
+    probe: Callable[[TelethonBridge], Awaitable[Any]],
+    commit: Callable[[TelethonBridge, Any], Awaitable[Any]],
+    deadline: Deadline,
+    reserve: float = 0.0,
+    on_error: Optional[Callable[[TelethonBridge, Exception], None]] = None,
+) -> Tuple[TelethonBridge, Any]:
+    """
+    probe(bridge) — идемпотентный шаг, запускается на всех кандидатах сразу.
+    commit(bridge, probe_result) — отправка, выполняется по очереди на тех,
+    кто прошёл probe (в порядке ответа). Таймаут commit не ретраится:
+    сообщение могло уйти, дублировать его нельзя.
+    """
+    if not candidates:
+        raise FailoverExhausted("no failover candidates")
+
+    probe_budget = deadline.budget(config.FAILOVER_PROBE_TIMEOUT, reserve)
+    if probe_budget <= 0:
+        raise FailoverExhausted("deadline exceeded before failover")
+
+    pending = {}
+    for bridge in candidates:
+        task = asyncio.ensure_future(asyncio.wait_for(probe(bridge), probe_budget))
+        pending[task] = bridge
+
+    last_error: Optional[Exception] = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending.keys(), return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                bridge = pending.pop(task)
+                if task.cancelled():
+                    continue
+                err = task.exception()
+                if err is not None:
+                    last_error = err
+                    logger.debug("Failover probe on %s failed: %s", bridge.name, err)
+                    continue
+
+                budget = deadline.budget(reserve=reserve)
+                if budget <= 0:
+                    raise FailoverExhausted("deadline exceeded", last_error)
+                try:
+                    result = await asyncio.wait_for(commit(bridge, task.result()), budget)
+                    return bridge, result
+                except asyncio.TimeoutError as e:
+                    if on_error:
+                        on_error(bridge, e)
+                    raise FailoverExhausted(
+                        f"commit on {bridge.name} timed out", e,
+                    )
+                except Exception as e:
+                    last_error = e
+                    logger.warning(
+                        "Failover commit on %s failed: %s: %s",
+                        bridge.name, type(e).__name__, e,
+                    )
+                    if on_error:
+                        on_error(bridge, e)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise FailoverExhausted("all failover candidates failed", last_error)
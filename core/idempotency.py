@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+core/idempotency.py — Idempotency-Key для send/create эндпоинтов.
+
+Клиент передаёт заголовок `Idempotency-Key` (или поле "idempotency_key"
+в JSON). Первый запрос с ключом выполняется, его успешный ответ
+сохраняется в LRU в памяти + таблицу idempotency_keys реестра.
+Повтор с тем же ключом получает сохранённый ответ без похода в Telegram;
+параллельный дубль ждёт завершения уже идущего запроса (не дольше
+IDEMPOTENCY_WAIT_TIMEOUT, затем 409 "request in progress").
+Ошибки (HTTP >= 400) не сохраняются — повтор выполнит запрос заново.
+
+Вместе с ответом хранится sha256 тела запроса: тот же ключ с другим
+payload'ом получает 422, а не чужой сохранённый ответ. Одиночные и
+пакетные эндпоинты — разные области ключей (send_text / send_text_batch).
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Response, make_response, request
+from werkzeug.exceptions import HTTPException
+
+import config
+from core.registry import ChatRegistry
+from core.router import BridgeStarting
+
+logger = logging.getLogger("core.idempotency")
+
+HEADER = "Idempotency-Key"
+PAYLOAD_FIELD = "idempotency_key"
+
+# (body, status_code)
+Stored = Tuple[str, int]
+
+# Пробрасываются в Flask (errorhandler → 503 starting / HTTP-ошибка), не кэшируются;
+# дубли, ждущие тот же ключ, получают то же исключение
+_PASSTHROUGH = (BridgeStarting, HTTPException)
+
+_MISMATCH = (json.dumps({"status": "error",
+                         "error": "Idempotency-Key reused with a different payload"}), 422)
+
+
+class IdempotencyStore:
+    """LRU в памяти поверх таблицы idempotency_keys + in-flight дедупликация."""
+
+    def __init__(self, registry: ChatRegistry,
+                 max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self._registry = registry
+        self._max_size = max_size or config.IDEMPOTENCY_CACHE_SIZE
+        self._ttl = ttl or config.IDEMPOTENCY_TTL
+        # key → (время, ответ, хэш тела)
+        self._lru: "OrderedDict[str, Tuple[float, Stored, str]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[Future, str]] = {}
+        self._lock = threading.Lock()
+
+    def _lru_get(self, key: str) -> Optional[Tuple[Stored, str]]:
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        ts, stored, body_hash = item
+        if time.time() - ts > self._ttl:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return stored, body_hash
+
+    def _lru_put(self, key: str, ts: float, stored: Stored, body_hash: str):
+        self._lru[key] = (ts, stored, body_hash)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._max_size:
+            self._lru.popitem(last=False)
+
+    def execute(self, key: str, service: str, fn: Callable[[], Stored],
+                body_hash: str = "") -> Tuple[str, int, bool]:
+        """Выполнить fn() один раз на ключ. Возвращает (body, code, replayed)."""
+        with self._lock:
+            cached = self._lru_get(key)
+            if cached is None:
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    row = self._registry.get_idempotent(key, max_age=self._ttl)
+                    if row is not None:
+                        cached = (row["response"], row["status_code"]), row["body_hash"] or ""
+                        self._lru_put(key, row["created_at"], *cached)
+            if cached is not None:
+                stored, known_hash = cached
+                if not _same_body(known_hash, body_hash):
+                    return _MISMATCH[0], _MISMATCH[1], False
+                return stored[0], stored[1], True
+
+            owner = inflight is None
+            if owner:
+                future = Future()
+                self._inflight[key] = (future, body_hash)
+            else:
+                future, known_hash = inflight
+                if not _same_body(known_hash, body_hash):
+                    return _MISMATCH[0], _MISMATCH[1], False
+
+        if not owner:
+            logger.info("Idempotency key %s: attaching to in-flight request", key)
+            try:
+                body, code = future.result(timeout=config.IDEMPOTENCY_WAIT_TIMEOUT)
+            except FutureTimeoutError:
+                logger.warning("Idempotency key %s: in-flight request still running", key)
+                return json.dumps({"status": "error", "error": "request in progress"}), 409, False
+            return body, code, True
+
+        try:
+            body, code = fn()
+        except _PASSTHROUGH as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        except Exception as e:
+            logger.error("Idempotent request %s failed: %s", key, e)
+            body, code = '{"status": "error", "error": "internal error"}', 500
+
+        try:
+            if code < 400:
+                now = time.time()
+                with self._lock:
+                    self._lru_put(key, now, (body, code), body_hash)
+                self._registry.save_idempotent(key, service, code, body, body_hash)
+        except Exception as e:
+            logger.warning("Failed to persist idempotency key %s: %s", key, e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result((body, code))
+
+        return body, code, False
+
+
+def _same_body(known: str, body_hash: str) -> bool:
+    # Пустой хэш — запись старой схемы или тело не прочитано: не сравниваем
+    return not known or not body_hash or known == body_hash
+
+
+_store: Optional[IdempotencyStore] = None
+
+
+def init(registry: ChatRegistry):
+    global _store
+    _store = IdempotencyStore(registry)
+
+
+def _request_key() -> Optional[str]:
+    key = request.headers.get(HEADER)
+    if not key:
+        data = request.get_json(force=True, silent=True)
+        if isinstance(data, dict):
+            key = data.get(PAYLOAD_FIELD)
+    key = str(key).strip() if key else ""
+    return key[:200] or None
+
+
+def _body_hash() -> str:
+    """sha256 тела запроса; JSON нормализуется (порядок ключей, пробелы)."""
+    data = request.get_json(force=True, silent=True)
+    if data is not None:
+        raw = json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    else:
+        raw = request.get_data()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def idempotent(service: str):
+    """Декоратор Flask view: дедупликация по Idempotency-Key."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = _request_key()
+            if not key or _store is None:
+                return view(*args, **kwargs)
+
+            def _call() -> Stored:
+                resp = make_response(view(*args, **kwargs))
+                return resp.get_data(as_text=True), resp.status_code
+
+            body, code, replayed = _store.execute(
+                f"{service}:{key}", service, _call, _body_hash(),
+            )
+            resp = Response(body, status=code, mimetype="application/json")
+            if replayed:
+                resp.headers["Idempotent-Replayed"] = "true"
+            return resp
+        return wrapper
+    return decorator
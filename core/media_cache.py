@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+core/media_cache.py — Кэш файлов, уже загруженных в Telegram.
+
+Ключ: (аккаунт, источник). Источник — URL или sha256 локального файла
+плюс параметры, влияющие на вид медиа (force_document, streaming, имя).
+Значение: InputPhoto / InputDocument (id, access_hash, file_reference) —
+повторная отправка того же файла идёт серверной ссылкой, без скачивания
+и загрузки. access_hash/file_reference привязаны к аккаунту, поэтому
+хэндлы у каждого аккаунта свои.
+
+Подготовка (загрузка + messages.uploadMedia) идёт single-flight: пока один
+запрос грузит файл, параллельные запросы с тем же (аккаунт, ключ) ждут
+его результата — N одновременных отправок стоят одной загрузки.
+
+URL сам по себе ключом хэндла не служит: send_media находит по нему запись
+спула (после ревалидации ETag / Last-Modified) и берёт ключ sha256 её
+содержимого — такой хэндл живёт MEDIA_CACHE_TTL, а сменившееся по URL
+содержимое даёт новый ключ. Ключ "url:" остаётся только для первой загрузки
+(single-flight) и при выключенном спуле; он живёт не дольше
+MEDIA_SPOOL_REVALIDATE_AFTER.
+
+Хранение: LRU в памяти поверх таблицы media_cache реестра. Протухший
+file_reference (FileReferenceExpiredError) — invalidate() и отправка из
+исходника заново (см. services/send_media.py).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from telethon.tl import types
+
+import config
+from core.registry import ChatRegistry
+
+logger = logging.getLogger("core.media_cache")
+
+InputMedia = Union[types.InputPhoto, types.InputDocument]
+
+# Кэш sha256 локальных файлов: path → (size, mtime, digest)
+_digests: Dict[str, Tuple[int, float, str]] = {}
+_digests_lock = threading.Lock()
+
+
+# === Ключи ====================================================================
+
+def _file_digest(path: str) -> str:
+    st = os.stat(path)
+    with _digests_lock:
+        known = _digests.get(path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime:
+            return known[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digests_lock:
+        _digests[path] = (st.st_size, st.st_mtime, digest)
+    return digest
+
+
+def source_key(source: str, force_document: bool = False,
+               supports_streaming: bool = False,
+               filename: Optional[str] = None) -> Optional[str]:
+    """Ключ кэша для URL или локального файла; None — источник не кэшируется.
+
+    Для локальных файлов читает файл целиком (sha256) — из event loop
+    вызывать через run_in_executor.
+    """
+    if not isinstance(source, str):
+        return None
+    if urlparse(source).scheme in ("http", "https"):
+        base = "url:" + source
+    elif os.path.isfile(source):
+        base = "sha256:" + _file_digest(source)
+    else:
+        return None
+    return _with_params(base, force_document, supports_streaming, filename)
+
+
+def content_key(sha256: str, force_document: bool = False,
+                supports_streaming: bool = False,
+                filename: Optional[str] = None) -> str:
+    """Ключ кэша по sha256 содержимого (файл спула, скачанный по URL)."""
+    return _with_params("sha256:" + sha256, force_document, supports_streaming, filename)
+
+
+def _with_params(base: str, force_document: bool, supports_streaming: bool,
+                 filename: Optional[str]) -> str:
+    return f"{base}|fd={int(force_document)}|st={int(supports_streaming)}|name={filename or ''}"
+
+
+# === Хэндлы ===================================================================
+
+def _handle_from_media(media) -> Optional[Tuple[str, int, int, bytes]]:
+    """MessageMedia* → (kind, id, access_hash, file_reference)."""
+    if isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo):
+        p = media.photo
+        return "photo", p.id, p.access_hash, p.file_reference
+    if isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document):
+        d = media.document
+        return "document", d.id, d.access_hash, d.file_reference
+    return None
+
+
+def _to_input(kind: str, media_id: int, access_hash: int, file_reference: bytes) -> InputMedia:
+    if kind == "photo":
+        return types.InputPhoto(media_id, access_hash, file_reference)
+    return types.InputDocument(media_id, access_hash, file_reference)
+
+
+class MediaCache:
+    """LRU в памяти + таблица media_cache."""
+
+    def __init__(self, registry: ChatRegistry,
+                 max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self._registry = registry
+        self._max_size = max_size or config.MEDIA_CACHE_SIZE
+        self._ttl = ttl or config.MEDIA_CACHE_TTL
+        # (account, key) → (хэндл, время сохранения)
+        self._lru: "OrderedDict[Tuple[str, str], Tuple[InputMedia, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Подготовки в процессе (только из event loop'а)
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    def _ttl_for(self, key: str) -> float:
+        if key.startswith("url:"):
+            return min(self._ttl, config.MEDIA_SPOOL_REVALIDATE_AFTER)
+        return self._ttl
+
+    def get(self, account: str, key: str) -> Optional[InputMedia]:
+        ttl = self._ttl_for(key)
+        with self._lock:
+            item = self._lru.get((account, key))
+            if item is not None:
+                if time.time() - item[1] < ttl:
+                    self._lru.move_to_end((account, key))
+                    return item[0]
+                del self._lru[(account, key)]
+        row = self._registry.get_media_handle(account, key, max_age=ttl)
+        if row is None:
+            return None
+        media = _to_input(row["kind"], row["media_id"], row["access_hash"],
+                          row["file_reference"])
+        self._remember(account, key, media, row["created_at"])
+        return media
+
+    def put(self, account: str, key: str, message_media) -> Optional[InputMedia]:
+        """Запомнить хэндл из MessageMedia (uploadMedia / отправленное сообщение)."""
+        handle = _handle_from_media(message_media)
+        if handle is None:
+            return None
+        kind, media_id, access_hash, file_reference = handle
+        media = _to_input(*handle)
+        self._remember(account, key, media)
+        try:
+            self._registry.save_media_handle(
+                account, key, kind, media_id, access_hash, file_reference,
+            )
+        except Exception as e:
+            logger.warning("Failed to persist media handle %s: %s", key, e)
+        return media
+
+    async def get_or_prepare(self, account: str, key: str,
+                             prepare: Callable[[], Awaitable]) -> InputMedia:
+        """Хэндл из кэша или prepare() → MessageMedia, один раз на (account, key)."""
+        while True:
+            media = self.get(account, key)
+            if media is not None:
+                return media
+            future = self._inflight.get((account, key))
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue  # владелец отменён (дедлайн) — готовим сами
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[(account, key)] = future
+        try:
+            media = self.put(account, key, await prepare())
+            if media is None:
+                raise ValueError(f"Unsupported media for {key}")
+            future.set_result(media)
+            return media
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # ошибка уйдёт владельцу, не логировать как потерянную
+            raise
+        finally:
+            self._inflight.pop((account, key), None)
+
+    def invalidate(self, account: str, key: str):
+        with self._lock:
+            self._lru.pop((account, key), None)
+        try:
+            self._registry.delete_media_handle(account, key)
+        except Exception as e:
+            logger.warning("Failed to delete media handle %s: %s", key, e)
+
+    def _remember(self, account: str, key: str, media: InputMedia,
+                  saved_at: Optional[float] = None):
+        with self._lock:
+            self._lru[(account, key)] = (media, saved_at or time.time())
+            self._lru.move_to_end((account, key))
+            while len(self._lru) > self._max_size:
+                self._lru.popitem(last=False)
+
+
+_cache: Optional[MediaCache] = None
+
+
+def init(registry: ChatRegistry):
+    global _cache
+    _cache = MediaCache(registry)
+
+
+def get(account: str, key: Optional[str]) -> Optional[InputMedia]:
+    if _cache is None or not key:
+        return None
+    return _cache.get(account, key)
+
+
+def put(account: str, key: Optional[str], message_media) -> Optional[InputMedia]:
+    if _cache is None or not key:
+        return None
+    return _cache.put(account, key, message_media)
+
+
+async def get_or_prepare(account: str, key: str,
+                         prepare: Callable[[], Awaitable]) -> InputMedia:
+    if _cache is None:
+        media = _handle_from_media(await prepare())
+        if media is None:
+            raise ValueError(f"Unsupported media for {key}")
+        return _to_input(*media)
+    return await _cache.get_or_prepare(account, key, prepare)
+
+
+def invalidate(account: str, key: Optional[str]):
+    if _cache is not None and key:
+        _cache.invalidate(account, key)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+core/metrics.py — Метрики в текстовом формате Prometheus (GET /metrics дашборда).
+
+Без внешних зависимостей: Counter / Gauge / Histogram с метками, один
+замок на метрику, на горячем пути — поиск по dict и пара сложений.
+Значения живут в памяти процесса и обнуляются при рестарте (для
+Prometheus это обычный reset счётчика).
+
+Что собирается:
+  http_request_duration_seconds — латентность HTTP-эндпоинтов сервисов
+  telegram_rpc_*                — RPC каждого bridge'а (см. InstrumentedClient
+                                  в core/bridge.py), FloodWait
+  entity_resolve_total          — откуда взялся entity (кэш диалогов / API / ...)
+  failovers_total               — переключения аккаунтов
+  bot_api_requests_*            — Bot API fallback
+  event_loop_lag_seconds        — задержка event loop'а Telethon
+Глубина очередей и состояние bridge'ей — gauges, обновляются при scrape.
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import config
+
+logger = logging.getLogger("core.metrics")
+
+LabelValues = Tuple[str, ...]
+
+# Границы бакетов (сек): от быстрого RPC до долгого create_chat
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues,
+                   extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name}: expected labels {self.label_names}")
+        return tuple(str(v) for v in labels)
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, *labels: str, value: float):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def replace(self, values: Dict[LabelValues, float]):
+        """Заменить все значения разом (gauges, считаемые при scrape)."""
+        with self._lock:
+            self._values = {tuple(str(v) for v in k): float(x) for k, x in values.items()}
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key → [счётчики по бакетам (не накопительные)..., +Inf, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, *labels: str, value: float):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def count(self, *labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return int(sum(row[:-1])) if row else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, row in items:
+            cumulative = 0.0
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += n
+                le = ("le", _format_value(bound))
+                yield (f"{self.name}_bucket{_format_labels(self.label_names, key, le)} "
+                       f"{_format_value(cumulative)}")
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(row[-1])}"
+            yield f"{self.name}_count{labels} {_format_value(cumulative)}"
+
+
+# === Реестр метрик ============================================================
+
+_metrics: List[_Metric] = []
+
+
+def _register(metric: _Metric) -> _Metric:
+    _metrics.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP ---
+HTTP_DURATION = _register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by service endpoint",
+    ("service", "endpoint", "status"),
+))
+
+# --- Telegram RPC ---
+RPC_TOTAL = _register(Counter(
+    "telegram_rpc_total", "Telegram API calls by bridge, method and result",
+    ("bridge", "method", "result"),
+))
+RPC_DURATION = _register(Histogram(
+    "telegram_rpc_duration_seconds", "Telegram API call latency",
+    ("bridge", "method"),
+))
+FLOOD_WAIT_SECONDS = _register(Counter(
+    "telegram_flood_wait_seconds_total", "Seconds of FloodWait received",
+    ("bridge",),
+))
+ENTITY_RESOLVE = _register(Counter(
+    "entity_resolve_total",
+    "get_entity resolutions by source (username_table/api/cache/refresh/peer/miss)",
+    ("bridge", "source"),
+))
+FAILOVERS = _register(Counter(
+    "failovers_total", "Account failovers", ("service", "from_account"),
+))
+
+# --- Bot API fallback ---
+BOT_API_TOTAL = _register(Counter(
+    "bot_api_requests_total", "Bot API fallback calls by method and result",
+    ("method", "result"),
+))
+BOT_API_DURATION = _register(Histogram(
+    "bot_api_request_duration_seconds", "Bot API call latency incl. rate-limit wait",
+    ("method",),
+))
+
+# --- Event loop ---
+LOOP_LAG = _register(Gauge(
+    "event_loop_lag_seconds", "Last measured Telethon event loop lag",
+))
+LOOP_LAG_HIST = _register(Histogram(
+    "event_loop_lag_hist_seconds", "Telethon event loop lag",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+))
+
+# --- Считаются при scrape (dashboard/routes.py) ---
+QUEUE_DEPTH = _register(Gauge(
+    "queue_depth", "Items waiting in internal queues", ("queue", "status"),
+))
+BRIDGE_UP = _register(Gauge(
+    "bridge_healthy", "1 if the bridge is healthy", ("bridge", "status"),
+))
+BRIDGE_DIALOGS = _register(Gauge(
+    "bridge_dialog_cache_size", "Entities in the bridge dialog cache", ("bridge",),
+))
+
+
+# === Event loop lag ===========================================================
+
+async def run_loop_lag_probe(interval: Optional[float] = None):
+    """Фоновая задача: насколько позже запланированного просыпается loop."""
+    interval = interval or config.METRICS_LOOP_LAG_INTERVAL
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        LOOP_LAG.set(value=lag)
+        LOOP_LAG_HIST.observe(value=lag)
+        if lag > config.METRICS_LOOP_LAG_WARN:
+            logger.warning("Event loop lag %.3fs", lag)
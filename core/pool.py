@@ -22,18 +22,21 @@ class AccountPool:
     Один bridge = один аккаунт + один сервис (= своя .session).
     """
 
-    def __init__(self, loop: asyncio.AbstractEventLoop):
+    def __init__(self, loop: asyncio.AbstractEventLoop, registry=None):
         self._loop = loop
+        # ChatRegistry — передаётся bridge'ам (таблица resolved_usernames)
+        self._registry = registry
         # Все bridge'и: ключ = "account_name:service"
         self.bridges: Dict[str, TelethonBridge] = {}
         # Порядок по приоритету для каждого сервиса
         self._sorted_by_service: Dict[str, List[str]] = {}
+        # start_all() завершён (все bridge'и хотя бы попытались стартовать)
+        self.started = False
 
     # === Lifecycle ============================================================
 
-    async def start_all(self):
-        """Создаём и запускаем bridge'и для каждой пары (аккаунт, сервис)."""
-        # 1. Create all bridges
+    def create_bridges(self):
+        """Создать bridge'и для каждой пары (аккаунт, сервис), не подключая их."""
         for acc in sorted(config.ACCOUNTS, key=lambda a: a["priority"]):
             acc_name = acc["name"]
             sessions = acc.get("sessions", {})
@@ -49,6 +52,7 @@ class AccountPool:
                     loop=self._loop,
                     api_id=acc["api_id"],
                     api_hash=acc["api_hash"],
+                    registry=self._registry,
                 )
                 self.bridges[bridge_key] = bridge
 
@@ -56,10 +60,19 @@ class AccountPool:
                     self._sorted_by_service[service] = []
                 self._sorted_by_service[service].append(bridge_key)
 
+    async def start_all(self, snapshot_sessions: bool = False):
+        """Запускаем bridge'и (создаём, если create_bridges ещё не вызывался).
+
+        snapshot_sessions — см. TelethonBridge.start (graceful reload).
+        """
+        # 1. Create all bridges
+        if not self.bridges:
+            self.create_bridges()
+
         # 2. Start all bridges in parallel (each has ~30s flood wait on cache warmup)
         async def _safe_start(key, bridge):
             try:
-                await bridge.start()
+                await bridge.start(snapshot_session=snapshot_sessions)
                 self._loop.create_task(bridge.periodic_warmup())
             except Exception as e:
                 logger.error("Failed to start bridge %s: %s", key, e)
@@ -69,6 +82,7 @@ class AccountPool:
             *[_safe_start(k, b) for k, b in self.bridges.items()]
         )
 
+        self.started = True
         total = len(self.bridges)
         healthy = sum(1 for b in self.bridges.values() if b.is_healthy)
         logger.info(
@@ -80,6 +94,14 @@ class AccountPool:
                 "  service=%s: %d/%d healthy", svc, svc_healthy, len(keys),
             )
 
+    def persist_sessions(self):
+        """Преемник reload'а: снимки сессий → .session файлы (после выхода старого)."""
+        for key, bridge in self.bridges.items():
+            try:
+                bridge.persist_session()
+            except Exception as e:
+                logger.error("Failed to persist session of bridge %s: %s", key, e)
+
     async def stop_all(self):
         for bridge in self.bridges.values():
             await bridge.stop()
@@ -176,6 +198,23 @@ class AccountPool:
 
         return random.choices(candidates, weights=weights, k=1)[0]
 
+    # === Готовность =========================================================
+
+    def is_service_ready(self, service: str) -> bool:
+        """Сервис принимает запросы: старт пула завершён или уже есть здоровый bridge."""
+        return self.started or self.get_best(service) is not None
+
+    def readiness(self) -> Dict[str, dict]:
+        """Готовность по сервисам (для /ready)."""
+        result = {}
+        for svc, keys in self._sorted_by_service.items():
+            result[svc] = {
+                "ready": self.is_service_ready(svc),
+                "healthy": sum(1 for k in keys if self.bridges[k].is_healthy),
+                "total": len(keys),
+            }
+        return result
+
     # === Информация ===========================================================
 
     def all_statuses(self) -> List[dict]:
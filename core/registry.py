@@ -7,6 +7,18 @@ core/registry.py — ChatRegistry: SQLite-реестр привязки чато
   operations_log    — лог всех операций
   failover_log      — лог переключений аккаунтов
   failed_requests   — неудачные запросы для повторного выполнения
+  idempotency_keys  — сохранённые ответы по Idempotency-Key
+  media_cache       — (аккаунт, источник файла) → InputPhoto/InputDocument
+  media_spool       — индекс дискового кэша скачанных по URL файлов
+  chat_pool         — заготовленные супергруппы для create_chat
+  admin_rights_variants — рабочий набор прав админа для (аккаунт, бот)
+  resolved_usernames — username → (id, access_hash, ...) для каждого аккаунта
+  outbound_queue    — очередь исходящих webhook'ов (core/delivery.py)
+  leave_tasks       — фоновые выходы из чатов (leave_chat, "background")
+  leave_batch_jobs  — задания /leave_chat/batch (прогресс и результаты)
+
+Статусы chat_assignments: 'active', 'leaving' (выход поставлен в фон,
+отправка уже запрещена), 'left'.
 """
 import json
 import sqlite3
@@ -83,6 +95,113 @@ class ChatRegistry:
                 last_retry_error TEXT DEFAULT ''
             );
 
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key           TEXT PRIMARY KEY,
+                service       TEXT NOT NULL,
+                status_code   INTEGER NOT NULL,
+                response      TEXT NOT NULL,
+                created_at    REAL NOT NULL,
+                body_hash     TEXT DEFAULT ''
+            );
+
+            CREATE TABLE IF NOT EXISTS media_cache (
+                account_name   TEXT NOT NULL,
+                key            TEXT NOT NULL,
+                kind           TEXT NOT NULL,
+                media_id       INTEGER NOT NULL,
+                access_hash    INTEGER NOT NULL,
+                file_reference BLOB NOT NULL,
+                created_at     REAL NOT NULL,
+                PRIMARY KEY (account_name, key)
+            );
+
+            CREATE TABLE IF NOT EXISTS media_spool (
+                url            TEXT PRIMARY KEY,
+                sha256         TEXT NOT NULL,
+                size           INTEGER NOT NULL,
+                mime_type      TEXT DEFAULT '',
+                filename       TEXT DEFAULT '',
+                etag           TEXT DEFAULT '',
+                last_modified  TEXT DEFAULT '',
+                checked_at     REAL NOT NULL,
+                last_used      REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS chat_pool (
+                id            INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_name  TEXT NOT NULL,
+                channel_id    INTEGER NOT NULL,
+                access_hash   INTEGER NOT NULL,
+                invite_link   TEXT DEFAULT '',
+                members       TEXT NOT NULL DEFAULT '[]',
+                created_at    REAL NOT NULL,
+                status        TEXT DEFAULT 'ready',
+                taken_at      REAL DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS admin_rights_variants (
+                account_name  TEXT NOT NULL,
+                bot_id        INTEGER NOT NULL,
+                variant       TEXT NOT NULL,
+                updated_at    REAL NOT NULL,
+                PRIMARY KEY (account_name, bot_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS resolved_usernames (
+                account_name  TEXT NOT NULL,
+                username      TEXT NOT NULL,
+                kind          TEXT NOT NULL,
+                entity_id     INTEGER NOT NULL,
+                access_hash   INTEGER NOT NULL,
+                is_bot        INTEGER DEFAULT 0,
+                first_name    TEXT DEFAULT '',
+                last_name     TEXT DEFAULT '',
+                title         TEXT DEFAULT '',
+                megagroup     INTEGER DEFAULT 0,
+                resolved_at   REAL NOT NULL,
+                PRIMARY KEY (account_name, username)
+            );
+
+            CREATE TABLE IF NOT EXISTS outbound_queue (
+                id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                service         TEXT NOT NULL,
+                url             TEXT NOT NULL,
+                destination     TEXT NOT NULL,
+                payload         TEXT NOT NULL,
+                status          TEXT DEFAULT 'pending',
+                attempts        INTEGER DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error      TEXT DEFAULT '',
+                created_at      REAL NOT NULL,
+                updated_at      REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS leave_tasks (
+                chat_id           TEXT PRIMARY KEY,
+                account_name      TEXT NOT NULL,
+                delete_if_creator INTEGER,
+                status            TEXT DEFAULT 'pending',
+                attempts          INTEGER DEFAULT 0,
+                kicked            INTEGER DEFAULT 0,
+                next_attempt_at   REAL NOT NULL,
+                last_error        TEXT DEFAULT '',
+                created_at        REAL NOT NULL,
+                updated_at        REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS leave_batch_jobs (
+                id                TEXT PRIMARY KEY,
+                status            TEXT NOT NULL,
+                chats             TEXT NOT NULL,
+                delete_if_creator INTEGER,
+                count             INTEGER NOT NULL,
+                done              INTEGER DEFAULT 0,
+                results           TEXT DEFAULT '{}',
+                created_at        REAL NOT NULL,
+                updated_at        REAL NOT NULL,
+                finished_at       REAL
+            );
+
             CREATE INDEX IF NOT EXISTS idx_ops_ts ON operations_log(ts);
             CREATE INDEX IF NOT EXISTS idx_ops_chat ON operations_log(chat_id);
             CREATE INDEX IF NOT EXISTS idx_fo_ts ON failover_log(ts);
@@ -90,7 +209,17 @@ class ChatRegistry:
             CREATE INDEX IF NOT EXISTS idx_ops_account ON operations_log(account_name);
             CREATE INDEX IF NOT EXISTS idx_failed_ts ON failed_requests(ts);
             CREATE INDEX IF NOT EXISTS idx_failed_status ON failed_requests(status);
+            CREATE INDEX IF NOT EXISTS idx_idem_ts ON idempotency_keys(created_at);
+            CREATE INDEX IF NOT EXISTS idx_media_ts ON media_cache(created_at);
+            CREATE INDEX IF NOT EXISTS idx_spool_sha ON media_spool(sha256);
+            CREATE INDEX IF NOT EXISTS idx_pool_account ON chat_pool(account_name, status);
+            CREATE INDEX IF NOT EXISTS idx_outbound_due ON outbound_queue(status, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS idx_leave_due ON leave_tasks(status, next_attempt_at);
         """)
+        # Колонки, добавленные в уже существующие таблицы
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(idempotency_keys)")}
+        if "body_hash" not in columns:
+            conn.execute("ALTER TABLE idempotency_keys ADD COLUMN body_hash TEXT DEFAULT ''")
         conn.commit()
 
     # === Chat Assignments =====================================================
@@ -157,6 +286,23 @@ class ChatRegistry:
         ).fetchone()
         return row["account_name"] if row else None
 
+    def get_accounts(self, chat_ids: List[str]) -> Dict[str, str]:
+        """Пакетный get_account: chat_id → account_name для активных чатов."""
+        conn = self._get_conn()
+        result = {}
+        ids = [str(c) for c in chat_ids]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT chat_id, account_name FROM chat_assignments "
+                f"WHERE status = 'active' AND chat_id IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            for row in rows:
+                result[row["chat_id"]] = row["account_name"]
+        return result
+
     def update_account(self, chat_id: str, new_account: str):
         conn = self._get_conn()
         conn.execute(
@@ -173,13 +319,62 @@ class ChatRegistry:
         )
         conn.commit()
 
+    def mark_left_many(self, chat_ids: List[str]):
+        """Пакетный mark_left — одна транзакция."""
+        if not chat_ids:
+            return
+        conn = self._get_conn()
+        with conn:
+            conn.executemany(
+                "UPDATE chat_assignments SET status = 'left' WHERE chat_id = ?",
+                [(str(c),) for c in chat_ids],
+            )
+
+    def mark_leaving(self, chat_id: str, account_name: str):
+        """Выход поставлен в фон: для отправки чат уже считается покинутым."""
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT INTO chat_assignments
+               (chat_id, account_name, title, invite_link, created_at, status)
+               VALUES (?, ?, '', '', ?, 'leaving')
+               ON CONFLICT(chat_id) DO UPDATE SET status = 'leaving'""",
+            (str(chat_id), account_name, time.time()),
+        )
+        conn.commit()
+
+    def unmark_leaving(self, chat_id: str):
+        """Фоновый выход не удался — чат снова активен (отправка разрешена)."""
+        conn = self._get_conn()
+        conn.execute(
+            "UPDATE chat_assignments SET status = 'active' WHERE chat_id = ? AND status = 'leaving'",
+            (str(chat_id),),
+        )
+        conn.commit()
+
     def is_left(self, chat_id: str) -> bool:
+        """True, если мы вышли из чата или выход уже идёт ('leaving')."""
         conn = self._get_conn()
         row = conn.execute(
             "SELECT status FROM chat_assignments WHERE chat_id = ?",
             (str(chat_id),),
         ).fetchone()
-        return row is not None and row["status"] == "left"
+        return row is not None and row["status"] in ("left", "leaving")
+
+    def get_left(self, chat_ids: List[str]) -> set:
+        """Пакетный is_left: chat_id, из которых мы вышли или выходим."""
+        conn = self._get_conn()
+        result = set()
+        ids = [str(c) for c in chat_ids]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT chat_id FROM chat_assignments "
+                f"WHERE status IN ('left', 'leaving') AND chat_id IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            result.update(row["chat_id"] for row in rows)
+        return result
 
     def get_all_assignments(self, limit: int = 200) -> List[Dict[str, Any]]:
         conn = self._get_conn()
@@ -240,6 +435,15 @@ class ChatRegistry:
         )
         conn.commit()
 
+    def count_operations_since(self, account_name: str, operation: str,
+                               since: float) -> int:
+        conn = self._get_conn()
+        return conn.execute(
+            """SELECT COUNT(*) AS c FROM operations_log
+               WHERE account_name = ? AND operation = ? AND status = 'ok' AND ts >= ?""",
+            (account_name, operation, since),
+        ).fetchone()["c"]
+
     def get_recent_operations(self, limit: int = 100) -> List[Dict[str, Any]]:
         conn = self._get_conn()
         rows = conn.execute(
@@ -375,6 +579,500 @@ class ChatRegistry:
         ).fetchone()
         return row["c"]
 
+    # === Idempotency Keys =====================================================
+
+    def get_idempotent(self, key: str, max_age: float) -> Optional[Dict[str, Any]]:
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT * FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+            (key, time.time() - max_age),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_idempotent(self, key: str, service: str,
+                        status_code: int, response: str, body_hash: str = ""):
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO idempotency_keys
+               (key, service, status_code, response, created_at, body_hash)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (key, service, status_code, response, time.time(), body_hash),
+        )
+        conn.commit()
+
+    # === Media Cache ==========================================================
+
+    def get_media_handle(self, account_name: str, key: str,
+                         max_age: float) -> Optional[Dict[str, Any]]:
+        conn = self._get_conn()
+        row = conn.execute(
+            """SELECT * FROM media_cache
+               WHERE account_name = ? AND key = ? AND created_at >= ?""",
+            (account_name, key, time.time() - max_age),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_media_handle(self, account_name: str, key: str, kind: str,
+                          media_id: int, access_hash: int, file_reference: bytes):
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO media_cache
+               (account_name, key, kind, media_id, access_hash, file_reference, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (account_name, key, kind, media_id, access_hash,
+             file_reference, time.time()),
+        )
+        conn.commit()
+
+    def delete_media_handle(self, account_name: str, key: str):
+        conn = self._get_conn()
+        conn.execute(
+            "DELETE FROM media_cache WHERE account_name = ? AND key = ?",
+            (account_name, key),
+        )
+        conn.commit()
+
+    # === Media Spool ==========================================================
+
+    def get_spool_entry(self, url: str) -> Optional[Dict[str, Any]]:
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT * FROM media_spool WHERE url = ?", (url,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_spool_entry(self, url: str, sha256: str, size: int,
+                         mime_type: str = "", filename: str = "",
+                         etag: str = "", last_modified: str = ""):
+        now = time.time()
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO media_spool
+               (url, sha256, size, mime_type, filename, etag, last_modified,
+                checked_at, last_used)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (url, sha256, size, mime_type, filename, etag, last_modified, now, now),
+        )
+        conn.commit()
+
+    def touch_spool_entry(self, url: str, checked: bool = False):
+        now = time.time()
+        conn = self._get_conn()
+        if checked:
+            conn.execute(
+                "UPDATE media_spool SET last_used = ?, checked_at = ? WHERE url = ?",
+                (now, now, url),
+            )
+        else:
+            conn.execute(
+                "UPDATE media_spool SET last_used = ? WHERE url = ?", (now, url),
+            )
+        conn.commit()
+
+    def get_spool_usage(self) -> List[Dict[str, Any]]:
+        """Файлы спула (по sha256), от давно не использованных к свежим."""
+        conn = self._get_conn()
+        rows = conn.execute(
+            """SELECT sha256, MAX(size) AS size, MAX(last_used) AS last_used
+               FROM media_spool GROUP BY sha256 ORDER BY last_used"""
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def delete_spool_file(self, sha256: str):
+        conn = self._get_conn()
+        conn.execute("DELETE FROM media_spool WHERE sha256 = ?", (sha256,))
+        conn.commit()
+
+    def delete_spool_entry(self, url: str):
+        conn = self._get_conn()
+        conn.execute("DELETE FROM media_spool WHERE url = ?", (url,))
+        conn.commit()
+
+    # === Chat Pool ============================================================
+
+    def add_pool_chat(self, account_name: str, channel_id: int, access_hash: int,
+                      invite_link: str, members: List[str]) -> int:
+        conn = self._get_conn()
+        cur = conn.execute(
+            """INSERT INTO chat_pool
+               (account_name, channel_id, access_hash, invite_link, members,
+                created_at, status)
+               VALUES (?, ?, ?, ?, ?, ?, 'ready')""",
+            (account_name, channel_id, access_hash, invite_link or "",
+             json.dumps(members), time.time()),
+        )
+        conn.commit()
+        return cur.lastrowid
+
+    def take_pool_chat(self, account_name: str) -> Optional[Dict[str, Any]]:
+        """Забрать самую старую готовую группу аккаунта (атомарно)."""
+        conn = self._get_conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """SELECT * FROM chat_pool
+                   WHERE account_name = ? AND status = 'ready'
+                   ORDER BY created_at LIMIT 1""",
+                (account_name,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE chat_pool SET status = 'taken', taken_at = ? WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+        d = dict(row)
+        d["members"] = json.loads(d["members"] or "[]")
+        return d
+
+    def set_pool_chat_status(self, pool_id: int, status: str):
+        """'ready' — вернуть в пул, 'broken' — группа непригодна."""
+        conn = self._get_conn()
+        conn.execute(
+            "UPDATE chat_pool SET status = ? WHERE id = ?", (status, pool_id),
+        )
+        conn.commit()
+
+    def count_pool_chats(self, account_name: str) -> int:
+        conn = self._get_conn()
+        return conn.execute(
+            "SELECT COUNT(*) AS c FROM chat_pool WHERE account_name = ? AND status = 'ready'",
+            (account_name,),
+        ).fetchone()["c"]
+
+    def get_pool_summary(self) -> Dict[str, int]:
+        """account_name → число готовых групп."""
+        conn = self._get_conn()
+        rows = conn.execute(
+            """SELECT account_name, COUNT(*) AS c FROM chat_pool
+               WHERE status = 'ready' GROUP BY account_name"""
+        ).fetchall()
+        return {row["account_name"]: row["c"] for row in rows}
+
+    # === Admin Rights Variants ================================================
+
+    def get_rights_variant(self, account_name: str, bot_id: int) -> Optional[str]:
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT variant FROM admin_rights_variants WHERE account_name = ? AND bot_id = ?",
+            (account_name, bot_id),
+        ).fetchone()
+        return row["variant"] if row else None
+
+    def save_rights_variant(self, account_name: str, bot_id: int, variant: str):
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO admin_rights_variants
+               (account_name, bot_id, variant, updated_at) VALUES (?, ?, ?, ?)""",
+            (account_name, bot_id, variant, time.time()),
+        )
+        conn.commit()
+
+    def delete_rights_variant(self, account_name: str, bot_id: int):
+        conn = self._get_conn()
+        conn.execute(
+            "DELETE FROM admin_rights_variants WHERE account_name = ? AND bot_id = ?",
+            (account_name, bot_id),
+        )
+        conn.commit()
+
+    # === Resolved Usernames ===================================================
+
+    def get_resolved_username(self, account_name: str, username: str,
+                              max_age: float) -> Optional[Dict[str, Any]]:
+        conn = self._get_conn()
+        row = conn.execute(
+            """SELECT * FROM resolved_usernames
+               WHERE account_name = ? AND username = ? AND resolved_at >= ?""",
+            (account_name, username.lower(), time.time() - max_age),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_resolved_username(self, account_name: str, username: str, kind: str,
+                               entity_id: int, access_hash: int, is_bot: bool = False,
+                               first_name: str = "", last_name: str = "",
+                               title: str = "", megagroup: bool = False):
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO resolved_usernames
+               (account_name, username, kind, entity_id, access_hash, is_bot,
+                first_name, last_name, title, megagroup, resolved_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (account_name, username.lower(), kind, entity_id, access_hash,
+             int(is_bot), first_name or "", last_name or "", title or "",
+             int(megagroup), time.time()),
+        )
+        conn.commit()
+
+    def delete_resolved_username(self, username: str,
+                                 account_name: Optional[str] = None) -> int:
+        """Инвалидация: для одного аккаунта или для всех. Возвращает число строк."""
+        conn = self._get_conn()
+        if account_name:
+            cur = conn.execute(
+                "DELETE FROM resolved_usernames WHERE account_name = ? AND username = ?",
+                (account_name, username.lower()),
+            )
+        else:
+            cur = conn.execute(
+                "DELETE FROM resolved_usernames WHERE username = ?", (username.lower(),),
+            )
+        conn.commit()
+        return cur.rowcount
+
+    # === Outbound Queue =======================================================
+
+    def enqueue_delivery(self, service: str, url: str, destination: str,
+                         payload: str) -> int:
+        conn = self._get_conn()
+        now = time.time()
+        cur = conn.execute(
+            """INSERT INTO outbound_queue
+               (service, url, destination, payload, status, attempts,
+                next_attempt_at, created_at, updated_at)
+               VALUES (?, ?, ?, ?, 'pending', 0, ?, ?, ?)""",
+            (service, url, destination, payload, now, now, now),
+        )
+        conn.commit()
+        return cur.lastrowid
+
+    def claim_delivery(self, now: float,
+                       exclude_destinations: Optional[List[str]] = None
+                       ) -> Optional[Dict[str, Any]]:
+        """Забрать ближайшую готовую задачу (атомарно, pending → inflight)."""
+        exclude = exclude_destinations or []
+        conn = self._get_conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"""SELECT * FROM outbound_queue
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    {"AND destination NOT IN (%s)" % ",".join("?" * len(exclude)) if exclude else ""}
+                    ORDER BY next_attempt_at LIMIT 1""",
+                [now, *exclude],
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE outbound_queue SET status = 'inflight', updated_at = ? WHERE id = ?",
+                (now, row["id"]),
+            )
+        return dict(row)
+
+    def next_delivery_in(self, now: float,
+                         exclude_destinations: Optional[List[str]] = None
+                         ) -> Optional[float]:
+        """Через сколько секунд наступит ближайшая попытка (None — очередь пуста).
+
+        Хосты из exclude_destinations не учитываются: их задачи ждут
+        освобождения слота, а не времени.
+        """
+        exclude = exclude_destinations or []
+        conn = self._get_conn()
+        row = conn.execute(
+            f"""SELECT MIN(next_attempt_at) AS t FROM outbound_queue
+                WHERE status = 'pending'
+                {"AND destination NOT IN (%s)" % ",".join("?" * len(exclude)) if exclude else ""}""",
+            exclude,
+        ).fetchone()
+        if row is None or row["t"] is None:
+            return None
+        return max(0.0, row["t"] - now)
+
+    def retry_delivery(self, job_id: int, attempts: int, next_attempt_at: float,
+                       error: str):
+        conn = self._get_conn()
+        conn.execute(
+            """UPDATE outbound_queue
+               SET status = 'pending', attempts = ?, next_attempt_at = ?,
+                   last_error = ?, updated_at = ?
+               WHERE id = ?""",
+            (attempts, next_attempt_at, error or "", time.time(), job_id),
+        )
+        conn.commit()
+
+    def complete_delivery(self, job_id: int):
+        conn = self._get_conn()
+        conn.execute("DELETE FROM outbound_queue WHERE id = ?", (job_id,))
+        conn.commit()
+
+    def requeue_stale_deliveries(self, older_than: float) -> int:
+        """Вернуть в работу задачи, зависшие в inflight (процесс умер)."""
+        conn = self._get_conn()
+        cur = conn.execute(
+            """UPDATE outbound_queue SET status = 'pending'
+               WHERE status = 'inflight' AND updated_at < ?""",
+            (older_than,),
+        )
+        conn.commit()
+        return cur.rowcount
+
+    def get_delivery_stats(self) -> Dict[str, int]:
+        conn = self._get_conn()
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS c FROM outbound_queue GROUP BY status"
+        ).fetchall()
+        return {row["status"]: row["c"] for row in rows}
+
+    # === Leave Tasks ==========================================================
+
+    def add_leave_task(self, chat_id: str, account_name: str,
+                       delete_if_creator: Optional[bool] = None):
+        """Поставить (или перезапустить) фоновый выход из чата."""
+        now = time.time()
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO leave_tasks
+               (chat_id, account_name, delete_if_creator, status, attempts,
+                kicked, next_attempt_at, last_error, created_at, updated_at)
+               VALUES (?, ?, ?, 'pending', 0, 0, ?, '', ?, ?)""",
+            (str(chat_id), account_name,
+             None if delete_if_creator is None else int(bool(delete_if_creator)),
+             now, now, now),
+        )
+        conn.commit()
+
+    def claim_leave_tasks(self, now: float, limit: int = 50) -> List[Dict[str, Any]]:
+        """Забрать созревшие задачи (pending → running) одной транзакцией."""
+        conn = self._get_conn()
+        with conn:
+            rows = conn.execute(
+                """SELECT * FROM leave_tasks
+                   WHERE status = 'pending' AND next_attempt_at <= ?
+                   ORDER BY next_attempt_at LIMIT ?""",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE leave_tasks SET status = 'running', updated_at = ? WHERE chat_id = ?",
+                [(now, row["chat_id"]) for row in rows],
+            )
+        return [dict(r) for r in rows]
+
+    def next_leave_task_in(self, now: float) -> Optional[float]:
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT MIN(next_attempt_at) AS t FROM leave_tasks WHERE status = 'pending'"
+        ).fetchone()
+        if row is None or row["t"] is None:
+            return None
+        return max(0.0, row["t"] - now)
+
+    def update_leave_task_progress(self, chat_id: str, kicked: int):
+        conn = self._get_conn()
+        conn.execute(
+            "UPDATE leave_tasks SET kicked = ?, updated_at = ? WHERE chat_id = ?",
+            (kicked, time.time(), str(chat_id)),
+        )
+        conn.commit()
+
+    def retry_leave_task(self, chat_id: str, attempts: int,
+                         next_attempt_at: float, error: str):
+        conn = self._get_conn()
+        conn.execute(
+            """UPDATE leave_tasks
+               SET status = 'pending', attempts = ?, next_attempt_at = ?,
+                   last_error = ?, updated_at = ?
+               WHERE chat_id = ?""",
+            (attempts, next_attempt_at, error[:500], time.time(), str(chat_id)),
+        )
+        conn.commit()
+
+    def finish_leave_task(self, chat_id: str, status: str, error: str = ""):
+        """status: 'done' или 'failed'."""
+        conn = self._get_conn()
+        conn.execute(
+            """UPDATE leave_tasks
+               SET status = ?, attempts = attempts + 1, last_error = ?, updated_at = ?
+               WHERE chat_id = ?""",
+            (status, error[:500], time.time(), str(chat_id)),
+        )
+        conn.commit()
+
+    def touch_leave_task(self, chat_id: str):
+        """Heartbeat выполняющейся задачи (см. requeue_stale_leave_tasks)."""
+        conn = self._get_conn()
+        conn.execute(
+            "UPDATE leave_tasks SET updated_at = ? WHERE chat_id = ? AND status = 'running'",
+            (time.time(), str(chat_id)),
+        )
+        conn.commit()
+
+    def requeue_stale_leave_tasks(self, older_than: float) -> int:
+        """Задачи 'running' без heartbeat'а с older_than (процесс умер) — снова в очередь."""
+        conn = self._get_conn()
+        cur = conn.execute(
+            """UPDATE leave_tasks SET status = 'pending'
+               WHERE status = 'running' AND updated_at < ?""",
+            (older_than,),
+        )
+        conn.commit()
+        return cur.rowcount
+
+    def get_leave_task(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT * FROM leave_tasks WHERE chat_id = ?", (str(chat_id),),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_leave_task_stats(self) -> Dict[str, int]:
+        conn = self._get_conn()
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS c FROM leave_tasks GROUP BY status"
+        ).fetchall()
+        return {row["status"]: row["c"] for row in rows}
+
+    # === Leave Batch Jobs =====================================================
+
+    def save_leave_batch(self, job: Dict[str, Any]):
+        """Создать или обновить задание пакетного выхода (состояние целиком)."""
+        dic = job.get("delete_if_creator")
+        conn = self._get_conn()
+        conn.execute(
+            """INSERT OR REPLACE INTO leave_batch_jobs
+               (id, status, chats, delete_if_creator, count, done, results,
+                created_at, updated_at, finished_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job["id"], job["status"], json.dumps(job["chats"], ensure_ascii=False),
+             None if dic is None else int(bool(dic)), job["count"], job["done"],
+             json.dumps(job["results"], ensure_ascii=False),
+             job["created_at"], time.time(), job.get("finished_at")),
+        )
+        conn.commit()
+
+    @staticmethod
+    def _leave_batch_row(row) -> Dict[str, Any]:
+        d = dict(row)
+        d["chats"] = json.loads(d["chats"] or "[]")
+        d["results"] = {int(i): r for i, r in json.loads(d["results"] or "{}").items()}
+        if d["delete_if_creator"] is not None:
+            d["delete_if_creator"] = bool(d["delete_if_creator"])
+        return d
+
+    def get_leave_batch(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT * FROM leave_batch_jobs WHERE id = ?", (job_id,),
+        ).fetchone()
+        return self._leave_batch_row(row) if row else None
+
+    def get_running_leave_batches(self) -> List[Dict[str, Any]]:
+        conn = self._get_conn()
+        rows = conn.execute(
+            "SELECT * FROM leave_batch_jobs WHERE status = 'running' ORDER BY created_at"
+        ).fetchall()
+        return [self._leave_batch_row(r) for r in rows]
+
+    # === Shutdown =============================================================
+
+    def close(self):
+        """Сбросить WAL в основной файл и закрыть соединение текущего потока."""
+        conn = self._get_conn()
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        self._local.conn = None
+
     # === Cleanup ==============================================================
 
     def cleanup_old_logs(self, days: int = 30):
@@ -386,4 +1084,28 @@ class ChatRegistry:
             "DELETE FROM failed_requests WHERE status != 'pending' AND ts < ?",
             (cutoff,),
         )
+        conn.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ?",
+            (time.time() - config.IDEMPOTENCY_TTL,),
+        )
+        conn.execute(
+            "DELETE FROM media_cache WHERE created_at < ?",
+            (time.time() - config.MEDIA_CACHE_TTL,),
+        )
+        conn.execute(
+            "DELETE FROM resolved_usernames WHERE resolved_at < ?",
+            (time.time() - config.USERNAME_CACHE_TTL,),
+        )
+        conn.execute(
+            "DELETE FROM chat_pool WHERE status != 'ready' AND created_at < ?",
+            (cutoff,),
+        )
+        conn.execute(
+            "DELETE FROM leave_tasks WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (cutoff,),
+        )
+        conn.execute(
+            "DELETE FROM leave_batch_jobs WHERE status = 'done' AND finished_at < ?",
+            (time.time() - config.LEAVE_BATCH_JOB_TTL,),
+        )
         conn.commit()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+core/reload.py — Graceful reload без потери портов и in-flight запросов.
+
+Схема (SIGHUP / дашборд action=reload / systemctl reload):
+ 1. Старый процесс запускает преемника (тот же argv) и передаёт ему
+    слушающие сокеты через pass_fds + env PLATFORM_LISTEN_FDS.
+ 2. Преемник стартует bridge'и со снимком сессий (StringSession), чтобы не
+    конфликтовать с SQLite-локом .session файлов старого процесса,
+    прогревает кэш и только потом начинает accept() на унаследованных сокетах.
+ 3. Готовый преемник шлёт старому SIGUSR2 и сообщает systemd новый MAINPID.
+ 4. Старый процесс перестаёт принимать соединения, дожидается in-flight
+    запросов (RELOAD_DRAIN_TIMEOUT), отключает клиентов, сбрасывает WAL
+    реестра и выходит.
+
+Пока оба процесса живы, ядро раздаёт новые соединения обоим — это нормально,
+оба обслуживают запросы полноценно. Фоновые воркеры (доставка webhook'ов,
+фоновые выходы, пул заготовок) работают только в одном процессе:
+предшественник останавливает их в начале drain, преемник запускает после
+его выхода (wait_predecessor_exit) и тогда же сохраняет снимки сессий
+обратно в .session файлы.
+
+Выход предшественника преемник узнаёт по pipe: предшественник держит
+пишущий конец до самого выхода (закрывает ядро, в т.ч. при падении),
+преемник ждёт EOF на читающем (env PLATFORM_RELOAD_EXIT_FD).
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("core.reload")
+
+ENV_LISTEN_FDS = "PLATFORM_LISTEN_FDS"     # "send_text=5,send_media=6,..."
+ENV_RELOAD_PARENT = "PLATFORM_RELOAD_PARENT"  # pid старого процесса
+ENV_RELOAD_EXIT_FD = "PLATFORM_RELOAD_EXIT_FD"  # читающий конец pipe выхода старого
+
+
+# === Сокеты ===================================================================
+
+def _parse_listen_fds() -> Dict[str, int]:
+    raw = os.environ.get(ENV_LISTEN_FDS, "")
+    fds = {}
+    for part in raw.split(","):
+        name, _, fd = part.partition("=")
+        if name and fd.isdigit():
+            fds[name] = int(fd)
+    return fds
+
+
+# Читаем один раз при импорте и чистим env, чтобы наши собственные
+# преемники не унаследовали чужие номера fd.
+_inherited_fds: Dict[str, int] = _parse_listen_fds()
+_parent_pid: Optional[int] = (
+    int(os.environ[ENV_RELOAD_PARENT])
+    if os.environ.get(ENV_RELOAD_PARENT, "").isdigit() else None
+)
+_exit_fd: Optional[int] = (
+    int(os.environ[ENV_RELOAD_EXIT_FD])
+    if os.environ.get(ENV_RELOAD_EXIT_FD, "").isdigit() else None
+)
+os.environ.pop(ENV_LISTEN_FDS, None)
+os.environ.pop(ENV_RELOAD_PARENT, None)
+os.environ.pop(ENV_RELOAD_EXIT_FD, None)
+
+# Пишущие концы pipe'ов выхода для запущенных преемников: держим до выхода
+_exit_pipes: List[int] = []
+
+
+def is_successor() -> bool:
+    """Процесс запущен через graceful reload (старый ещё обслуживает трафик)."""
+    return _parent_pid is not None
+
+
+def wait_predecessor_exit(poll: float = 1.0):
+    """Блокирует, пока жив предшественник.
+
+    EOF на pipe выхода; без pipe (предшественник старой версии) — пока
+    существует его PID.
+    """
+    global _exit_fd
+    if _parent_pid is None:
+        return
+    if _exit_fd is not None:
+        try:
+            while os.read(_exit_fd, 1):
+                pass
+        finally:
+            os.close(_exit_fd)
+            _exit_fd = None
+        return
+    while _pid_alive(_parent_pid):
+        time.sleep(poll)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def listen_socket(name: str, port: int) -> socket.socket:
+    """Слушающий сокет сервиса: унаследованный от предшественника или новый."""
+    fd = _inherited_fds.pop(name, None)
+    if fd is not None:
+        sock = socket.socket(fileno=fd)
+        logger.info("Reusing inherited socket for %s (fd=%d, port=%d)", name, fd, port)
+        return sock
+    return socket.create_server(("0.0.0.0", port), backlog=128)
+
+
+# === In-flight запросы ========================================================
+
+class InflightTracker:
+    """Счётчик запросов в обработке — WSGI-middleware поверх Flask-приложений."""
+
+    def __init__(self):
+        self._count = 0
+        self._cond = threading.Condition()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def wrap(self, wsgi_app):
+        def middleware(environ, start_response):
+            with self._cond:
+                self._count += 1
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                with self._cond:
+                    self._count -= 1
+                    self._cond.notify_all()
+        return middleware
+
+    def drain(self, timeout: float) -> bool:
+        """Дождаться завершения всех запросов. False — если вышел таймаут."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._count == 0, timeout=timeout)
+
+
+tracker = InflightTracker()
+
+
+# === Преемник =================================================================
+
+def spawn_successor(sockets: Dict[str, socket.socket]) -> subprocess.Popen:
+    """Запустить новый процесс с теми же аргументами и передать ему сокеты."""
+    env = dict(os.environ)
+    env[ENV_LISTEN_FDS] = ",".join(
+        f"{name}={sock.fileno()}" for name, sock in sockets.items()
+    )
+    env[ENV_RELOAD_PARENT] = str(os.getpid())
+    exit_r, exit_w = os.pipe()
+    env[ENV_RELOAD_EXIT_FD] = str(exit_r)
+    try:
+        proc = subprocess.Popen(
+            [sys.executable] + sys.argv,
+            env=env,
+            pass_fds=[sock.fileno() for sock in sockets.values()] + [exit_r],
+        )
+    except BaseException:
+        os.close(exit_w)
+        raise
+    finally:
+        os.close(exit_r)
+    _exit_pipes.append(exit_w)
+    logger.info("Spawned successor pid=%d", proc.pid)
+    return proc
+
+
+def can_reload() -> Optional[str]:
+    """None — reload возможен, иначе причина отказа.
+
+    Под systemd преемник переживёт старый процесс только при Type=notify
+    и NotifyAccess=all (новый MAINPID передаётся через sd_notify).
+    """
+    if os.environ.get("INVOCATION_ID") and not os.environ.get("NOTIFY_SOCKET"):
+        return "systemd unit must use Type=notify and NotifyAccess=all"
+    return None
+
+
+def notify_ready():
+    """Сообщить о готовности: systemd (MAINPID/READY) и предшественнику."""
+    sd_notify(f"MAINPID={os.getpid()}\nREADY=1")
+    if _parent_pid is not None:
+        try:
+            os.kill(_parent_pid, signal.SIGUSR2)
+            logger.info("Signalled predecessor pid=%d to drain", _parent_pid)
+        except ProcessLookupError:
+            logger.warning("Predecessor pid=%d already gone", _parent_pid)
+
+
+def sd_notify(state: str):
+    """Минимальная реализация sd_notify(3) без зависимости от libsystemd."""
+    addr = os.environ.get("NOTIFY_SOCKET")
+    if not addr:
+        return
+    if addr.startswith("@"):
+        addr = "\0" + addr[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.connect(addr)
+            s.sendall(state.encode())
+    except OSError as e:
+        logger.warning("sd_notify failed: %s", e)
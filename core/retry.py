@@ -8,6 +8,8 @@ import logging
 from telethon import TelegramClient
 
 import config
+from core import tracing
+from core.bridge import username_hits
 
 logger = logging.getLogger("core.retry")
 
@@ -32,6 +34,19 @@ def is_frozen_error(e: Exception) -> bool:
     return "frozenparticipant" in name or "frozen" in text
 
 
+STALE_PEER_ERRORS = (
+    "UsernameNotOccupiedError",
+    "PeerIdInvalidError",
+    "UserIdInvalidError",
+    "ChannelInvalidError",
+)
+
+
+def is_stale_peer_error(e: Exception) -> bool:
+    """Telegram не знает peer — возможно, устарела запись username → access_hash."""
+    return type(e).__name__ in STALE_PEER_ERRORS
+
+
 def is_flood_wait(e: Exception) -> bool:
     return type(e).__name__ == "FloodWaitError"
 
@@ -42,6 +57,11 @@ def flood_wait_seconds(e: Exception) -> int:
 
 async def reconnect_client(client: TelegramClient):
     """Disconnect + reconnect. Raises if authorization lost."""
+    with tracing.span("reconnect"):
+        await _reconnect(client)
+
+
+async def _reconnect(client: TelegramClient):
     logger.warning("Reconnecting Telethon client...")
     try:
         await client.disconnect()
@@ -55,6 +75,33 @@ async def reconnect_client(client: TelegramClient):
     logger.info("Reconnect successful")
 
 
+async def _call(coro_func, *args, **kwargs):
+    """
+    coro_func(*args, **kwargs); если упал на "peer не найден", а entity брались
+    из таблицы username'ов (core/bridge.py) — записи удаляются и вызов
+    повторяется один раз с честным ResolveUsername.
+    """
+    hits: list = []
+    token = username_hits.set(hits)
+    try:
+        return await coro_func(*args, **kwargs)
+    except Exception as e:
+        if not hits or not is_stale_peer_error(e):
+            raise
+        logger.warning(
+            "%s with cached usernames %s, re-resolving",
+            type(e).__name__, sorted({u for _, u in hits}),
+        )
+    finally:
+        username_hits.reset(token)
+    for bridge, uname in hits:
+        try:
+            bridge.forget_username(uname)
+        except Exception as e:
+            logger.warning("Failed to forget username %s: %s", uname, e)
+    return await coro_func(*args, **kwargs)
+
+
 async def run_with_retry(coro_func, client: TelegramClient, *args, **kwargs):
     """
     Вызывает coro_func(*args, **kwargs) с retry.
@@ -64,7 +111,7 @@ async def run_with_retry(coro_func, client: TelegramClient, *args, **kwargs):
     last_error = None
     for attempt in range(1, config.MAX_RETRIES + 1):
         try:
-            return await coro_func(*args, **kwargs)
+            return await _call(coro_func, *args, **kwargs)
         except RETRIABLE_ERRORS as e:
             last_error = e
             logger.warning(
@@ -9,8 +9,9 @@ core/router.py — AccountRouter: выбор аккаунта + failover + ба
      если привязки нет → least-loaded
 """
 import logging
-from typing import Optional
+from typing import Dict, List, Optional
 
+from core import metrics
 from core.bridge import TelethonBridge
 from core.pool import AccountPool
 from core.registry import ChatRegistry
@@ -21,6 +22,18 @@ import config
 logger = logging.getLogger("core.router")
 
 
+class BridgeStarting(Exception):
+    """Привязанный аккаунт ещё не поднялся после старта процесса.
+
+    Не RuntimeError: сервисы трактуют RuntimeError как «нет аккаунтов» и уходят
+    в Bot API, а здесь правильный ответ — 503 starting (см. app.py).
+    """
+
+    def __init__(self, bridge_name: str):
+        super().__init__(f"Bridge {bridge_name} is starting")
+        self.bridge_name = bridge_name
+
+
 class AccountRouter:
     """Роутер: связывает pool + registry. Балансировка по числу чатов."""
 
@@ -28,6 +41,12 @@ class AccountRouter:
         self.pool = pool
         self.registry = registry
 
+    def _check_starting(self, bridge: Optional[TelethonBridge]):
+        """Не переносим чат на другой аккаунт, пока его собственный ещё стартует."""
+        if (bridge is not None and not self.pool.started
+                and bridge.status in (bridge.STATUS_OFFLINE, bridge.STATUS_STARTING)):
+            raise BridgeStarting(bridge.name)
+
     def _pick_least_loaded(self, service: str,
                            exclude_key: str = "") -> Optional[TelethonBridge]:
         """Выбрать здоровый bridge с наименьшим количеством активных чатов."""
@@ -70,6 +89,7 @@ class AccountRouter:
             bridge = self.pool.get_by_account(assigned_account, service)
             if bridge and bridge.is_healthy:
                 return bridge
+            self._check_starting(bridge)
 
             # Failover — берём least-loaded вместо просто "следующего"
             current_key = f"{assigned_account}:{service}"
@@ -83,10 +103,8 @@ class AccountRouter:
                     f"No accounts for chat {chat_id}, service={service}"
                 )
 
-            self.registry.log_failover(
-                chat_str, assigned_account, new_bridge.account_name, reason,
-            )
-            self.registry.update_account(chat_str, new_bridge.account_name)
+            self.record_failover(service, chat_str, assigned_account,
+                                 new_bridge.account_name, reason)
             logger.warning(
                 "Failover for chat %s [%s]: %s → %s (%s)",
                 chat_id, service, assigned_account, new_bridge.account_name, reason,
@@ -99,6 +117,41 @@ class AccountRouter:
             raise RuntimeError(f"No healthy accounts for service={service}")
         return bridge
 
+    def pick_for_chats(self, chat_ids: List[str],
+                       service: str) -> Dict[str, TelethonBridge]:
+        """
+        Пакетный pick_for_chat для батч-эндпоинтов.
+        Привязки читаются из реестра одним запросом, счётчики чатов — тоже
+        один раз; непривязанные чаты раскладываются по least-loaded с
+        локальным инкрементом счётчика, чтобы батч не лёг на один аккаунт.
+        Нездоровые привязки идут через pick_for_chat (failover + лог).
+        Чатов без доступного аккаунта в ответе нет.
+        """
+        assigned = self.registry.get_accounts(chat_ids)
+        counts: Optional[Dict[str, int]] = None
+        out: Dict[str, TelethonBridge] = {}
+
+        for chat in dict.fromkeys(str(c) for c in chat_ids):
+            account = assigned.get(chat)
+            if account:
+                bridge = self.pool.get_by_account(account, service)
+                if bridge and bridge.is_healthy:
+                    out[chat] = bridge
+                    continue
+                try:
+                    out[chat] = self.pick_for_chat(chat, service)
+                except RuntimeError:
+                    pass
+                continue
+
+            if counts is None:
+                counts = dict(self.registry.get_account_chat_counts())
+            bridge = self.pool.get_least_loaded(service, counts)
+            if bridge is not None:
+                out[chat] = bridge
+                counts[bridge.account_name] = counts.get(bridge.account_name, 0) + 1
+        return out
+
     # === Для send_media (по user_id / username, без chat_id) ==================
 
     def pick_for_recipient(self, service: str = "send_media",
@@ -115,17 +168,15 @@ class AccountRouter:
                 bridge = self.pool.get_by_account(assigned, service)
                 if bridge and bridge.is_healthy:
                     return bridge
+                self._check_starting(bridge)
                 # Failover на least-loaded
                 current_key = f"{assigned}:{service}"
                 new_bridge = self._pick_least_loaded(
                     service, exclude_key=current_key,
                 )
                 if new_bridge:
-                    self.registry.log_failover(
-                        chat_str, assigned, new_bridge.account_name,
-                        "recipient failover",
-                    )
-                    self.registry.update_account(chat_str, new_bridge.account_name)
+                    self.record_failover(service, chat_str, assigned,
+                                         new_bridge.account_name, "recipient failover")
                     return new_bridge
                 if bridge:
                     return bridge
@@ -135,6 +186,20 @@ class AccountRouter:
             raise RuntimeError(f"No healthy accounts for service={service}")
         return bridge
 
+    # === Failover ==============================================================
+
+    def record_failover(self, service: str, chat_id: str, from_account: str,
+                        to_account: str, reason: str = ""):
+        """
+        Единственное место учёта failover'а: лог, метрика и перепривязка
+        чата. Перепривязка нужна и после failover'а внутри запроса (сервисы),
+        иначе следующий запрос снова уйдёт на старый аккаунт и failover
+        посчитается второй раз.
+        """
+        self.registry.log_failover(chat_id, from_account, to_account, reason)
+        metrics.FAILOVERS.inc(service, from_account)
+        self.registry.update_account(chat_id, to_account)
+
     # === Error handling ========================================================
 
     def handle_error(self, bridge: TelethonBridge, error: Exception,
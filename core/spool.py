@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+core/spool.py — Дисковый кэш файлов, скачанных по URL (send_media).
+
+Файлы лежат по sha256 содержимого: <MEDIA_SPOOL_DIR>/<ab>/<sha256>, один
+файл может обслуживать несколько URL. Индекс url → sha256 + ETag /
+Last-Modified хранится в таблице media_spool реестра.
+
+ - запись моложе MEDIA_SPOOL_REVALIDATE_AFTER используется без запроса к хосту;
+ - старше — условный GET (If-None-Match / If-Modified-Since), 304 → берём
+   файл с диска, 200 → качаем заново;
+ - суммарный размер ограничен MEDIA_SPOOL_MAX_BYTES, вытесняются давно
+   не использованные файлы (LRU); файлы, которые сейчас загружаются
+   (pinned()), не вытесняются.
+
+Сетевую часть делает core/uploader.py; здесь только хранение и индекс.
+Скачанные байты также использует Bot API fallback.
+"""
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, NamedTuple, Optional
+
+import config
+from core.registry import ChatRegistry
+
+logger = logging.getLogger("core.spool")
+
+
+class SpoolEntry(NamedTuple):
+    url: str
+    path: str
+    size: int
+    mime_type: str
+    filename: str
+    etag: str
+    last_modified: str
+    checked_at: float
+
+
+class SpoolWriter:
+    """Запись скачиваемого тела во временный файл спула (sha256 на лету)."""
+
+    def __init__(self, spool: "MediaSpool", url: str):
+        self._spool = spool
+        self.url = url
+        fd, self._tmp = tempfile.mkstemp(prefix="dl_", dir=spool.tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+        self._sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._sha.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, headers: Dict[str, str], mime_type: str,
+               filename: str) -> SpoolEntry:
+        self._file.close()
+        return self._spool._commit(
+            self.url, self._tmp, self._sha.hexdigest(), self.size,
+            headers, mime_type, filename,
+        )
+
+    def abort(self):
+        try:
+            self._file.close()
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+class MediaSpool:
+    """Файлы на диске + индекс в реестре."""
+
+    def __init__(self, registry: ChatRegistry, root: Optional[str] = None,
+                 max_bytes: Optional[int] = None):
+        self._registry = registry
+        self.root = root or config.MEDIA_SPOOL_DIR
+        self.max_bytes = config.MEDIA_SPOOL_MAX_BYTES if max_bytes is None else max_bytes
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._evict_lock = threading.Lock()
+        # sha256 → сколько загрузок сейчас читают файл (под _evict_lock)
+        self._pinned: Dict[str, int] = defaultdict(int)
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def lookup(self, url: str) -> Optional[SpoolEntry]:
+        """Запись для URL, если файл на месте (без обращения к хосту)."""
+        row = self._registry.get_spool_entry(url)
+        if row is None:
+            return None
+        path = self._path(row["sha256"])
+        if not os.path.isfile(path):
+            self._registry.delete_spool_entry(url)
+            return None
+        return SpoolEntry(
+            url, path, row["size"], row["mime_type"], row["filename"],
+            row["etag"], row["last_modified"], row["checked_at"],
+        )
+
+    def is_fresh(self, entry: SpoolEntry) -> bool:
+        return time.time() - entry.checked_at < config.MEDIA_SPOOL_REVALIDATE_AFTER
+
+    def touch(self, url: str, checked: bool = False):
+        self._registry.touch_spool_entry(url, checked=checked)
+
+    @contextlib.contextmanager
+    def pinned(self, entry: SpoolEntry) -> Iterator[str]:
+        """Защитить файл записи от evict() на время чтения.
+
+        FileNotFoundError — файл уже вытеснен (запись удаляется).
+        """
+        sha256 = os.path.basename(entry.path)
+        with self._evict_lock:
+            if not os.path.isfile(entry.path):
+                self._registry.delete_spool_entry(entry.url)
+                raise FileNotFoundError(entry.path)
+            self._pinned[sha256] += 1
+        try:
+            yield entry.path
+        finally:
+            with self._evict_lock:
+                self._pinned[sha256] -= 1
+                if self._pinned[sha256] <= 0:
+                    del self._pinned[sha256]
+
+    def writer(self, url: str) -> SpoolWriter:
+        return SpoolWriter(self, url)
+
+    def _commit(self, url: str, tmp: str, sha256: str, size: int,
+                headers: Dict[str, str], mime_type: str, filename: str) -> SpoolEntry:
+        path = self._path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp)  # то же содержимое уже есть (другой URL)
+        else:
+            os.replace(tmp, path)
+        etag = headers.get("ETag", "")
+        last_modified = headers.get("Last-Modified", "")
+        self._registry.save_spool_entry(
+            url, sha256, size, mime_type, filename, etag, last_modified,
+        )
+        self.evict()
+        return SpoolEntry(url, path, size, mime_type, filename,
+                          etag, last_modified, time.time())
+
+    def evict(self):
+        """Удалить давно не использованные файлы, пока спул больше лимита."""
+        with self._evict_lock:
+            usage = self._registry.get_spool_usage()
+            total = sum(u["size"] for u in usage)
+            for u in usage:
+                if total <= self.max_bytes:
+                    break
+                if self._pinned.get(u["sha256"]):
+                    continue
+                try:
+                    os.remove(self._path(u["sha256"]))
+                except OSError:
+                    pass
+                self._registry.delete_spool_file(u["sha256"])
+                total -= u["size"]
+                logger.info("Spool: evicted %s (%d bytes)", u["sha256"][:12], u["size"])
+
+
+def conditional_headers(entry: Optional[SpoolEntry]) -> Dict[str, str]:
+    """Заголовки условного GET для ревалидации записи."""
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+    return headers
+
+
+_spool: Optional[MediaSpool] = None
+
+
+def init(registry: ChatRegistry):
+    global _spool
+    if config.MEDIA_SPOOL_MAX_BYTES > 0:
+        _spool = MediaSpool(registry)
+
+
+def get() -> Optional[MediaSpool]:
+    """Спул или None, если выключен."""
+    return _spool
+
+
+def cached_path(url: str) -> Optional[SpoolEntry]:
+    """Уже скачанный файл для URL (для Bot API fallback), без ревалидации."""
+    if _spool is None:
+        return None
+    entry = _spool.lookup(url)
+    if entry is not None:
+        _spool.touch(url)
+    return entry
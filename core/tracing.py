@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+core/tracing.py — Трассировка фаз запроса (send_text / send_media / create_chat / leave_chat).
+
+Трейс открывается на HTTP-запрос (app.py, before_request) и лежит в
+contextvar. run_coroutine_threadsafe копирует контекст вызывающего потока
+в задачу event loop'а, поэтому span'ы из *_impl, core/retry и RPC
+(InstrumentedClient в core/bridge.py) попадают в трейс своего запроса,
+включая параллельные ветки asyncio.gather.
+
+    with tracing.span("load_participants"):
+        ...
+
+Без открытого трейса span() ничего не делает (фоновые задачи, батчи
+воркеров). По завершении запроса:
+ - заголовок Server-Timing: суммарное время по имени фазы + total;
+ - трейс попадает в список TRACE_KEEP_SLOWEST самых медленных
+   (GET /api/traces дашборда).
+"""
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+import config
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_depth: ContextVar[int] = ContextVar("trace_depth", default=0)
+
+
+class Trace:
+    """Span'ы одного запроса: (имя, начало от старта запроса, длительность, вложенность)."""
+
+    def __init__(self, service: str, endpoint: str):
+        self.service = service
+        self.endpoint = endpoint
+        self.ts = time.time()
+        self.started = time.perf_counter()
+        self.total_ms: Optional[float] = None
+        self.status: Optional[int] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, started: float, ended: float, depth: int, error: bool):
+        with self._lock:
+            if len(self.spans) >= config.TRACE_MAX_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append({
+                "name": name,
+                "start_ms": round((started - self.started) * 1000, 1),
+                "duration_ms": round((ended - started) * 1000, 1),
+                "depth": depth,
+                **({"error": True} if error else {}),
+            })
+
+    def finish(self, status: int):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+        self.status = status
+
+    def phases(self) -> Dict[str, float]:
+        """Суммарная длительность по имени span'а (верхний уровень и вложенные)."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for s in self.spans:
+                totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"]
+        return totals
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={dur:.1f}" for name, dur in self.phases().items()]
+        if self.total_ms is not None:
+            parts.append(f"total;dur={self.total_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "service": self.service,
+            "endpoint": self.endpoint,
+            "ts": self.ts,
+            "status": self.status,
+            "total_ms": round(self.total_ms or 0.0, 1),
+            "phases": {k: round(v, 1) for k, v in self.phases().items()},
+            "spans": spans,
+            "dropped_spans": self.dropped,
+        }
+
+
+# === Span API =================================================================
+
+def start(service: str, endpoint: str):
+    """Открыть трейс в текущем контексте; вернуть токен для end()."""
+    return _current.set(Trace(service, endpoint))
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def end(token, status: int) -> Optional[Trace]:
+    """Закрыть трейс, запомнить среди медленных и вернуть его."""
+    trace = _current.get()
+    _current.reset(token)
+    if trace is None:
+        return None
+    trace.finish(status)
+    slowest.offer(trace)
+    return trace
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _depth.reset(token)
+        trace.add(name, started, time.perf_counter(), depth, error)
+
+
+# === Самые медленные трейсы ===================================================
+
+class SlowestTraces:
+    """Min-heap по total_ms: хранит N самых медленных трейсов."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def offer(self, trace: Trace):
+        if self.size <= 0 or trace.total_ms is None:
+            return
+        item = (trace.total_ms, next(self._seq), trace)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def list(self, service: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = [t for _, _, t in self._heap]
+        if service:
+            traces = [t for t in traces if t.service == service]
+        return [t.to_dict() for t in sorted(traces, key=lambda t: -(t.total_ms or 0))]
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+
+
+slowest = SlowestTraces(config.TRACE_KEEP_SLOWEST)
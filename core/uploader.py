@@ -0,0 +1,633 @@
+# -*- coding: utf-8 -*-
+"""
+core/uploader.py — Загрузка медиа по URL в Telegram потоком.
+
+HTTP-тело читается кусками в executor'е и через ограниченную очередь
+(UPLOAD_BUFFER_PARTS) уходит прямо в SaveFilePart / SaveBigFilePart.
+Скачивание и загрузка идут одновременно, в памяти — не больше очереди.
+Если размер заранее неизвестен (нет Content-Length или тело сжато),
+файл сначала пишется на диск (спул или временный файл), потом грузится.
+Скачанное тело попутно сохраняется в дисковый спул (core/spool.py).
+
+Большие файлы (> 10 MB, SaveBigFilePart) грузятся параллельно: части
+раздаются UPLOAD_WORKERS воркерам, у каждого своё MTProto-соединение к
+домашнему DC аккаунта (тот же auth_key, отдельная MTProto-сессия), так что
+загрузка не занимает основной sender bridge'а. Соединения живут в
+SenderPool bridge'а и закрываются в TelethonBridge.stop(). Если
+доп. соединение недоступно — часть уходит через основной клиент.
+SenderPool собирает соединение из приватных атрибутов TelegramClient
+(версия Telethon закреплена в requirements.txt); если их нет — пул не
+создаётся и все части идут через основной клиент (публичный API).
+
+Результат — InputMedia (Uploaded Photo/Document), который можно отдать
+в send_file вместо URL.
+"""
+import asyncio
+import copy
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import unquote, urlparse
+
+import requests
+from telethon import TelegramClient, helpers, utils
+from telethon.network import MTProtoSender
+from telethon.tl import functions, types
+from telethon.tl.alltlobjects import LAYER
+
+import config
+from core import spool
+
+logger = logging.getLogger("core.uploader")
+
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024   # > 10 MB — SaveBigFilePart
+PHOTO_MIME_TYPES = ("image/jpeg", "image/png")
+
+InputFileHandle = Union[types.InputFile, types.InputFileBig]
+
+# Чтение HTTP-тела занимает поток на всё скачивание (и может висеть до
+# DOWNLOAD_READ_TIMEOUT) — свой пул, чтобы не выедать default executor
+_download_executor = ThreadPoolExecutor(max_workers=config.UPLOAD_DOWNLOAD_THREADS,
+                                        thread_name_prefix="upload-download")
+
+
+class DownloadError(Exception):
+    """Не удалось скачать источник.
+
+    Не OSError (как requests.RequestException): иначе run_with_retry примет
+    ошибку чужого хоста за сетевую проблему Telegram и переподключит клиента.
+    """
+
+
+class UploadedFile(NamedTuple):
+    handle: InputFileHandle
+    name: str
+    mime_type: str
+    size: int
+    attributes: List  # DocumentAttribute* (см. _describe)
+
+
+# === Метаданные ответа ========================================================
+
+def _filename(resp: requests.Response, url: str) -> str:
+    cd = resp.headers.get("Content-Disposition", "")
+    m = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", cd, re.IGNORECASE)
+    if m:
+        return os.path.basename(unquote(m.group(1).strip()))
+    name = os.path.basename(unquote(urlparse(url).path))
+    return name or "file"
+
+
+def _mime_type(resp: requests.Response, name: str) -> str:
+    ctype = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if ctype and ctype != "application/octet-stream":
+        return ctype
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def _content_length(resp: requests.Response) -> Optional[int]:
+    """Размер тела на проводе; None — если он не совпадёт с отданными байтами."""
+    if resp.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return None
+    try:
+        size = int(resp.headers.get("Content-Length", ""))
+    except ValueError:
+        return None
+    return size if size > 0 else None
+
+
+def _open(url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    try:
+        resp = requests.get(
+            url, stream=True, headers=headers or None,
+            timeout=(config.DOWNLOAD_CONNECT_TIMEOUT, config.DOWNLOAD_READ_TIMEOUT),
+        )
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        raise DownloadError(f"Failed to download {url}: {e}") from e
+    return resp
+
+
+def _iter_body(resp: requests.Response, chunk_size: int):
+    try:
+        yield from resp.iter_content(chunk_size)
+    except requests.RequestException as e:
+        raise DownloadError(f"Failed to download {resp.url}: {e}") from e
+
+
+# === Доп. соединения для загрузки ============================================
+
+class SenderPool:
+    """MTProto-соединения к домашнему DC аккаунта для параллельной загрузки."""
+
+    RETRY_COOLDOWN = 60  # сек до повторной попытки открыть упавший слот
+    # Внутренности TelegramClient, нужные _connect()
+    CLIENT_ATTRS = ("_log", "_connection", "_proxy", "_local_addr", "_init_request")
+
+    @classmethod
+    def supported(cls, client: TelegramClient) -> bool:
+        return all(hasattr(client, attr) for attr in cls.CLIENT_ATTRS)
+
+    def __init__(self, client: TelegramClient, size: int):
+        self.client = client
+        self.size = size
+        self._senders: List[Optional[MTProtoSender]] = [None] * size
+        self._failed_at: List[float] = [0.0] * size
+        self._lock = asyncio.Lock()
+
+    async def get(self, slot: int) -> Optional[MTProtoSender]:
+        """Подключённый sender слота или None (тогда — основной клиент)."""
+        sender = self._senders[slot]
+        if sender is not None and sender.is_connected():
+            return sender
+        if time.time() - self._failed_at[slot] < self.RETRY_COOLDOWN:
+            return None
+        async with self._lock:
+            sender = self._senders[slot]
+            if sender is not None and sender.is_connected():
+                return sender
+            try:
+                sender = await self._connect()
+            except Exception as e:
+                self._failed_at[slot] = time.time()
+                logger.warning("Upload sender #%d: connect failed: %s", slot, e)
+                return None
+            self._senders[slot] = sender
+            return sender
+
+    async def _connect(self) -> MTProtoSender:
+        client = self.client
+        session = client.session
+        sender = MTProtoSender(session.auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            session.server_address, session.port, session.dc_id,
+            loggers=client._log, proxy=client._proxy, local_addr=client._local_addr,
+        ))
+        # Новая MTProto-сессия с тем же ключом: initConnection перед работой
+        init = copy.copy(client._init_request)
+        init.query = functions.help.GetConfigRequest()
+        await sender.send(functions.InvokeWithLayerRequest(LAYER, init))
+        return sender
+
+    async def drop(self, slot: int):
+        sender, self._senders[slot] = self._senders[slot], None
+        self._failed_at[slot] = time.time()
+        if sender is not None:
+            try:
+                await sender.disconnect()
+            except Exception:
+                pass
+
+    async def close(self):
+        for slot in range(self.size):
+            sender, self._senders[slot] = self._senders[slot], None
+            if sender is not None:
+                try:
+                    await sender.disconnect()
+                except Exception:
+                    pass
+
+
+_unsupported_warned = False
+
+
+def sender_pool(bridge) -> Optional[SenderPool]:
+    """SenderPool bridge'а (создаётся при первой большой загрузке).
+
+    None — загрузка через основной клиент (выключено или Telethon без
+    нужных внутренностей).
+    """
+    global _unsupported_warned
+    if config.UPLOAD_WORKERS <= 1:
+        return None
+    pool = bridge.upload_senders
+    if pool is None or pool.client is not bridge.client:
+        if not SenderPool.supported(bridge.client):
+            if not _unsupported_warned:
+                _unsupported_warned = True
+                logger.warning(
+                    "Telethon client lacks %s: parallel upload disabled, "
+                    "using the main connection", ", ".join(SenderPool.CLIENT_ATTRS),
+                )
+            return None
+        pool = bridge.upload_senders = SenderPool(bridge.client, config.UPLOAD_WORKERS)
+    return pool
+
+
+# === Загрузка частей ==========================================================
+
+class PartUploader:
+    """Отправка частей одного файла (file_id) в Telegram по порядку."""
+
+    def __init__(self, client: TelegramClient, size: int,
+                 part_size: Optional[int] = None):
+        self.client = client
+        self.size = size
+        self.part_size = part_size or config.UPLOAD_PART_SIZE
+        self.file_id = helpers.generate_random_long()
+        self.total_parts = (size + self.part_size - 1) // self.part_size
+        self.is_big = size > BIG_FILE_THRESHOLD
+
+    def _request(self, index: int, data: bytes):
+        if self.is_big:
+            return functions.upload.SaveBigFilePartRequest(
+                self.file_id, index, self.total_parts, data,
+            )
+        return functions.upload.SaveFilePartRequest(self.file_id, index, data)
+
+    async def put(self, index: int, data: bytes):
+        if not await self.client(self._request(index, data)):
+            raise RuntimeError(f"Failed to upload file part {index}")
+
+    async def finish(self):
+        """Дождаться всех частей (у последовательной реализации — ничего)."""
+
+    def close(self):
+        """Прервать незавершённую загрузку."""
+
+    def handle(self, name: str, md5_checksum: str = "") -> InputFileHandle:
+        if self.is_big:
+            return types.InputFileBig(self.file_id, self.total_parts, name)
+        return types.InputFile(self.file_id, self.total_parts, name, md5_checksum)
+
+
+class ParallelPartUploader(PartUploader):
+    """Части раздаются воркерам, у каждого — своё соединение из SenderPool."""
+
+    def __init__(self, client: TelegramClient, size: int, senders: SenderPool,
+                 part_size: Optional[int] = None):
+        super().__init__(client, size, part_size)
+        self._senders = senders
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=senders.size * 2)
+        self._error: Optional[BaseException] = None
+        self._workers = [
+            asyncio.ensure_future(self._worker(slot)) for slot in range(senders.size)
+        ]
+
+    async def put(self, index: int, data: bytes):
+        if self._error is not None:
+            raise self._error
+        await self._queue.put((index, data))
+
+    async def _worker(self, slot: int):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    await self._send(slot, *item)
+                except Exception as e:
+                    self._error = e
+
+    async def _send(self, slot: int, index: int, data: bytes):
+        request = self._request(index, data)
+        sender = await self._senders.get(slot)
+        if sender is not None:
+            try:
+                if await asyncio.wait_for(sender.send(request), config.UPLOAD_PART_TIMEOUT):
+                    return
+            except Exception as e:
+                # Соединение или RPC-ошибка (FloodWait и т.п.) — повторяем
+                # часть через основной клиент, он умеет ждать и переподключаться
+                logger.warning("Upload sender #%d: part %d failed: %s", slot, index, e)
+                await self._senders.drop(slot)
+        if not await self.client(request):
+            raise RuntimeError(f"Failed to upload file part {index}")
+
+    async def finish(self):
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers)
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        for w in self._workers:
+            w.cancel()
+
+
+def _part_uploader(client: TelegramClient, size: int,
+                   senders: Optional[SenderPool]) -> PartUploader:
+    if senders is not None and size > BIG_FILE_THRESHOLD:
+        return ParallelPartUploader(client, size, senders)
+    return PartUploader(client, size)
+
+
+# === Атрибуты документа =======================================================
+
+def _describe(name: str, mime_type: str, path: Optional[str] = None) -> List:
+    """Атрибуты документа так, как их строит Telethon в send_file.
+
+    Длительность / размеры видео и аудио, исполнитель, название читаются
+    из файла (hachoir); без файла (поток без спула) — только по имени.
+    Файлы спула без расширения: тип Telethon определяет по имени загрузки.
+    """
+    if path is not None:
+        try:
+            with open(path, "rb") as f:
+                f.raw.name = name
+                return utils.get_attributes(f, mime_type=mime_type)[0]
+        except OSError:
+            pass  # файл успели вытеснить из спула
+    return utils.get_attributes(_NameOnly(name), mime_type=mime_type)[0]
+
+
+class _NameOnly:
+    """Файл без содержимого для get_attributes: тип — по имени, не читается."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def seekable(self) -> bool:
+        return False
+
+
+async def _describe_async(name: str, mime_type: str, path: Optional[str] = None) -> List:
+    return await asyncio.get_running_loop().run_in_executor(
+        None, _describe, name, mime_type, path,
+    )
+
+
+# === Потоковая загрузка =======================================================
+
+async def _stream(client: TelegramClient, resp: requests.Response, size: int,
+                  name: str, senders: Optional[SenderPool] = None,
+                  sink: Optional[spool.SpoolWriter] = None) -> InputFileHandle:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=config.UPLOAD_BUFFER_PARTS)
+    stop = threading.Event()
+    parts = _part_uploader(client, size, senders)
+
+    def _pump():
+        """Поток скачивания: куски тела → очередь (с backpressure)."""
+        try:
+            for chunk in _iter_body(resp, parts.part_size):
+                if stop.is_set():
+                    return
+                if sink is not None:
+                    sink.write(chunk)  # копия на диск (spool) в том же проходе
+                asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+            item = None
+        except BaseException as e:
+            item = e
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    loop.run_in_executor(_download_executor, _pump)
+    md5 = hashlib.md5() if not parts.is_big else None
+    buf = bytearray()
+    index = 0
+    received = 0
+    try:
+        while True:
+            chunk = await queue.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if chunk is not None:
+                buf += chunk
+                received += len(chunk)
+                if md5 is not None:
+                    md5.update(chunk)
+                if received > size:
+                    raise DownloadError(f"Body is larger than Content-Length ({size})")
+            while len(buf) >= parts.part_size or (chunk is None and buf):
+                data = bytes(buf[:parts.part_size])
+                del buf[:parts.part_size]
+                await parts.put(index, data)
+                index += 1
+            if chunk is None:
+                break
+        if received != size:
+            raise DownloadError(f"Body size {received} != Content-Length {size}")
+        await parts.finish()
+    finally:
+        parts.close()
+        stop.set()
+        # Освобождаем место в очереди, чтобы поток не завис на put(); сам поток
+        # увидит stop и завершится (не ждём его — чтение может висеть до таймаута)
+        while not queue.empty():
+            queue.get_nowait()
+        resp.close()
+
+    return parts.handle(name, md5.hexdigest() if md5 is not None else "")
+
+
+async def _upload_local(client: TelegramClient, path: str, size: int, name: str,
+                        senders: Optional[SenderPool] = None) -> InputFileHandle:
+    loop = asyncio.get_running_loop()
+    parts = _part_uploader(client, size, senders)
+    md5 = hashlib.md5() if not parts.is_big else None
+    try:
+        with open(path, "rb") as f:
+            for index in range(parts.total_parts):
+                data = await loop.run_in_executor(None, f.read, parts.part_size)
+                if md5 is not None:
+                    md5.update(data)
+                await parts.put(index, data)
+        await parts.finish()
+    finally:
+        parts.close()
+    return parts.handle(name, md5.hexdigest() if md5 is not None else "")
+
+
+async def _download_then_upload(client: TelegramClient, resp: requests.Response,
+                                name: str, senders: Optional[SenderPool] = None,
+                                sink: Optional[spool.SpoolWriter] = None
+                                ) -> Tuple[InputFileHandle, int, List]:
+    """Размер неизвестен — сначала на диск (в спул или временный файл), потом загрузка."""
+    loop = asyncio.get_running_loop()
+    if sink is None:
+        fd, path = tempfile.mkstemp(prefix="upload_", suffix=os.path.splitext(name)[1])
+        out = os.fdopen(fd, "wb")
+    else:
+        path, out = None, sink
+
+    def _download() -> int:
+        total = 0
+        for chunk in _iter_body(resp, config.UPLOAD_PART_SIZE):
+            out.write(chunk)
+            total += len(chunk)
+        return total
+
+    entry = None
+    try:
+        size = await loop.run_in_executor(_download_executor, _download)
+        if not size:
+            raise DownloadError(f"Empty body: {resp.url}")
+        if sink is None:
+            out.close()
+        else:
+            entry = await loop.run_in_executor(
+                None, sink.commit, resp.headers, _mime_type(resp, name), name,
+            )
+            path = entry.path
+        attributes = await _describe_async(name, _mime_type(resp, name), path)
+        handle = await _upload_local(client, path, size, name, senders)
+        return handle, size, attributes
+    except BaseException:
+        if sink is not None and entry is None:
+            sink.abort()
+        raise
+    finally:
+        resp.close()
+        if sink is None:
+            out.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def upload_url(client: TelegramClient, url: str,
+                     file_name: Optional[str] = None,
+                     senders: Optional[SenderPool] = None) -> UploadedFile:
+    """Скачать URL и загрузить в Telegram, не держа файл в памяти целиком.
+
+    С включённым спулом повторный URL берётся с диска (после ревалидации
+    по ETag / Last-Modified), а свежескачанное тело параллельно пишется в спул.
+    """
+    loop = asyncio.get_running_loop()
+    store = spool.get()
+    entry = store.lookup(url) if store is not None else None
+    if entry is not None and store.is_fresh(entry):
+        store.touch(url)
+        uploaded = await _from_spool(store, client, entry, file_name, senders)
+        if uploaded is not None:
+            return uploaded
+        entry = None
+
+    resp = await loop.run_in_executor(None, _open, url, spool.conditional_headers(entry))
+    if entry is not None and resp.status_code == 304:
+        resp.close()
+        store.touch(url, checked=True)
+        uploaded = await _from_spool(store, client, entry, file_name, senders)
+        if uploaded is not None:
+            return uploaded
+        resp = await loop.run_in_executor(None, _open, url, None)
+
+    name = file_name or _filename(resp, url)
+    mime_type = _mime_type(resp, name)
+    size = _content_length(resp)
+    sink = store.writer(url) if store is not None else None
+
+    started = time.time()
+    if size is None:
+        handle, size, attributes = await _download_then_upload(
+            client, resp, name, senders, sink,
+        )
+    else:
+        entry = None
+        try:
+            handle = await _stream(client, resp, size, name, senders, sink)
+        except BaseException:
+            if sink is not None:
+                sink.abort()
+            raise
+        if sink is not None:
+            try:
+                entry = await loop.run_in_executor(
+                    None, sink.commit, resp.headers, mime_type, name,
+                )
+            except Exception as e:
+                logger.warning("Spool: failed to store %s: %s", url, e)
+        attributes = await _describe_async(
+            name, mime_type, entry.path if entry is not None else None,
+        )
+    logger.info(
+        "Uploaded %s (%d bytes, %s) from %s in %.1fs",
+        name, size, mime_type, url, time.time() - started,
+    )
+    return UploadedFile(handle, name, mime_type, size, attributes)
+
+
+async def spooled(url: str) -> Optional[spool.SpoolEntry]:
+    """Запись спула для URL, актуальная на сейчас (при необходимости — 304).
+
+    None — спул выключен, URL ещё не скачивался или содержимое сменилось:
+    тогда файл скачивает upload_url.
+    """
+    store = spool.get()
+    entry = store.lookup(url) if store is not None else None
+    if entry is None:
+        return None
+    if store.is_fresh(entry):
+        store.touch(url)
+        return entry
+    loop = asyncio.get_running_loop()
+    try:
+        resp = await loop.run_in_executor(None, _open, url, spool.conditional_headers(entry))
+    except DownloadError as e:
+        logger.info("Spool: revalidation of %s failed: %s", url, e)
+        return None
+    resp.close()
+    if resp.status_code != 304:
+        return None
+    store.touch(url, checked=True)
+    return store.lookup(url)
+
+
+async def _from_spool(store: spool.MediaSpool, client: TelegramClient,
+                      entry: spool.SpoolEntry, file_name: Optional[str],
+                      senders: Optional[SenderPool]) -> Optional[UploadedFile]:
+    """Загрузка файла из спула; None — файл успели вытеснить, качать заново."""
+    try:
+        with store.pinned(entry) as path:
+            logger.info("Spool hit for %s (%d bytes)", entry.url, entry.size)
+            return await upload_path(
+                client, path, file_name or entry.filename or None, senders,
+                mime_type=entry.mime_type or None,
+            )
+    except FileNotFoundError:
+        logger.info("Spool entry for %s was evicted, downloading again", entry.url)
+        return None
+
+
+async def upload_path(client: TelegramClient, path: str,
+                      file_name: Optional[str] = None,
+                      senders: Optional[SenderPool] = None,
+                      mime_type: Optional[str] = None) -> UploadedFile:
+    """Загрузить локальный файл (большие — параллельно через senders)."""
+    size = os.path.getsize(path)
+    name = file_name or os.path.basename(path)
+    mime_type = mime_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+    started = time.time()
+    attributes = await _describe_async(name, mime_type, path)
+    handle = await _upload_local(client, path, size, name, senders)
+    logger.info(
+        "Uploaded %s (%d bytes, %s) in %.1fs",
+        path, size, mime_type, time.time() - started,
+    )
+    return UploadedFile(handle, name, mime_type, size, attributes)
+
+
+# === InputMedia ===============================================================
+
+def input_media(uploaded: UploadedFile, force_document: bool = False,
+                supports_streaming: bool = False):
+    """UploadedFile → InputMediaUploadedPhoto / InputMediaUploadedDocument."""
+    if (not force_document and uploaded.mime_type in PHOTO_MIME_TYPES
+            and isinstance(uploaded.handle, types.InputFile)):
+        return types.InputMediaUploadedPhoto(uploaded.handle)
+
+    attributes: List = []
+    for attr in uploaded.attributes:
+        if isinstance(attr, types.DocumentAttributeVideo):
+            if force_document:
+                continue
+            attr = copy.copy(attr)
+            attr.supports_streaming = supports_streaming
+        attributes.append(attr)
+    return types.InputMediaUploadedDocument(
+        file=uploaded.handle,
+        mime_type=uploaded.mime_type,
+        attributes=attributes,
+        force_file=force_document,
+    )
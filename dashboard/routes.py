@@ -13,6 +13,7 @@ dashboard/routes.py — Flask-дашборд для Егора.
 import asyncio
 import json
 import os
+import signal
 import subprocess
 import time
 import logging
@@ -26,6 +27,7 @@ import config
 from core.pool import AccountPool
 from core.registry import ChatRegistry
 from core.router import AccountRouter
+from core import bot_fallback, metrics, reload, tracing
 
 logger = logging.getLogger("dashboard")
 
@@ -132,8 +134,33 @@ def create_dashboard_app(pool, registry, router, loop) -> Flask:
             "total_errors": db_stats["total_errors"],
             "total_failovers": db_stats["total_failovers"],
             "pending_retries": _registry.get_failed_requests_count(),
+            "chat_pool": _registry.get_pool_summary(),
+            "delivery_queue": _registry.get_delivery_stats(),
+            "leave_tasks": _registry.get_leave_task_stats(),
         })
 
+    # --- Prometheus ---
+
+    @app.route("/metrics")
+    @requires_auth
+    def prometheus_metrics():
+        """Метрики в текстовом формате Prometheus (basic auth как у дашборда)."""
+        depth = {("bot_api", "queued"): bot_fallback.limiter.queued(),
+                 ("failed_requests", "pending"): _registry.get_failed_requests_count()}
+        for status, n in _registry.get_delivery_stats().items():
+            depth[("delivery", status)] = n
+        for status, n in _registry.get_leave_task_stats().items():
+            depth[("leave_tasks", status)] = n
+        depth[("chat_pool", "ready")] = sum(_registry.get_pool_summary().values())
+        metrics.QUEUE_DEPTH.replace(depth)
+        metrics.BRIDGE_UP.replace({
+            (b.name, b.status): 1 if b.is_healthy else 0 for b in _pool.bridges.values()
+        })
+        metrics.BRIDGE_DIALOGS.replace({
+            (b.name,): b.to_dict()["cache_size"] for b in _pool.bridges.values()
+        })
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     # --- API: load distribution ---
 
     @app.route("/api/load")
@@ -305,6 +332,14 @@ def create_dashboard_app(pool, registry, router, loop) -> Flask:
         fos = _registry.get_failover_log(limit=limit)
         return jsonify({"failovers": fos})
 
+    # --- API: slowest traces ---
+
+    @app.route("/api/traces")
+    @requires_auth
+    def api_traces():
+        """Самые медленные запросы с разбивкой по фазам (?service=send_text)."""
+        return jsonify({"traces": tracing.slowest.list(request.args.get("service"))})
+
     # --- API: system logs ---
 
     @app.route("/api/logs")
@@ -378,6 +413,14 @@ def create_dashboard_app(pool, registry, router, loop) -> Flask:
                     return jsonify({"status": "ok"})
             return jsonify({"error": "unknown bridge or not frozen"}), 400
 
+        elif action == "forget_username":
+            # Инвалидация username → (id, access_hash) у всех аккаунтов
+            username = (data.get("username") or "").strip().lstrip("@")
+            if not username:
+                return jsonify({"error": "username is required"}), 400
+            removed = _registry.delete_resolved_username(username)
+            return jsonify({"status": "ok", "removed": removed})
+
         elif action == "restart":
             try:
                 subprocess.Popen(
@@ -388,6 +431,14 @@ def create_dashboard_app(pool, registry, router, loop) -> Flask:
             except Exception as e:
                 return jsonify({"error": str(e)}), 500
 
+        elif action == "reload":
+            # Graceful reload: новый процесс забирает сокеты, старый дорабатывает
+            reason = reload.can_reload()
+            if reason:
+                return jsonify({"error": reason}), 409
+            os.kill(os.getpid(), signal.SIGHUP)
+            return jsonify({"status": "ok"})
+
         elif action == "start_debug_api":
             try:
                 subprocess.Popen(
@@ -429,10 +480,14 @@ def create_dashboard_app(pool, registry, router, loop) -> Flask:
                         "stdout": pull.stdout,
                         "stderr": pull.stderr,
                     }), 500
-                subprocess.Popen(
-                    ["systemctl", "restart", "telethon-platform"],
-                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-                )
+                # Новый код подхватываем через graceful reload, если он доступен
+                if reload.can_reload() is None:
+                    os.kill(os.getpid(), signal.SIGHUP)
+                else:
+                    subprocess.Popen(
+                        ["systemctl", "restart", "telethon-platform"],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    )
                 return jsonify({
                     "status": "ok",
                     "git_output": pull.stdout,
@@ -618,4 +673,15 @@ def create_dashboard_app(pool, registry, router, loop) -> Flask:
         ok = _pool is not None and any(b.is_healthy for b in _pool.bridges.values())
         return jsonify({"status": "ok" if ok else "not_ready"})
 
+    @app.route("/ready")
+    def api_ready():
+        """Готовность по сервисам: 200 — все готовы, 503 — кто-то ещё стартует."""
+        services = _pool.readiness()
+        all_ready = all(s["ready"] for s in services.values())
+        return jsonify({
+            "ready": all_ready,
+            "starting": not _pool.started,
+            "services": services,
+        }), 200 if all_ready else 503
+
     return app
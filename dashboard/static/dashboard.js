@@ -374,6 +374,26 @@ function restartPlatform() {
     .catch(e => alert('Ошибка перезапуска: ' + e));
 }
 
+function reloadPlatform() {
+    if (!confirm('Плавный перезапуск: новый процесс прогреется и заберёт трафик,\nтекущие запросы будут доработаны. Продолжить?')) {
+        return;
+    }
+    fetch('/api/control', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({action: 'reload'}),
+    })
+    .then(r => r.json())
+    .then(data => {
+        if (data.status === 'ok') {
+            alert('Плавный перезапуск запущен. Дашборд продолжит работать.');
+        } else {
+            alert('Ошибка: ' + data.error);
+        }
+    })
+    .catch(e => alert('Ошибка перезапуска: ' + e));
+}
+
 /* ========== SHOW MORE HELPERS ========== */
 
 function showMoreBar(total, shown, showMoreFn, collapseFn) {
@@ -561,6 +581,42 @@ function showMoreFos(all) {
 }
 function collapseFos() { _shownFos = PAGE_SIZE; renderFos(); }
 
+/* ========== SLOW TRACES ========== */
+
+let _allTraces = [];
+
+function refreshTraces() {
+    fetch('/api/traces')
+        .then(r => r.json())
+        .then(data => {
+            _allTraces = data.traces || [];
+            renderTraces();
+        })
+        .catch(() => {});
+}
+
+function renderTraces() {
+    const tbody = document.getElementById('traces-tbody');
+    let html = '';
+    for (const t of _allTraces) {
+        const phases = Object.entries(t.phases || {})
+            .sort((a, b) => b[1] - a[1])
+            .map(([name, ms]) => `${esc(name)}: ${Math.round(ms)}`)
+            .join(', ');
+        const spans = (t.spans || [])
+            .map(s => `${'  '.repeat(s.depth)}${s.name} +${s.start_ms} ${s.duration_ms}ms${s.error ? ' !' : ''}`)
+            .join('\n');
+        html += `<tr>
+            <td>${fmtTime(t.ts)}</td>
+            <td>${esc(SERVICE_NAMES[t.service] || t.service)}</td>
+            <td>${esc(String(t.status))}</td>
+            <td>${Math.round(t.total_ms)}</td>
+            <td class="detail" title="${esc(spans)}">${phases}</td>
+        </tr>`;
+    }
+    tbody.innerHTML = html || '<tr><td colspan="5" class="empty-row">Запросов пока не было</td></tr>';
+}
+
 /* ========== FAILED REQUESTS ========== */
 
 const DIRECTION_NAMES = {
@@ -960,6 +1016,9 @@ function initTabs() {
             if (btn.dataset.tab === 'failed' && _allFailed.length === 0) {
                 refreshFailed();
             }
+            if (btn.dataset.tab === 'traces') {
+                refreshTraces();
+            }
         });
     });
 }
@@ -4,6 +4,8 @@ services/create_chat.py — POST /create_chat
 
 Создание супергруппы, приглашение участников, повышение ботов.
 Привязывает созданный чат к аккаунту в реестре.
+Если у аккаунта есть заготовленная группа (пул, CREATE_POOL_SIZE) —
+берётся она: переименование + приглашение клиента вместо создания с нуля.
 
 JSON запрос (не меняется):
 {
@@ -13,17 +15,17 @@ JSON запрос (не меняется):
 """
 import asyncio
 import logging
-import threading
-from typing import Any, Dict, List, Optional
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests as http_requests
 from flask import Blueprint, request, jsonify
-from telethon import functions, types
+from telethon import errors as tl_errors, functions, types
 from telethon.utils import get_peer_id
 
 from core.bridge import TelethonBridge
 from core.router import AccountRouter
 from core.retry import run_with_retry
+from core import delivery, idempotency, tracing
 import config
 
 logger = logging.getLogger("svc.create_chat")
@@ -43,20 +45,35 @@ def _run(coro, timeout=120):
     return asyncio.run_coroutine_threadsafe(coro, _loop).result(timeout=timeout)
 
 
+# Паузы перед попытками повысить бота (первая — сразу)
+PROMOTE_RETRY_DELAYS = (0, 0.5, 1.5)
+
+
 # === Helpers (из оригинального create_chat) ===================================
 
 async def _resolve_idents(bridge: TelethonBridge, idents: List[str]) -> Dict[str, Any]:
-    out: Dict[str, Any] = {}
-    for raw in idents:
-        s = (raw or "").strip()
-        if not s:
-            continue
+    """Resolve всех идентификаторов одновременно."""
+    keys = list(dict.fromkeys((raw or "").strip() for raw in idents))
+    keys = [k for k in keys if k]
+
+    async def _one(s: str):
         try:
-            ent = await bridge.get_entity(s)
-            out[s] = ent
+            return await bridge.get_entity(s)
         except Exception as e:
-            out[s] = {"error": str(e)}
-    return out
+            return {"error": str(e)}
+
+    results = await asyncio.gather(*(_one(k) for k in keys))
+    return dict(zip(keys, results))
+
+
+async def _timed(timings: Dict[str, int], step: str, coro):
+    """Выполнить шаг и записать его длительность (мс) в debug.timings_ms."""
+    started = time.monotonic()
+    try:
+        with tracing.span(step):
+            return await coro
+    finally:
+        timings[step] = int((time.monotonic() - started) * 1000)
 
 
 async def _export_invite(bridge: TelethonBridge, channel: Any) -> Optional[str]:
@@ -69,66 +86,129 @@ async def _export_invite(bridge: TelethonBridge, channel: Any) -> Optional[str]:
         return None
 
 
-async def _promote_bot_admin(bridge: TelethonBridge, channel_peer: Any,
-                             bot_user: types.User) -> str:
+def _rights_variants() -> List[Tuple[str, types.ChatAdminRights]]:
+    """Наборы прав от полного к минимальному: (имя варианта, права)."""
     rights_variants = []
     try:
-        rights_variants.append(types.ChatAdminRights(
+        rights_variants.append(("stories", types.ChatAdminRights(
             change_info=True, post_messages=True, edit_messages=True,
             delete_messages=True, ban_users=True, invite_users=True,
             pin_messages=True, add_admins=True, anonymous=False,
             manage_call=True, manage_topics=True,
             post_stories=True, edit_stories=True, delete_stories=True,
-        ))
+        )))
     except TypeError:
         pass
     try:
-        rights_variants.append(types.ChatAdminRights(
+        rights_variants.append(("topics", types.ChatAdminRights(
             change_info=True, post_messages=True, edit_messages=True,
             delete_messages=True, ban_users=True, invite_users=True,
             pin_messages=True, add_admins=True, anonymous=False,
             manage_call=True, manage_topics=True,
-        ))
+        )))
     except TypeError:
         pass
     try:
-        rights_variants.append(types.ChatAdminRights(
+        rights_variants.append(("call", types.ChatAdminRights(
             change_info=True, post_messages=True, edit_messages=True,
             delete_messages=True, ban_users=True, invite_users=True,
             pin_messages=True, add_admins=True, anonymous=False,
             manage_call=True,
-        ))
+        )))
     except TypeError:
         pass
     if not rights_variants:
-        rights_variants.append(types.ChatAdminRights(
+        rights_variants.append(("minimal", types.ChatAdminRights(
             change_info=True, delete_messages=True, ban_users=True,
             invite_users=True, pin_messages=True, add_admins=True,
             anonymous=False, manage_call=True,
-        ))
+        )))
+    return rights_variants
 
-    last_error = None
-    for rights in rights_variants:
+
+# Рабочий вариант прав для (аккаунт, bot_id): память + таблица admin_rights_variants.
+# Повышение стоит один EditAdminRequest; перебор — только если сервер
+# отверг запомненный вариант (RightForbidden и т.п.).
+_rights_memo: Dict[Tuple[str, int], Optional[str]] = {}
+
+
+def _remembered_variant(account_name: str, bot_id: int) -> Optional[str]:
+    key = (account_name, bot_id)
+    if key not in _rights_memo:
+        _rights_memo[key] = _router.registry.get_rights_variant(account_name, bot_id)
+    return _rights_memo[key]
+
+
+def _remember_variant(account_name: str, bot_id: int, variant: Optional[str]):
+    _rights_memo[(account_name, bot_id)] = variant
+    try:
+        if variant:
+            _router.registry.save_rights_variant(account_name, bot_id, variant)
+        else:
+            _router.registry.delete_rights_variant(account_name, bot_id)
+    except Exception as e:
+        logger.warning("Failed to persist rights variant for bot %s: %s", bot_id, e)
+
+
+def _is_rights_rejection(e: Exception) -> bool:
+    return isinstance(e, (tl_errors.RightForbiddenError, tl_errors.BannedRightsInvalidError))
+
+
+def _is_not_participant(e: Exception) -> bool:
+    """Бот ещё не «доехал» до группы после инвайта — повышение стоит повторить."""
+    return (isinstance(e, tl_errors.UserNotParticipantError)
+            or "USER_NOT_PARTICIPANT" in str(e))
+
+
+async def _promote_bot_admin(bridge: TelethonBridge, channel_peer: Any,
+                             bot_user: types.User) -> Tuple[str, Optional[Exception]]:
+    """("ok", None) или ("error:...", ошибка последнего EditAdmin)."""
+    iu = types.InputUser(bot_user.id, bot_user.access_hash)
+
+    async def _edit(rights) -> Optional[Exception]:
         try:
-            iu = types.InputUser(bot_user.id, bot_user.access_hash)
             await bridge.client(functions.channels.EditAdminRequest(
                 channel=channel_peer, user_id=iu,
                 admin_rights=rights, rank="Admin Bot",
             ))
-            return "ok"
+        except tl_errors.RightsNotModifiedError:
+            pass  # такие права у бота уже есть
         except Exception as e:
-            last_error = e
-    return f"error:{last_error}"
-
-
-# === Основная логика ==========================================================
+            return e
+        return None
 
-async def _create_chat_impl(bridge: TelethonBridge, title: str,
-                             usernames: List[str]) -> Dict[str, Any]:
-    debug: Dict[str, Any] = {"account": bridge.name, "idents_sample": usernames[:2]}
+    rights_variants = _rights_variants()
+    remembered = _remembered_variant(bridge.account_name, bot_user.id)
+    if remembered:
+        known = dict(rights_variants)
+        if remembered in known:
+            err = await _edit(known[remembered])
+            if err is None:
+                return "ok", None
+            if not _is_rights_rejection(err):
+                # FloodWait, бот ещё не в группе и т.п. — другой набор прав не поможет
+                return f"error:{err}", err
+            logger.info("Rights variant %s rejected for bot %s (%s), probing",
+                        remembered, bot_user.id, err)
+        rights_variants = [(n, r) for n, r in rights_variants if n != remembered]
 
-    # 1) Resolve users
-    resolved = await _resolve_idents(bridge, usernames)
+    last_error = None
+    for name, rights in rights_variants:
+        last_error = await _edit(rights)
+        if last_error is None:
+            if name != remembered:
+                _remember_variant(bridge.account_name, bot_user.id, name)
+            return "ok", None
+        if not _is_rights_rejection(last_error):
+            return f"error:{last_error}", last_error  # перебор прав тут не поможет
+    if remembered:
+        _remember_variant(bridge.account_name, bot_user.id, None)
+    return f"error:{last_error}", last_error
+
+
+# === Шаги создания чата =======================================================
+
+def _split_resolved(resolved: Dict[str, Any]):
     ok_users: List[Any] = []
     resolve_failed: List[str] = []
     for k, v in resolved.items():
@@ -136,29 +216,24 @@ async def _create_chat_impl(bridge: TelethonBridge, title: str,
             resolve_failed.append(f"{k}: {v['error']}")
         else:
             ok_users.append(v)
-    debug["resolve_failed"] = resolve_failed
-    if not ok_users:
-        return {"error": "no resolvable users", "debug": debug}
+    return ok_users, resolve_failed
+
 
-    # 2) Create supergroup
+async def _create_supergroup(bridge: TelethonBridge, title: str) -> Optional[types.Channel]:
     upd = await bridge.client(functions.channels.CreateChannelRequest(
         title=title, about="", megagroup=True, for_import=False,
     ))
-
-    # 3) Get channel entity
-    channel_ent = None
+    # Каждое создание (запрос и пул) — в лог: общий суточный лимит аккаунта
+    _router.registry.log_operation(bridge.account_name, "", "create_channel", "ok",
+                                   detail=title)
     if getattr(upd, "chats", None):
         for c in upd.chats:
             if isinstance(c, types.Channel) and getattr(c, "megagroup", True):
-                channel_ent = c
-                break
-    if channel_ent is None:
-        return {"error": "cannot determine created supergroup", "debug": debug}
+                return c
+    return None
 
-    channel_peer = channel_ent
-    watched_id = get_peer_id(channel_ent)
 
-    # 4) Open history
+async def _open_history(bridge: TelethonBridge, channel_peer: Any, debug: Dict[str, Any]):
     try:
         await bridge.client(functions.channels.TogglePreHistoryHiddenRequest(
             channel=channel_peer, enabled=False,
@@ -167,12 +242,15 @@ async def _create_chat_impl(bridge: TelethonBridge, title: str,
     except Exception as e:
         debug["open_history"] = f"error:{e}"
 
-    # 5) Invite users + promote bots
+
+async def _invite_users(bridge: TelethonBridge, channel_peer: Any, users: List[Any],
+                        debug: Dict[str, Any]) -> List[types.User]:
+    """Пригласить пользователей; возвращает User'ов (для повышения ботов)."""
     invite_failed: List[str] = []
     users_meta: List[types.User] = []
     try:
         batch = []
-        for u in ok_users:
+        for u in users:
             ent = u
             if not hasattr(ent, "access_hash"):
                 ent = await bridge.get_entity(u)
@@ -188,48 +266,142 @@ async def _create_chat_impl(bridge: TelethonBridge, title: str,
         debug["invite"] = "error"
         invite_failed.append(str(e))
     debug["invite_failed"] = invite_failed
-
-    # 5.1) Promote bots
+    return users_meta
+
+
+async def _promote_bot_with_retry(bridge: TelethonBridge, channel_peer: Any,
+                                  bot_user: types.User) -> str:
+    """Повышение сразу после инвайта иногда не проходит, пока участник не
+    «доехал» до группы — повторяем с короткой паузой вместо фиксированного sleep.
+    Только в этом случае: отказ по правам (перебор уже был), FloodWait и
+    прочие ошибки возвращаются сразу."""
+    res = ""
+    for delay in PROMOTE_RETRY_DELAYS:
+        if delay:
+            await asyncio.sleep(delay)
+        res, err = await _promote_bot_admin(bridge, channel_peer, bot_user)
+        if err is None or not _is_not_participant(err):
+            break
+    return res
+
+
+async def _promote_bots(bridge: TelethonBridge, channel_peer: Any,
+                        users_meta: List[types.User], debug: Dict[str, Any]):
+    bots = [usr for usr in users_meta if getattr(usr, "bot", False)]
+    if not bots:
+        debug["promote_bots"] = ["no_bots_detected"]
+        return
     try:
-        await asyncio.sleep(1)
-        promote_results: List[str] = []
-        for usr in users_meta:
-            if getattr(usr, "bot", False):
-                res = await _promote_bot_admin(bridge, channel_peer, usr)
-                promote_results.append(f"@{usr.username or usr.id}: {res}")
-        debug["promote_bots"] = promote_results or ["no_bots_detected"]
+        results = await asyncio.gather(*(
+            _promote_bot_with_retry(bridge, channel_peer, usr) for usr in bots
+        ))
+        debug["promote_bots"] = [
+            f"@{usr.username or usr.id}: {res}" for usr, res in zip(bots, results)
+        ]
     except Exception as e:
         debug["promote_bots_error"] = str(e)
 
-    # 5.2) Invite AMO observer (if chat created by non-main account)
-    if config.AMO_OBSERVER_USERNAME and bridge.account_name != "main":
-        try:
-            amo_user = await bridge.get_entity(config.AMO_OBSERVER_USERNAME)
-            amo_input = types.InputUser(amo_user.id, amo_user.access_hash)
-            invite_result = await bridge.client(functions.channels.InviteToChannelRequest(
-                channel=channel_peer, users=[amo_input],
-            ))
-            # Check missing_invitees — users blocked by privacy settings
-            missing = getattr(invite_result, 'missing_invitees', [])
-            if missing:
-                debug["amo_invite"] = f"missing:{[getattr(m,'user_id','?') for m in missing]}"
-                logger.warning("AMO observer %s MISSING (privacy?) in chat %s: %s",
-                               config.AMO_OBSERVER_USERNAME, watched_id, missing)
-            else:
-                debug["amo_invite"] = "ok"
-                logger.info("AMO observer %s invited OK into chat %s (bridge=%s)",
-                            config.AMO_OBSERVER_USERNAME, watched_id, bridge.name)
-        except Exception as e:
-            debug["amo_invite"] = f"error:{e}"
-            logger.warning("Failed to invite AMO observer %s into chat %s: %s",
-                           config.AMO_OBSERVER_USERNAME, watched_id, e)
-    else:
+
+async def _invite_and_promote(bridge: TelethonBridge, channel_peer: Any,
+                              users: List[Any], debug: Dict[str, Any],
+                              timings: Dict[str, int]) -> List[types.User]:
+    """Инвайт → повышение ботов (повышение зависит от инвайта)."""
+    users_meta = await _timed(
+        timings, "invite", _invite_users(bridge, channel_peer, users, debug),
+    )
+    await _timed(
+        timings, "promote_bots", _promote_bots(bridge, channel_peer, users_meta, debug),
+    )
+    return users_meta
+
+
+def _amo_expected(bridge: TelethonBridge) -> bool:
+    return bool(config.AMO_OBSERVER_USERNAME) and bridge.account_name != "main"
+
+
+async def _invite_amo_observer(bridge: TelethonBridge, channel_peer: Any,
+                               watched_id: int, debug: Dict[str, Any]) -> Optional[int]:
+    """Invite AMO observer (if chat created by non-main account). Возвращает его id."""
+    if not _amo_expected(bridge):
         logger.info("AMO observer skip: username=%s, account=%s",
                     config.AMO_OBSERVER_USERNAME, bridge.account_name)
+        return None
+    try:
+        amo_user = await bridge.get_entity(config.AMO_OBSERVER_USERNAME)
+        amo_input = types.InputUser(amo_user.id, amo_user.access_hash)
+        invite_result = await bridge.client(functions.channels.InviteToChannelRequest(
+            channel=channel_peer, users=[amo_input],
+        ))
+        # Check missing_invitees — users blocked by privacy settings
+        missing = getattr(invite_result, 'missing_invitees', [])
+        if missing:
+            debug["amo_invite"] = f"missing:{[getattr(m,'user_id','?') for m in missing]}"
+            logger.warning("AMO observer %s MISSING (privacy?) in chat %s: %s",
+                           config.AMO_OBSERVER_USERNAME, watched_id, missing)
+            return None
+        debug["amo_invite"] = "ok"
+        logger.info("AMO observer %s invited OK into chat %s (bridge=%s)",
+                    config.AMO_OBSERVER_USERNAME, watched_id, bridge.name)
+        return amo_user.id
+    except Exception as e:
+        debug["amo_invite"] = f"error:{e}"
+        logger.warning("Failed to invite AMO observer %s into chat %s: %s",
+                       config.AMO_OBSERVER_USERNAME, watched_id, e)
+        return None
+
+
+# === Основная логика ==========================================================
+
+async def _create_chat_impl(bridge: TelethonBridge, title: str,
+                             usernames: List[str],
+                             pool_state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Граф шагов: resolve → (пул | создание группы) → параллельно
+    [история, инвайт → повышение ботов, AMO observer, invite-ссылка].
+    Длительности шагов — в debug.timings_ms.
+
+    pool_state переживает повторы run_with_retry: взятая из пула группа
+    используется повторно, а не берётся новая (см. _create_chat).
+    """
+    started = time.monotonic()
+    timings: Dict[str, int] = {}
+    debug: Dict[str, Any] = {
+        "account": bridge.name, "idents_sample": usernames[:2], "timings_ms": timings,
+    }
+
+    # 1) Resolve users (все одновременно)
+    resolved = await _timed(timings, "resolve", _resolve_idents(bridge, usernames))
+    ok_users, resolve_failed = _split_resolved(resolved)
+    debug["resolve_failed"] = resolve_failed
+    if not ok_users:
+        return {"error": "no resolvable users", "debug": debug}
+
+    # 1.1) Заготовленная группа из пула — только переименовать и пригласить
+    pooled = await _take_from_pool(bridge, title, ok_users, debug, timings,
+                                   pool_state if pool_state is not None else {})
+    if pooled is not None:
+        timings["total"] = int((time.monotonic() - started) * 1000)
+        return pooled
+
+    # 2) Create supergroup, 3) get channel entity
+    channel_ent = await _timed(timings, "create", _create_supergroup(bridge, title))
+    if channel_ent is None:
+        return {"error": "cannot determine created supergroup", "debug": debug}
+
+    channel_peer = channel_ent
+    watched_id = get_peer_id(channel_ent)
 
-    # 6) Invite link
-    invite_link = await _export_invite(bridge, channel_peer) or None
+    # 4–6) Независимые шаги — одновременно
+    _, _, _, invite_link = await asyncio.gather(
+        _timed(timings, "open_history", _open_history(bridge, channel_peer, debug)),
+        _invite_and_promote(bridge, channel_peer, ok_users, debug, timings),
+        _timed(timings, "amo_invite",
+               _invite_amo_observer(bridge, channel_peer, watched_id, debug)),
+        _timed(timings, "export_invite", _export_invite(bridge, channel_peer)),
+    )
+    invite_link = invite_link or None
     debug["export_invite"] = "ok" if invite_link else "none"
+    timings["total"] = int((time.monotonic() - started) * 1000)
 
     return {
         "status": "ok",
@@ -240,42 +412,238 @@ async def _create_chat_impl(bridge: TelethonBridge, title: str,
     }
 
 
+# === Пул заготовленных групп ==================================================
+# Заготовку создаёт фоновый провизионер (run_pool_provisioner) под названием
+# CREATE_POOL_TITLE: история открыта, CREATE_POOL_MEMBERS приглашены, боты
+# повышены, AMO observer добавлен, ссылка выгружена. Запрос на create_chat
+# забирает заготовку своего аккаунта и только переименовывает её.
+
+# account_name → время последнего create_chat (провизионер ждёт «тишины»)
+_last_create: Dict[str, float] = {}
+
+
+async def _rename_pool_chat(bridge: TelethonBridge, channel_peer: Any, title: str):
+    try:
+        await bridge.client(functions.channels.EditTitleRequest(
+            channel=channel_peer, title=title,
+        ))
+    except tl_errors.ChatNotModifiedError:
+        pass  # повтор после сетевой ошибки — уже переименована
+
+
+async def _take_from_pool(bridge: TelethonBridge, title: str, ok_users: List[Any],
+                          debug: Dict[str, Any], timings: Dict[str, int],
+                          state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if config.CREATE_POOL_SIZE <= 0 and "row" not in state:
+        return None
+    row = state.get("row")  # повтор run_with_retry — та же группа
+    if row is None:
+        row = _router.registry.take_pool_chat(bridge.account_name)
+        if row is None:
+            debug["pool"] = "empty"
+            return None
+        state["row"] = row
+
+    channel_peer = types.InputChannel(row["channel_id"], row["access_hash"])
+    watched_id = get_peer_id(types.PeerChannel(row["channel_id"]))
+    try:
+        await _timed(timings, "rename", _rename_pool_chat(bridge, channel_peer, title))
+    except (ConnectionError, OSError, asyncio.TimeoutError):
+        raise  # группа остаётся за запросом (state), повтор её переиспользует
+    except Exception as e:
+        # Группа удалена / аккаунт из неё выкинут — создаём обычным путём
+        logger.warning("Pooled chat %s unusable (%s), creating a new one", watched_id, e)
+        _router.registry.set_pool_chat_status(row["id"], "broken")
+        state.pop("row", None)
+        debug["pool"] = f"broken:{e}"
+        return None
+    debug["pool"] = "hit"
+    state["invited"] = True  # дальше группа уже не «чистая» заготовка
+
+    # Кто уже в заготовке (CREATE_POOL_MEMBERS, AMO) — не приглашаем повторно
+    members = set(row["members"])
+    new_users = [u for u in ok_users if str(getattr(u, "id", "")) not in members]
+    steps = [_invite_and_promote(bridge, channel_peer, new_users, debug, timings)]
+    if not row["invite_link"]:
+        steps.append(_timed(timings, "export_invite", _export_invite(bridge, channel_peer)))
+    if await _pool_missing_amo(bridge, members):
+        # При провижининге AMO не добавился — добавляем, как в обычном пути
+        steps.append(_timed(timings, "amo_invite",
+                            _invite_amo_observer(bridge, channel_peer, watched_id, debug)))
+    results = await asyncio.gather(*steps)
+    invite_link = row["invite_link"] or results[1] or None
+    debug["export_invite"] = "ok" if invite_link else "none"
+    state["done"] = True
+    logger.info("create_chat from pool: %s → %s (account=%s)",
+                watched_id, title, bridge.account_name)
+    return {
+        "status": "ok",
+        "title": title,
+        "chat_id": str(watched_id),
+        "invite_link": invite_link,
+        "debug": debug,
+    }
+
+
+async def _pool_missing_amo(bridge: TelethonBridge, members: set) -> bool:
+    """AMO observer должен быть в группе, но его нет среди участников заготовки."""
+    if not _amo_expected(bridge):
+        return False
+    try:
+        amo_user = await bridge.get_entity(config.AMO_OBSERVER_USERNAME)
+    except Exception:
+        return True  # не знаем id — пусть _invite_amo_observer разберётся
+    return str(amo_user.id) not in members
+
+
+async def _release_pool_chat(bridge: TelethonBridge, state: Dict[str, Any]):
+    """Запрос не удался с взятой из пула группой: вернуть её или списать."""
+    row = state.get("row")
+    if row is None or state.get("done"):
+        return
+    if state.get("invited"):
+        # Клиенту/ботам уже могли уйти приглашения — выдавать другому нельзя
+        _router.registry.set_pool_chat_status(row["id"], "broken")
+        logger.warning("Pooled chat %s abandoned after failed create_chat", row["channel_id"])
+        return
+    try:
+        await _rename_pool_chat(
+            bridge, types.InputChannel(row["channel_id"], row["access_hash"]),
+            config.CREATE_POOL_TITLE,
+        )
+        _router.registry.set_pool_chat_status(row["id"], "ready")
+    except Exception as e:
+        logger.warning("Pooled chat %s: cannot return to pool: %s", row["channel_id"], e)
+        _router.registry.set_pool_chat_status(row["id"], "broken")
+
+
+async def _create_chat(bridge: TelethonBridge, title: str,
+                       usernames: List[str]) -> Dict[str, Any]:
+    """_create_chat_impl с retry; взятая из пула группа не теряется между повторами."""
+    pool_state: Dict[str, Any] = {}
+    try:
+        return await run_with_retry(
+            _create_chat_impl, bridge.client, bridge, title, usernames, pool_state,
+        )
+    except BaseException:
+        await asyncio.shield(_release_pool_chat(bridge, pool_state))
+        raise
+
+
+async def _provision_chat(bridge: TelethonBridge) -> int:
+    """Создать одну заготовку и положить её в пул. Возвращает id записи."""
+    timings: Dict[str, int] = {}
+    debug: Dict[str, Any] = {"timings_ms": timings}
+    resolved = await _resolve_idents(bridge, config.CREATE_POOL_MEMBERS)
+    members, failed = _split_resolved(resolved)
+    if failed:
+        logger.warning("Chat pool: unresolved members for %s: %s", bridge.name, failed)
+
+    channel_ent = await _create_supergroup(bridge, config.CREATE_POOL_TITLE)
+    if channel_ent is None:
+        raise RuntimeError("cannot determine created supergroup")
+    watched_id = get_peer_id(channel_ent)
+
+    _, users_meta, amo_id, invite_link = await asyncio.gather(
+        _open_history(bridge, channel_ent, debug),
+        _invite_and_promote(bridge, channel_ent, members, debug, timings),
+        _invite_amo_observer(bridge, channel_ent, watched_id, debug),
+        _export_invite(bridge, channel_ent),
+    )
+
+    member_ids = [str(u.id) for u in users_meta] if debug.get("invite") == "ok" else []
+    if amo_id:
+        member_ids.append(str(amo_id))
+    pool_id = _router.registry.add_pool_chat(
+        bridge.account_name, channel_ent.id, channel_ent.access_hash,
+        invite_link or "", member_ids,
+    )
+    logger.info("Chat pool: provisioned %s for %s (%s)", watched_id, bridge.account_name, debug)
+    return pool_id
+
+
+def _in_pool_hours() -> bool:
+    """CREATE_POOL_HOURS="1-7" — пополнять только в эти часы (локальное время)."""
+    start, sep, end = config.CREATE_POOL_HOURS.partition("-")
+    if not sep or not start.strip().isdigit() or not end.strip().isdigit():
+        return True
+    hour = time.localtime().tm_hour
+    start, end = int(start), int(end)
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+async def _provision_round():
+    if not _in_pool_hours():
+        return
+    now = time.time()
+    for bridge in _router.pool.get_healthy_list("create_chat"):
+        account = bridge.account_name
+        if now - _last_create.get(account, 0) < config.CREATE_POOL_IDLE:
+            continue
+        if _router.registry.count_pool_chats(account) >= config.CREATE_POOL_SIZE:
+            continue
+        created = _router.registry.count_operations_since(
+            account, "create_channel", now - 86400,
+        )
+        if created >= config.CREATE_POOL_DAILY_QUOTA:
+            logger.debug("Chat pool: daily quota reached for %s", account)
+            continue
+        try:
+            # По одной заготовке за проход: создание размазано во времени
+            await run_with_retry(_provision_chat, bridge.client, bridge)
+            _router.handle_success(bridge, "", "chat_pool")
+        except Exception as e:
+            logger.warning("Chat pool: provisioning failed for %s: %s", bridge.name, e)
+            _router.handle_error(bridge, e, "", "chat_pool")
+
+
+async def run_pool_provisioner():
+    """Фоновая задача: держать у каждого аккаунта CREATE_POOL_SIZE заготовок."""
+    if config.CREATE_POOL_SIZE <= 0:
+        return
+    while True:
+        await asyncio.sleep(config.CREATE_POOL_INTERVAL)
+        try:
+            # Отмена (graceful reload) не бросает заготовку на полпути
+            await asyncio.shield(_provision_round())
+        except Exception as e:
+            logger.error("Chat pool provisioner failed: %s", e)
+
+
 # === Salebot callback =========================================================
 
 def _send_salebot_callback(client_tg_id: str, invite_link: str):
-    """Отправляет callback в salebot с invite_link (в фоновом потоке, не блокирует ответ)."""
-    def _do_send():
-        payload = {
-            "message": "send_invite_link",
-            "user_id": client_tg_id,
-            "group_id": config.SALEBOT_GROUP_ID,
-            "tg_business": 1,
-            "invite_link": invite_link,
-        }
+    """Ставит callback в salebot с invite_link в очередь доставки (не блокирует ответ)."""
+    payload = {
+        "message": "send_invite_link",
+        "user_id": client_tg_id,
+        "group_id": config.SALEBOT_GROUP_ID,
+        "tg_business": 1,
+        "invite_link": invite_link,
+    }
+    try:
+        job_id = delivery.enqueue(
+            config.SALEBOT_CALLBACK_URL, payload, service="salebot_callback",
+        )
+        logger.info("salebot callback queued: #%d user=%s", job_id, client_tg_id)
+    except Exception as e:
+        logger.error("salebot callback enqueue failed: %s", e)
         try:
-            resp = http_requests.post(
-                config.SALEBOT_CALLBACK_URL,
-                json=payload,
-                timeout=15,
+            _router.registry.save_failed_request(
+                service="salebot_callback", endpoint=config.SALEBOT_CALLBACK_URL,
+                request_payload=payload, error=str(e),
+                direction="outbound",
             )
-            logger.info("salebot callback sent: status=%s body=%s", resp.status_code, resp.text[:200])
-        except Exception as e:
-            logger.error("salebot callback failed: %s", e)
-            try:
-                _router.registry.save_failed_request(
-                    service="salebot_callback", endpoint=config.SALEBOT_CALLBACK_URL,
-                    request_payload=payload, error=str(e),
-                    direction="outbound",
-                )
-            except Exception:
-                pass
-
-    threading.Thread(target=_do_send, daemon=True).start()
+        except Exception:
+            pass
 
 
 # === HTTP endpoint ============================================================
 
 @bp.route("/create_chat", methods=["POST"])
+@idempotency.idempotent("create_chat")
 def create_chat():
     if _router is None:
         return jsonify({"error": "not initialized"}), 503
@@ -294,12 +662,10 @@ def create_chat():
         bridge = _router.pick_for_create(service="create_chat")
     except RuntimeError as e:
         return jsonify({"error": str(e)}), 503
+    _last_create[bridge.account_name] = time.time()
 
     try:
-        result = _run(
-            run_with_retry(_create_chat_impl, bridge.client, bridge, title, usernames),
-            timeout=120,
-        )
+        result = _run(_create_chat(bridge, title, usernames), timeout=120)
 
         if "error" in result and result.get("status") != "ok":
             return jsonify(result), 400 if "no resolvable" in result.get("error", "") else 500
@@ -329,13 +695,8 @@ def create_chat():
         for fallback in fallbacks:
             try:
                 logger.warning("create_chat failover: %s → %s", bridge.name, fallback.name)
-                result = _run(
-                    run_with_retry(
-                        _create_chat_impl, fallback.client,
-                        fallback, title, usernames,
-                    ),
-                    timeout=120,
-                )
+                _last_create[fallback.account_name] = time.time()
+                result = _run(_create_chat(fallback, title, usernames), timeout=120)
                 if result.get("status") == "ok":
                     chat_id = result.get("chat_id", "")
                     if chat_id:
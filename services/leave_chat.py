@@ -6,20 +6,46 @@ services/leave_chat.py — POST /leave_chat
 
 JSON запрос (не меняется):
 {
-    "chat": "-1001234567890"
+    "chat": "-1001234567890",
+    "delete_if_creator": false   // опционально, по умолчанию LEAVE_DELETE_IF_CREATOR
 }
+
+Перед выходом из супергруппы кикаются все участники (постранично, пауза
+между киками подстраивается под FloodWait). Если чат создан нашим
+аккаунтом и delete_if_creator — чат удаляется одним DeleteChannelRequest.
+
+POST /leave_chat/batch — {"chats": [...]}: чаты группируются по аккаунту,
+аккаунты работают параллельно, внутри аккаунта — по одному с паузой.
+Ответ 202 с job_id; прогресс и результаты — GET /leave_chat/batch/<job_id>.
+Состояние задания хранится в таблице leave_batch_jobs: статус доступен
+после рестарта / graceful reload, а прерванное задание доделывает фоновый
+воркер следующего процесса.
+
+"background": true (или LEAVE_BACKGROUND=1) — чат сразу помечается
+'leaving' (send_text/send_media считают его покинутым), ответ 202, а кики
+и выход делает фоновая задача с повторами; состояние хранится в таблице
+leave_tasks и переживает рестарт. Статус — GET /leave_chat/task?chat=...
+Супергруппа больше LEAVE_SYNC_MAX_PARTICIPANTS уходит в фон и без флага:
+синхронный ответ не дождался бы всех киков.
+Если выход так и не удался, чат возвращается в 'active', запрос — в
+failed_requests (повтор из дашборда).
 """
 import asyncio
 import logging
-from typing import Any, Optional
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from flask import Blueprint, request, jsonify
-from telethon import functions, types
+from telethon import errors as tl_errors, functions, types
 from telethon.utils import get_peer_id
 
 from core.bridge import TelethonBridge
 from core.router import AccountRouter
 from core.retry import run_with_retry
+from core import batch, tracing
+import config
 
 logger = logging.getLogger("svc.leave_chat")
 
@@ -59,19 +85,66 @@ def _normalize_chat_ref(raw: Any) -> Any:
     return raw
 
 
-async def _kick_all_members(bridge: TelethonBridge, channel_peer: Any) -> list:
-    """Кикнуть всех участников (кроме себя) перед выходом из чата."""
-    kicked = []
-    my_id = bridge.self_user_id
-    try:
+async def _get_all_participants(bridge: TelethonBridge, channel_peer: Any) -> List[types.User]:
+    """Все участники канала постранично (по 200)."""
+    users: Dict[int, types.User] = {}
+    offset = 0
+    while True:
         result = await bridge.client(functions.channels.GetParticipantsRequest(
             channel=channel_peer,
             filter=types.ChannelParticipantsRecent(),
-            offset=0, limit=200, hash=0,
+            offset=offset, limit=200, hash=0,
         ))
+        if not result.participants:
+            break
         for user in result.users:
-            if user.id == my_id:
-                continue
+            users[user.id] = user
+        offset += len(result.participants)
+        if offset >= result.count:
+            break
+    return list(users.values())
+
+
+class _KickPacer:
+    """Пауза между киками по обратной связи от FloodWait (AIMD)."""
+
+    def __init__(self):
+        self.interval = config.LEAVE_KICK_INTERVAL_MIN
+
+    async def wait(self):
+        await asyncio.sleep(self.interval)
+
+    def success(self):
+        self.interval = max(config.LEAVE_KICK_INTERVAL_MIN, self.interval * 0.9)
+
+    async def flood(self, seconds: int):
+        self.interval = min(config.LEAVE_KICK_INTERVAL_MAX, self.interval * 2)
+        logger.warning("Kick FloodWait %ds, interval now %.2fs", seconds, self.interval)
+        await asyncio.sleep(seconds)
+
+
+async def _kick_all_members(bridge: TelethonBridge, channel_peer: Any,
+                            on_kick: Optional[Callable[[int], None]] = None,
+                            ) -> Tuple[list, list]:
+    """Кикнуть всех участников (кроме себя) перед выходом из чата.
+
+    on_kick(n) вызывается после каждого успешного кика (прогресс фоновой задачи).
+    Не кикнутые за проход (ошибка, FloodWait на повторе) пробуются ещё раз
+    после него. Возвращает (кикнутые, оставшиеся) id.
+    """
+    kicked = []
+    my_id = bridge.self_user_id
+    try:
+        with tracing.span("load_participants"):
+            users = await _get_all_participants(bridge, channel_peer)
+    except Exception as e:
+        logger.warning("Failed to get participants for kick: %s", e)
+        return kicked, []
+
+    pacer = _KickPacer()
+
+    async def _kick(user: types.User) -> bool:
+        for attempt in range(2):
             try:
                 await bridge.client(functions.channels.EditBannedRequest(
                     channel=channel_peer,
@@ -82,21 +155,76 @@ async def _kick_all_members(bridge: TelethonBridge, channel_peer: Any) -> list:
                     ),
                 ))
                 kicked.append(user.id)
+                pacer.success()
+                if on_kick is not None:
+                    on_kick(len(kicked))
                 logger.info("Kicked user %s (%s) from chat", user.id, user.username or "no_username")
-                await asyncio.sleep(0.5)  # пауза между кикам чтобы не словить FloodWait
+                return True
+            except tl_errors.FloodWaitError as e:
+                if e.seconds > config.LEAVE_KICK_MAX_FLOOD:
+                    raise  # router пометит аккаунт, выход — повтором позже
+                await pacer.flood(e.seconds)
             except Exception as e:
                 logger.warning("Failed to kick user %s: %s", user.id, e)
-    except Exception as e:
-        logger.warning("Failed to get participants for kick: %s", e)
-    return kicked
+                return False
+        return False
+
+    failed = []
+    for user in users:
+        if user.id == my_id:
+            continue
+        if not await _kick(user):
+            failed.append(user)
+        await pacer.wait()
+    if failed:
+        logger.info("Retrying %d failed kicks", len(failed))
+        retry, failed = failed, []
+        for user in retry:
+            if not await _kick(user):
+                failed.append(user)
+            await pacer.wait()
+    logger.info("Kicked %d of %d participants", len(kicked), len(users))
+    return kicked, [u.id for u in failed]
 
 
-async def _leave_chat_impl(bridge: TelethonBridge, chat_ref: Any) -> dict:
+async def _kick_count(bridge: TelethonBridge, chat_ref: Any,
+                      delete_if_creator: Optional[bool] = None) -> int:
+    """Сколько участников придётся кикнуть (одним запросом, limit=0)."""
+    entity = await bridge.get_entity(chat_ref)
+    if not isinstance(entity, types.Channel):
+        return 0
+    if delete_if_creator is None:
+        delete_if_creator = config.LEAVE_DELETE_IF_CREATOR
+    if delete_if_creator and getattr(entity, "creator", False):
+        return 0
+    result = await bridge.client(functions.channels.GetParticipantsRequest(
+        channel=entity, filter=types.ChannelParticipantsRecent(),
+        offset=0, limit=0, hash=0,
+    ))
+    return result.count
+
+
+async def _leave_chat_impl(bridge: TelethonBridge, chat_ref: Any,
+                           delete_if_creator: Optional[bool] = None,
+                           on_kick: Optional[Callable[[int], None]] = None) -> dict:
     entity = await bridge.get_entity(chat_ref)
     peer_id = get_peer_id(entity)
+    if delete_if_creator is None:
+        delete_if_creator = config.LEAVE_DELETE_IF_CREATOR
 
     if isinstance(entity, types.Channel):
-        kicked = await _kick_all_members(bridge, entity)
+        if delete_if_creator and getattr(entity, "creator", False):
+            # Наш аккаунт — создатель: один запрос вместо N киков
+            await bridge.client(functions.channels.DeleteChannelRequest(entity))
+            return {"status": "ok", "left_type": "deleted", "id": entity.id,
+                    "peer_id": peer_id, "kicked": []}
+        with tracing.span("kick_members"):
+            kicked, not_kicked = await _kick_all_members(bridge, entity, on_kick)
+        if not_kicked:
+            # Не выходим: после выхода оставшихся кикнуть будет уже некому
+            return {"status": "partial", "error": f"{len(not_kicked)} members not kicked",
+                    "id": entity.id, "peer_id": peer_id,
+                    "kicked": kicked, "not_kicked": not_kicked}
         await bridge.client(functions.channels.LeaveChannelRequest(entity))
         return {"status": "ok", "left_type": "channel", "id": entity.id,
                 "peer_id": peer_id, "kicked": kicked}
@@ -126,18 +254,41 @@ def leave_chat():
         return jsonify({"status": "error", "error": "chat is required"}), 400
 
     chat_ref = _normalize_chat_ref(chat)
+    delete_if_creator = data.get("delete_if_creator")
 
     try:
         bridge = _router.pick_for_chat(chat_ref, service="leave_chat")
     except RuntimeError as e:
         return jsonify({"status": "error", "error": str(e)}), 503
 
+    background = data.get("background", config.LEAVE_BACKGROUND)
+    members = 0
+    if not background:
+        try:
+            members = _run(_kick_count(bridge, chat_ref, delete_if_creator), timeout=30)
+        except Exception as e:
+            # Ошибку (нет чата, нет доступа) разберёт основной путь ниже
+            logger.debug("leave_chat: participant count for %s failed: %s", chat_ref, e)
+        if members > config.LEAVE_SYNC_MAX_PARTICIPANTS:
+            logger.info("leave_chat: %s has %d participants, leaving in background",
+                        chat_ref, members)
+            background = True
+
+    if background:
+        _router.registry.mark_leaving(str(chat_ref), bridge.account_name)
+        _router.registry.add_leave_task(str(chat_ref), bridge.account_name, delete_if_creator)
+        _wake_leave_worker()
+        return jsonify({"status": "accepted", "left_type": "pending",
+                        "chat": str(chat_ref)}), 202
+
     try:
         result = _run(
-            run_with_retry(_leave_chat_impl, bridge.client, bridge, chat_ref),
-            timeout=60,
+            run_with_retry(_leave_chat_impl, bridge.client, bridge, chat_ref,
+                           delete_if_creator),
+            timeout=config.LEAVE_SYNC_TIMEOUT + members * config.LEAVE_SYNC_PER_MEMBER,
         )
-        code = 200 if result.get("status") == "ok" else 400
+        # partial — участники остались, из чата не вышли (повторить позже)
+        code = {"ok": 200, "partial": 409}.get(result.get("status"), 400)
         if result.get("status") == "ok":
             # peer_id совпадает с форматом хранения в БД (get_peer_id)
             mark_id = str(result.get("peer_id") or chat_ref)
@@ -166,6 +317,371 @@ def leave_chat():
         return jsonify({"status": "error", "error": str(e)}), 500
 
 
+# === Batch ====================================================================
+
+# job_id → состояние заданий этого процесса (копия — в leave_batch_jobs).
+# results/done меняет event loop, читают HTTP-потоки — только под _jobs_lock.
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+
+
+def _snapshot(job: Dict[str, Any]) -> Dict[str, Any]:
+    with _jobs_lock:
+        return {**job, "results": dict(job["results"])}
+
+
+def _save_job(job: Dict[str, Any]):
+    try:
+        _router.registry.save_leave_batch(_snapshot(job))
+    except Exception as e:
+        logger.warning("leave_chat batch %s: failed to persist: %s", job["id"], e)
+
+
+async def _leave_batch_item(bridge: Optional[TelethonBridge], chat_ref: Any,
+                            delete_if_creator: Optional[bool] = None,
+                            ) -> Tuple[Dict[str, Any], Optional[str]]:
+    """(результат, chat_id для mark_left или None)."""
+    if bridge is None:
+        return {"status": "error", "error": "no healthy accounts for leave_chat"}, None
+    try:
+        result = await run_with_retry(_leave_chat_impl, bridge.client, bridge, chat_ref,
+                                      delete_if_creator)
+    except ValueError as e:
+        if "Cannot resolve" not in str(e):
+            raise
+        return {"status": "ok", "left_type": "unresolvable",
+                "note": "Chat not found, marked as left"}, str(chat_ref)
+    if result.get("status") != "ok":
+        return result, None
+    return result, str(result.get("peer_id") or chat_ref)
+
+
+async def _run_leave_batch(job: Dict[str, Any], refs: List[Any],
+                           routes: Dict[str, TelethonBridge]):
+    # Чат помечается покинутым до записи результата: "ok" в статусе задания
+    # (и в leave_batch_jobs) всегда означает, что реестр уже обновлён
+    left = 0
+
+    def _job(i: int, ref: Any):
+        bridge = routes.get(str(ref))
+
+        async def _one():
+            nonlocal left
+            try:
+                body, mark_id = await _leave_batch_item(
+                    bridge, ref, job.get("delete_if_creator"))
+            except Exception as e:
+                _router.handle_error(bridge, e, str(ref), "leave_chat")
+                body, mark_id = {"status": "error", "error": str(e) or type(e).__name__}, None
+            if mark_id:
+                _router.registry.mark_left(mark_id)
+                _router.handle_success(bridge, mark_id, "leave_chat")
+                left += 1
+            with _jobs_lock:
+                job["results"][i] = {"index": i, "chat": str(ref), **body}
+                job["done"] += 1
+            _save_job(job)
+        return bridge.name if bridge else "", (i, _one)
+
+    groups: Dict[str, List[batch.Job]] = {}
+    for i, ref in enumerate(refs):
+        if job["results"].get(i) is not None:
+            continue
+        key, item = _job(i, ref)
+        groups.setdefault(key, []).append(item)
+
+    cancelled = False
+    try:
+        await batch.run_grouped(
+            groups,
+            concurrency=config.LEAVE_BATCH_CONCURRENCY,
+            interval=config.LEAVE_BATCH_INTERVAL,
+        )
+    except asyncio.CancelledError:
+        cancelled = True  # остановка процесса: задание останется 'running' и будет доделано
+        raise
+    finally:
+        if not cancelled:
+            with _jobs_lock:
+                job["status"] = "done"
+                job["finished_at"] = time.time()
+        _save_job(job)
+        logger.info("leave_chat batch %s: %d/%d left", job["id"], left, len(refs))
+
+
+def _resume_leave_batches():
+    """Задания, прерванные рестартом / reload: доделать оставшиеся чаты."""
+    for job in _router.registry.get_running_leave_batches():
+        if job["id"] in _jobs:
+            continue  # выполняется этим процессом
+        refs = job["chats"]
+        routes = _router.pick_for_chats(
+            [str(r) for i, r in enumerate(refs) if i not in job["results"]],
+            service="leave_chat",
+        )
+        with _jobs_lock:
+            _jobs[job["id"]] = job
+        logger.info("leave_chat batch %s: resuming, %d/%d done",
+                    job["id"], job["done"], job["count"])
+        asyncio.ensure_future(_run_leave_batch(job, refs, routes))
+
+
+def _job_body(job: Dict[str, Any]) -> Dict[str, Any]:
+    job = _snapshot(job)
+    results = [job["results"][i] for i in sorted(job["results"])]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "count": job["count"],
+        "done": job["done"],
+        "succeeded": sum(1 for r in results if r.get("status") == "ok"),
+        "results": results,
+    }
+
+
+def _cleanup_jobs():
+    cutoff = time.time() - config.LEAVE_BATCH_JOB_TTL
+    with _jobs_lock:
+        for job_id in [j for j, job in _jobs.items()
+                       if job.get("finished_at", time.time()) < cutoff]:
+            _jobs.pop(job_id, None)
+
+
+@bp.route("/leave_chat/batch", methods=["POST"])
+def leave_chat_batch():
+    """
+    Пакетный выход: {"chats": [...]} или массив чатов.
+    Уже покинутые чаты сразу получают "skipped". "wait": true — ждать
+    завершения и вернуть все результаты в ответе (как /send_text/batch).
+    """
+    if _router is None:
+        return jsonify({"status": "error", "error": "not initialized"}), 503
+
+    data = request.get_json(force=True, silent=True)
+    chats = data.get("chats") if isinstance(data, dict) else data
+    if not isinstance(chats, list) or not chats:
+        return jsonify({"status": "error", "error": "chats must be a non-empty list"}), 400
+    if len(chats) > config.BATCH_MAX_ITEMS:
+        return jsonify({"status": "error",
+                        "error": f"too many chats (max {config.BATCH_MAX_ITEMS})"}), 400
+
+    refs = [_normalize_chat_ref(c) for c in chats]
+    _cleanup_jobs()
+    job = {"id": uuid.uuid4().hex[:12], "status": "running", "count": len(refs),
+           "chats": refs, "done": 0, "results": {}, "created_at": time.time(),
+           "delete_if_creator": data.get("delete_if_creator") if isinstance(data, dict) else None}
+
+    left = _router.registry.get_left([str(r) for r in refs])
+    for i, ref in enumerate(refs):
+        if str(ref) in left:
+            job["results"][i] = {"index": i, "chat": str(ref),
+                                 "status": "skipped", "reason": "chat already left"}
+            job["done"] += 1
+    routes = _router.pick_for_chats(
+        [str(r) for i, r in enumerate(refs) if i not in job["results"]],
+        service="leave_chat",
+    )
+    with _jobs_lock:
+        _jobs[job["id"]] = job
+    _save_job(job)
+
+    future = asyncio.run_coroutine_threadsafe(_run_leave_batch(job, refs, routes), _loop)
+    if isinstance(data, dict) and data.get("wait"):
+        try:
+            future.result(timeout=config.BATCH_TIMEOUT)
+        except Exception as e:
+            logger.error("leave_chat batch failed: %s: %s", type(e).__name__, e)
+            return jsonify({"status": "error", "error": str(e) or type(e).__name__,
+                            **_job_body(job)}), 500
+        return jsonify(_job_body(job))
+    return jsonify(_job_body(job)), 202
+
+
+@bp.route("/leave_chat/batch/<job_id>", methods=["GET"])
+def leave_chat_batch_status(job_id: str):
+    if _router is None:
+        return jsonify({"status": "error", "error": "not initialized"}), 503
+    job = _jobs.get(job_id) or _router.registry.get_leave_batch(job_id)
+    if job is None:
+        return jsonify({"status": "error", "error": "job not found"}), 404
+    return jsonify(_job_body(job))
+
+
+# === Background leave =========================================================
+
+_leave_wakeup: Optional[asyncio.Event] = None
+_leave_running: Dict[str, asyncio.Semaphore] = {}  # аккаунт → слоты
+
+
+def _wake_leave_worker():
+    if _loop is not None and _leave_wakeup is not None:
+        _loop.call_soon_threadsafe(_leave_wakeup.set)
+
+
+def _leave_task_delay(attempt: int) -> float:
+    return min(config.LEAVE_TASK_BACKOFF_MAX,
+               config.LEAVE_TASK_BACKOFF_BASE * (2 ** (attempt - 1)))
+
+
+def _bridge_for_task(task: Dict[str, Any]) -> TelethonBridge:
+    """Аккаунт, который ставил задачу; если он нездоров — обычный выбор."""
+    bridge = _router.pool.get_by_account(task["account_name"], "leave_chat")
+    if bridge is not None and bridge.is_healthy:
+        return bridge
+    return _router.pick_for_chat(task["chat_id"], service="leave_chat")
+
+
+def _fail_leave_task(chat_id: str, error: str):
+    """Окончательная неудача: мы всё ещё в чате — вернуть его в 'active'."""
+    _router.registry.finish_leave_task(chat_id, "failed", error)
+    _router.registry.unmark_leaving(chat_id)
+
+
+async def _process_leave_task(task: Dict[str, Any]):
+    registry = _router.registry
+    chat_id = task["chat_id"]
+    chat_ref = _normalize_chat_ref(chat_id)
+    delete_if_creator = (None if task["delete_if_creator"] is None
+                         else bool(task["delete_if_creator"]))
+    attempt = task["attempts"] + 1
+    bridge = None
+
+    def _progress(n: int):
+        # Каждый 10-й кик — в реестр (рестарт продолжит с оставшихся участников)
+        if n % 10 == 0:
+            registry.update_leave_task_progress(chat_id, task["kicked"] + n)
+
+    try:
+        bridge = _bridge_for_task(task)
+        result = await run_with_retry(_leave_chat_impl, bridge.client, bridge, chat_ref,
+                                      delete_if_creator, _progress)
+    except Exception as e:
+        if isinstance(e, ValueError) and "Cannot resolve" in str(e):
+            registry.mark_left(chat_id)
+            registry.finish_leave_task(chat_id, "done", "unresolvable")
+            logger.info("leave task %s: chat not found, marking as left", chat_id)
+            return
+        if bridge is not None:
+            _router.handle_error(bridge, e, chat_id, "leave_chat")
+        _retry_leave_task(chat_id, attempt, str(e) or type(e).__name__,
+                          e.seconds if isinstance(e, tl_errors.FloodWaitError) else 0)
+        return
+
+    if result.get("status") == "partial":
+        # Часть участников не кикнута: из чата не вышли, повторим задачу
+        registry.update_leave_task_progress(chat_id, task["kicked"] + len(result["kicked"]))
+        _retry_leave_task(chat_id, attempt, result["error"])
+        return
+    if result.get("status") != "ok":
+        _fail_leave_task(chat_id, result.get("error", ""))
+        logger.error("leave task %s failed: %s", chat_id, result.get("error"))
+        return
+    mark_id = str(result.get("peer_id") or chat_id)
+    registry.mark_left_many(list({chat_id, mark_id}))
+    registry.update_leave_task_progress(chat_id, task["kicked"] + len(result.get("kicked", [])))
+    registry.finish_leave_task(chat_id, "done")
+    _router.handle_success(bridge, mark_id, "leave_chat")
+    logger.info("leave task %s done (%s)", chat_id, result.get("left_type"))
+
+
+def _retry_leave_task(chat_id: str, attempt: int, error: str, min_delay: float = 0):
+    """Неудачная попытка: повтор с backoff или, после последней, окончательный fail."""
+    registry = _router.registry
+    if attempt >= config.LEAVE_TASK_MAX_ATTEMPTS:
+        _fail_leave_task(chat_id, error)
+        logger.error("leave task %s gave up after %d attempts: %s", chat_id, attempt, error)
+        try:
+            registry.save_failed_request(
+                service="leave_chat", endpoint="/leave_chat",
+                request_payload={"chat": chat_id, "background": True}, error=error,
+            )
+        except Exception:
+            pass
+        return
+    delay = max(_leave_task_delay(attempt), min_delay)
+    registry.retry_leave_task(chat_id, attempt, time.time() + delay, error)
+    logger.warning("leave task %s failed (attempt %d/%d), retry in %.0fs: %s",
+                   chat_id, attempt, config.LEAVE_TASK_MAX_ATTEMPTS, delay, error)
+
+
+async def _heartbeat(chat_id: str):
+    """Пока задача у нас — держать updated_at свежим (другой процесс её не заберёт)."""
+    while True:
+        await asyncio.sleep(config.LEAVE_TASK_HEARTBEAT)
+        try:
+            _router.registry.touch_leave_task(chat_id)
+        except Exception as e:
+            logger.warning("leave task %s heartbeat failed: %s", chat_id, e)
+
+
+async def _run_leave_task(task: Dict[str, Any]):
+    sem = _leave_running.setdefault(
+        task["account_name"], asyncio.Semaphore(config.LEAVE_BATCH_CONCURRENCY),
+    )
+    heartbeat = asyncio.ensure_future(_heartbeat(task["chat_id"]))
+    try:
+        async with sem:
+            try:
+                await _process_leave_task(task)
+            except Exception as e:
+                logger.error("leave task %s crashed: %s", task["chat_id"], e)
+                _router.registry.retry_leave_task(
+                    task["chat_id"], task["attempts"] + 1,
+                    time.time() + _leave_task_delay(task["attempts"] + 1), str(e),
+                )
+            await asyncio.sleep(config.LEAVE_BATCH_INTERVAL)
+    finally:
+        heartbeat.cancel()
+
+
+async def run_leave_worker():
+    """Фоновая задача: выполнять leave_tasks по мере созревания."""
+    global _leave_wakeup
+    _leave_wakeup = asyncio.Event()
+    last_requeue = 0.0
+    try:
+        _resume_leave_batches()
+    except Exception as e:
+        logger.error("Leave worker: failed to resume batch jobs: %s", e)
+    while True:
+        try:
+            # Задачи умершего процесса (в т.ч. предшественника при reload):
+            # только без heartbeat'а, живые задачи другого процесса не трогаем
+            if time.time() - last_requeue >= config.LEAVE_TASK_HEARTBEAT:
+                last_requeue = time.time()
+                recovered = _router.registry.requeue_stale_leave_tasks(
+                    time.time() - config.LEAVE_TASK_STALE_AFTER,
+                )
+                if recovered:
+                    logger.info("Leave worker: %d interrupted tasks requeued", recovered)
+            for task in _router.registry.claim_leave_tasks(time.time()):
+                asyncio.ensure_future(_run_leave_task(task))
+            wait = _router.registry.next_leave_task_in(time.time())
+        except Exception as e:
+            logger.error("Leave worker failed: %s", e)
+            wait = None
+        timeout = config.LEAVE_TASK_POLL if wait is None else min(wait, config.LEAVE_TASK_POLL)
+        try:
+            await asyncio.wait_for(_leave_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        _leave_wakeup.clear()
+
+
+@bp.route("/leave_chat/task", methods=["GET"])
+def leave_chat_task():
+    """Состояние фонового выхода: ?chat=<id>."""
+    if _router is None:
+        return jsonify({"status": "error", "error": "not initialized"}), 503
+    chat = request.args.get("chat")
+    if not chat:
+        return jsonify({"status": "error", "error": "chat is required"}), 400
+    task = _router.registry.get_leave_task(str(_normalize_chat_ref(chat)))
+    if task is None:
+        return jsonify({"status": "error", "error": "task not found"}), 404
+    return jsonify(task)
+
+
 @bp.route("/health", methods=["GET"])
 def health():
     ok = _router is not None and _router.pool.get_best("leave_chat") is not None
@@ -15,20 +15,27 @@ JSON запрос (не меняется):
 }
 """
 import asyncio
+import mimetypes
 import os
 import re
+import time
 import logging
-from typing import Any, Dict, List, Optional, Union, Tuple
+from contextlib import ExitStack
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union, Tuple
 from urllib.parse import urlparse
 
 from flask import Blueprint, request, jsonify
-from telethon import TelegramClient, errors as tl_errors
-from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+from telethon import TelegramClient, errors as tl_errors, functions
+from telethon.tl.types import (
+    DocumentAttributeFilename, InputPeerSelf, PeerChannel, PeerChat, PeerUser,
+)
 
 from core.bridge import TelethonBridge
 from core.router import AccountRouter
 from core.retry import run_with_retry
-from core import bot_fallback
+from core import (batch, bot_fallback, failover, idempotency, media_cache, spool, tracing,
+                  uploader)
+import config
 
 logger = logging.getLogger("svc.send_media")
 
@@ -57,39 +64,75 @@ def _save_failed(data: dict, error: str):
         pass
 
 
+def _bot_media_item(f, pins: ExitStack,
+                    force_document: bool = False) -> Optional[bot_fallback.MediaItem]:
+    """Файл из запроса → MediaItem для Bot API; None — бот его не отправит.
+
+    Файл спула закрепляется в pins (evict() не удалит его до конца отправки).
+    """
+    filename = ""
+    if isinstance(f, dict):
+        ref = f.get("url") or f.get("file") or f.get("path")
+        force_document = bool(f.get("force_document", force_document))
+        filename = f.get("filename") or ""
+    else:
+        ref = f
+    if not isinstance(ref, str) or not ref or _parse_tg_link(ref):
+        return None
+
+    if _is_url(ref):
+        cached = spool.cached_path(ref)
+        if cached is not None and cached.size <= bot_fallback.MAX_UPLOAD_SIZE:
+            try:
+                pins.enter_context(spool.get().pinned(cached))
+            except FileNotFoundError:
+                return bot_fallback.MediaItem(url=ref, force_document=force_document)
+            # Файл уже на диске — шлём байты, не полагаясь на то,
+            # что серверы Telegram смогут скачать URL сами
+            return bot_fallback.MediaItem(
+                url=ref, path=cached.path,
+                filename=filename or cached.filename or os.path.basename(cached.path),
+                mime_type=cached.mime_type, force_document=force_document,
+            )
+        return bot_fallback.MediaItem(url=ref, force_document=force_document)
+
+    if os.path.isfile(ref) and os.path.getsize(ref) <= bot_fallback.MAX_UPLOAD_SIZE:
+        name = filename or os.path.basename(ref)
+        return bot_fallback.MediaItem(
+            path=ref, filename=name,
+            mime_type=mimetypes.guess_type(name)[0] or "",
+            force_document=force_document,
+        )
+    return None
+
+
 def _try_bot_fallback(chat_id, files: list, caption: str,
                       parse_mode: str, force_document: bool = False) -> Optional[dict]:
-    """Попытка отправить через Bot API (@alex_rumhelp_bot) как последний фоллбэк."""
+    """Попытка отправить через Bot API (@alex_rumhelp_bot) как последний фоллбэк.
+
+    Совместимые файлы уходят альбомами (sendMediaGroup), локальные и уже
+    скачанные в спул — загрузкой multipart.
+    """
     if not bot_fallback.is_configured():
         return None
     if chat_id is None:
         return None
     try:
-        sent_ids = []
-        for i, f in enumerate(files):
-            file_url = None
-            fd = False
-            if isinstance(f, str):
-                file_url = f if _is_url(f) else None
-            elif isinstance(f, dict):
-                file_url = f.get("url") or f.get("file") or f.get("path")
-                fd = bool(f.get("force_document", force_document))
-                if file_url and not _is_url(file_url):
-                    file_url = None
-
-            if not file_url:
-                continue
-
-            cap = caption if i == 0 else ""
-            msg = bot_fallback.send_media_by_url(
-                chat_id=chat_id,
-                file_url=file_url,
-                caption=cap,
-                parse_mode=parse_mode or "HTML",
-                force_document=fd,
-            )
-            sent_ids.append(msg.get("message_id"))
+        with ExitStack() as pins:
+            items = [it for it in (_bot_media_item(f, pins, force_document) for f in files)
+                     if it]
+            if len(items) < len(files):
+                logger.warning(
+                    "Bot fallback send_media: %d of %d files can't be sent by bot",
+                    len(files) - len(items), len(files),
+                )
+            if not items:
+                return None
 
+            msgs = bot_fallback.send_media(
+                chat_id, items, caption=caption, parse_mode=parse_mode or "HTML",
+            )
+        sent_ids = [m.get("message_id") for m in msgs]
         if sent_ids:
             logger.info("Bot fallback send_media succeeded for %s: %s", chat_id, sent_ids)
             return {
@@ -130,6 +173,8 @@ def _guess_file_hint(payload) -> Optional[str]:
     return None
 
 
+ALBUM_SIZE = 10  # максимум файлов в одном альбоме Telegram
+
 _TG_PATTERNS = [
     r'^(?:https?://)?t\.me/([^/]+)/(\d+)$',
     r'^(?:https?://)?telegram\.me/([^/]+)/(\d+)$',
@@ -155,8 +200,32 @@ async def _get_media_from_tg_post(bridge: TelethonBridge, channel: str, msg_id:
     return msg.media
 
 
+# Кэш медиа постов t.me: (аккаунт, канал, id) → (время, media).
+# file_reference привязан к аккаунту, поэтому ключ включает аккаунт.
+_tg_posts: Dict[Tuple[str, str, int], Tuple[float, Any]] = {}
+
+
+async def _get_tg_post_media(bridge: TelethonBridge, channel: str, msg_id: int,
+                             refresh: bool = False):
+    """Медиа поста t.me с кэшем на TG_POST_CACHE_TTL (refresh — перечитать пост)."""
+    key = (bridge.account_name, channel.lower(), msg_id)
+    item = _tg_posts.get(key)
+    if item and not refresh and time.time() - item[0] < config.TG_POST_CACHE_TTL:
+        return item[1]
+    media = await _get_media_from_tg_post(bridge, channel, msg_id)
+    _tg_posts[key] = (time.time(), media)
+    if len(_tg_posts) > config.TG_POST_CACHE_SIZE:
+        # Выкидываем самые старые записи
+        for old in sorted(_tg_posts, key=lambda k: _tg_posts[k][0])[:len(_tg_posts) // 10]:
+            _tg_posts.pop(old, None)
+    return media
+
+
 async def _normalize_file_entry(bridge: TelethonBridge, item):
-    meta = {"force_document": False, "supports_streaming": None, "filename": None}
+    meta = {
+        "force_document": False, "supports_streaming": None, "filename": None,
+        "cache_key": None, "content_key": None, "tg_post": None,
+    }
 
     if isinstance(item, dict):
         path = item.get("file") or item.get("url") or item.get("path")
@@ -173,21 +242,35 @@ async def _normalize_file_entry(bridge: TelethonBridge, item):
         parsed = _parse_tg_link(path)
         if parsed:
             ch, mid = parsed
-            media = await _get_media_from_tg_post(bridge, ch, mid)
+            meta["tg_post"] = parsed
+            media = await _get_tg_post_media(bridge, ch, mid)
             return media, meta
 
-    if isinstance(path, str) and _is_url(path):
-        return item, meta
+    if meta["supports_streaming"] is None and not meta["force_document"]:
+        if _looks_like_video(_guess_file_hint(item)):
+            meta["supports_streaming"] = True
 
-    if isinstance(path, str) and os.path.exists(path):
-        return item, meta
+    if isinstance(path, str) and (_is_url(path) or os.path.exists(path)):
+        # sha256 локального файла считается в executor'е
+        meta["cache_key"] = await asyncio.get_running_loop().run_in_executor(
+            None, media_cache.source_key,
+            path, meta["force_document"], bool(meta["supports_streaming"]),
+            meta["filename"],
+        )
+        return path, meta
 
     if isinstance(path, str):
-        return item, meta
+        return path, meta
 
     raise ValueError("Unsupported file reference format")
 
 
+def _file_attributes(meta: Dict[str, Any]) -> Optional[list]:
+    if not meta.get("filename"):
+        return None
+    return [DocumentAttributeFilename(meta["filename"])]
+
+
 async def _resolve_recipient(bridge: TelethonBridge,
                               user_id: Optional[int],
                               username: Optional[str]) -> Any:
@@ -206,209 +289,525 @@ async def _send_media_impl(
     user_id: Optional[int], username: Optional[str],
     files: List, caption: str,
     parse_mode: str, disable_web_page_preview: bool,
+    recipient: Any = None,
 ):
-    entity = await _resolve_recipient(bridge, user_id, username)
+    entity = recipient if recipient is not None else await _resolve_recipient(
+        bridge, user_id, username,
+    )
+
+    limit = _prepare_limit(bridge)
+    if len(files) == 1:
+        return entity, await _send_single(
+            bridge, entity, files[0], limit, caption, parse_mode, disable_web_page_preview,
+        )
+
+    # Подготовка всех файлов стартует сразу (в пределах лимита bridge'а);
+    # альбомы по 10 уходят по порядку, пока следующие ещё грузятся
+    tasks = [asyncio.ensure_future(_prepare_entry(bridge, f, limit)) for f in files]
+    try:
+        sent = []
+        for start in range(0, len(tasks), ALBUM_SIZE):
+            chunk = list(await asyncio.gather(*tasks[start:start + ALBUM_SIZE]))
+            sent += await _send_chunk(
+                bridge, entity, chunk, caption if start == 0 else "",
+                parse_mode, disable_web_page_preview,
+            )
+        return entity, sent
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+            elif not t.cancelled():
+                t.exception()  # ошибка уже проброшена через gather
+
+
+# Лимиты одновременной подготовки файлов по bridge'ам (ключ — bridge.name)
+_prepare_limits: Dict[str, asyncio.Semaphore] = {}
+
+
+def _prepare_limit(bridge: TelethonBridge) -> asyncio.Semaphore:
+    limit = _prepare_limits.get(bridge.name)
+    if limit is None:
+        limit = _prepare_limits[bridge.name] = asyncio.Semaphore(
+            config.MEDIA_PREPARE_CONCURRENCY,
+        )
+    return limit
+
+
+# (исходный payload, meta, payload для отправки — хэндл или исходник)
+PreparedFile = Tuple[Any, Dict[str, Any], Any]
+
+
+async def _prepare_entry(bridge: TelethonBridge, item,
+                         limit: asyncio.Semaphore) -> PreparedFile:
+    async with limit:
+        payload, meta = await _normalize_file_entry(bridge, item)
+        return payload, meta, await _prepare_media(bridge, payload, meta)
+
+
+async def _send_single(bridge: TelethonBridge, entity: Any, item,
+                       limit: asyncio.Semaphore, caption: str,
+                       parse_mode: str, disable_web_page_preview: bool) -> list:
+    """Один файл: при промахе кэша загруженный файл сразу уходит сообщением.
+
+    Хэндл для кэша берётся из media отправленного сообщения — без отдельного
+    messages.uploadMedia. Хэндл из кэша (или от параллельной загрузки того же
+    файла) отправляется как обычно, через _send_chunk.
+    """
+    sent: list = []
+
+    async def _send(media):
+        sent[:] = await _send_prepared(
+            bridge, entity, [(payload, meta, media)], caption,
+            parse_mode, disable_web_page_preview,
+        )
+        return sent[0]
 
-    # Prepare files
-    prepared: List[Tuple[Any, Dict[str, Any]]] = []
-    for f in files:
-        prepared.append(await _normalize_file_entry(bridge, f))
+    async with limit:
+        payload, meta = await _normalize_file_entry(bridge, item)
+        try:
+            media = await _prepare_media(bridge, payload, meta, send=_send)
+        except Exception:
+            if sent:
+                return sent  # сообщение ушло, не сохранился только хэндл
+            raise
+    if sent:
+        return sent
+    return await _send_chunk(
+        bridge, entity, [(payload, meta, media)], caption,
+        parse_mode, disable_web_page_preview,
+    )
+
+
+async def _send_chunk(bridge: TelethonBridge, entity: Any,
+                      chunk: List[PreparedFile], caption: str,
+                      parse_mode: str, disable_web_page_preview: bool) -> list:
+    """Отправить до 10 подготовленных файлов; протухший file_reference — повтор."""
+    try:
+        return await _send_prepared(
+            bridge, entity, chunk, caption, parse_mode, disable_web_page_preview,
+        )
+    except tl_errors.FileReferenceExpiredError:
+        keys = [key for _, meta, _ in chunk
+                for key in (meta["cache_key"], meta["content_key"]) if key]
+        posts = [meta["tg_post"] for _, meta, _ in chunk if meta["tg_post"]]
+        if not keys and not posts:
+            raise
+    # Протухший file_reference: перечитываем посты t.me, сбрасываем хэндлы
+    # загруженных файлов и повторяем отправку один раз
+    logger.info("Media file reference expired on %s, refreshing", bridge.name)
+    for key in keys:
+        media_cache.invalidate(bridge.account_name, key)
+    refreshed = []
+    for payload, meta, _ in chunk:
+        if meta["tg_post"]:
+            payload = await _get_tg_post_media(bridge, *meta["tg_post"], refresh=True)
+        refreshed.append((payload, meta, await _prepare_media(bridge, payload, meta)))
+    return await _send_prepared(
+        bridge, entity, refreshed, caption, parse_mode, disable_web_page_preview,
+    )
+
+
+async def _prepare_media(bridge: TelethonBridge, payload: Any, meta: Dict[str, Any],
+                         send: Optional[Callable[[Any], Awaitable[Any]]] = None) -> Any:
+    """Хэндл файла (InputPhoto/InputDocument) для кэшируемых источников.
 
-    if len(prepared) == 1:
-        payload, meta = prepared[0]
-        if meta["supports_streaming"] is None and not meta["force_document"]:
-            hint = _guess_file_hint(files[0])
-            if _looks_like_video(hint):
-                meta["supports_streaming"] = True
+    Загрузка идёт single-flight по (аккаунт, ключ): параллельные запросы с тем
+    же файлом ждут одну загрузку. Некэшируемые payload'ы — без изменений.
+    send(media) → Message: загруженный файл отправляется сразу, хэндл — из
+    media сообщения; без send хэндл даёт messages.uploadMedia.
+
+    URL служит только для поиска записи спула: если она есть (и прошла
+    ревалидацию), хэндл ищется по sha256 её содержимого. Первая загрузка URL
+    идёт под ключом "url:", и её хэндл сразу же кладётся под ключ содержимого.
+    """
+    if not meta["cache_key"]:
+        return payload
+    key = meta["cache_key"]
+    if _is_url(payload):
+        entry = await uploader.spooled(payload)
+        if entry is not None:
+            key = meta["content_key"] = _content_key(entry, meta)
+
+    async def _prepare():
+        with tracing.span("upload"):
+            media = await _upload_media(bridge, payload, meta)
+        if send is not None:
+            result = (await send(media)).media
+        else:
+            # uploadMedia без отправки: получаем постоянный хэндл файла
+            result = await bridge.client(functions.messages.UploadMediaRequest(
+                peer=InputPeerSelf(), media=media,
+            ))
+        if key == meta["cache_key"] and _is_url(payload):
+            entry = spool.cached_path(payload)
+            if entry is not None:
+                media_cache.put(bridge.account_name, _content_key(entry, meta), result)
+        return result
+
+    with tracing.span("prepare_media"):
+        media = await media_cache.get_or_prepare(bridge.account_name, key, _prepare)
+    if key == meta["cache_key"] and _is_url(payload):
+        entry = spool.cached_path(payload)
+        if entry is not None:
+            meta["content_key"] = _content_key(entry, meta)
+    return media
+
+
+def _content_key(entry: spool.SpoolEntry, meta: Dict[str, Any]) -> str:
+    """Ключ кэша по содержимому файла спула (имя — как при загрузке из спула)."""
+    return media_cache.content_key(
+        os.path.basename(entry.path), meta["force_document"],
+        bool(meta["supports_streaming"]), meta["filename"] or entry.filename,
+    )
+
+
+async def _upload_media(bridge: TelethonBridge, payload: str, meta: Dict[str, Any]) -> Any:
+    """Загрузить URL / локальный файл → InputMediaUploaded*.
+
+    URL скачивается потоком прямо в загрузку (отдавать URL самому Telegram
+    ненадёжно: многие хосты и типы файлов он не забирает). Большие файлы
+    грузятся параллельно по нескольким соединениям.
+    """
+    force_document = bool(meta["force_document"])
+    supports_streaming = bool(meta["supports_streaming"])
+    if _is_url(payload):
+        uploaded = await uploader.upload_url(
+            bridge.client, payload, meta["filename"],
+            senders=uploader.sender_pool(bridge),
+        )
+    elif os.path.getsize(payload) > uploader.BIG_FILE_THRESHOLD:
+        uploaded = await uploader.upload_path(
+            bridge.client, payload, meta["filename"],
+            senders=uploader.sender_pool(bridge),
+        )
+    else:
+        # Небольшой локальный файл — штатная логика Telethon (сжатие фото, атрибуты)
+        _, media, _ = await bridge.client._file_to_media(
+            payload, force_document=force_document,
+            supports_streaming=supports_streaming,
+            attributes=_file_attributes(meta),
+        )
+        return media
+    return uploader.input_media(
+        uploaded, force_document=force_document, supports_streaming=supports_streaming,
+    )
 
-        file_arg = (payload, {"file_name": meta["filename"]}) if meta["filename"] else payload
+
+async def _send_prepared(bridge: TelethonBridge, entity: Any,
+                         chunk: List[PreparedFile], caption: str,
+                         parse_mode: str, disable_web_page_preview: bool) -> list:
+    """send_file по подготовленным файлам (одно сообщение или альбом до 10)."""
+    if len(chunk) == 1:
+        _, meta, payload = chunk[0]
         sent = await bridge.client.send_file(
-            entity=entity, file=file_arg,
+            entity=entity, file=payload,
             caption=caption or "",
             parse_mode=parse_mode,
             force_document=bool(meta["force_document"]),
             supports_streaming=bool(meta["supports_streaming"]),
+            attributes=_file_attributes(meta),
             link_preview=not disable_web_page_preview,
         )
-        return entity, [sent]
+        return [sent]
 
     # Multiple files
-    files_list = []
-    for payload, meta in prepared:
-        files_list.append(
-            (payload, {"file_name": meta["filename"]}) if meta.get("filename") else payload
-        )
     sent = await bridge.client.send_file(
-        entity=entity, file=files_list,
+        entity=entity, file=[payload for _, _, payload in chunk],
         caption=caption or "",
         parse_mode=parse_mode,
         link_preview=not disable_web_page_preview,
     )
-    return entity, sent if isinstance(sent, list) else [sent]
+    return sent if isinstance(sent, list) else [sent]
 
 
-# === HTTP endpoint ============================================================
-
-@bp.route("/send_media", methods=["POST"])
-def send_media():
-    if _router is None:
-        return jsonify({"status": "error", "error": "not initialized"}), 503
-
-    try:
-        raw_preview = request.get_data(as_text=True)[:500]
-        logger.info("[send_media] CT=%s RAW=%s", request.content_type, raw_preview)
-    except Exception:
-        pass
-
-    try:
-        data = request.get_json(force=True)
-    except Exception as e:
-        return jsonify({"status": "error", "error": f"Invalid JSON: {e}"}), 400
+# === Доставка (failover с дедлайном) ==========================================
 
+def _parse_payload(data: dict) -> Dict[str, Any]:
+    """Разбор одного payload'а /send_media. ValueError — некорректный запрос."""
+    if not isinstance(data, dict):
+        raise ValueError("item must be an object")
     user_id = data.get("user_id")
     username = data.get("username")
     files = data.get("files")
-    caption = data.get("caption", "")
-    parse_mode = (data.get("parse_mode") or "html").lower()
-    disable_web_page_preview = bool(data.get("disable_web_page_preview", False))
 
     if user_id is not None:
         try:
             user_id = int(user_id)
         except Exception:
-            return jsonify({"status": "error", "error": "user_id must be integer"}), 400
-
+            raise ValueError("user_id must be integer")
     if not (user_id is not None or username):
-        return jsonify({"status": "error", "error": "Specify 'user_id' or 'username'"}), 400
-
+        raise ValueError("Specify 'user_id' or 'username'")
     if not files or not isinstance(files, list):
-        return jsonify({"status": "error", "error": "files must be a non-empty list"}), 400
+        raise ValueError("files must be a non-empty list")
+
+    return {
+        "user_id": user_id,
+        "username": username,
+        "files": files,
+        "caption": data.get("caption", ""),
+        "parse_mode": (data.get("parse_mode") or "html").lower(),
+        "disable_web_page_preview": bool(data.get("disable_web_page_preview", False)),
+    }
+
+
+def _ok_body(p: Dict[str, Any], msgs: list) -> Dict[str, Any]:
+    return {
+        "status": "ok",
+        "recipient": p["username"] if p["username"] else p["user_id"],
+        "message_ids": [m.id for m in msgs],
+        "count": len(msgs),
+    }
+
+
+def _attempt(bridge: TelethonBridge, p: Dict[str, Any], recipient: Any = None):
+    """Корутина одной попытки отправки. recipient — уже зарезолвленный entity (failover)."""
+    return run_with_retry(
+        _send_media_impl, bridge.client,
+        bridge, p["user_id"], p["username"],
+        p["files"], p["caption"], p["parse_mode"], p["disable_web_page_preview"],
+        recipient=recipient,
+    )
 
-    # Проверяем, не вышли ли мы уже из этого чата
-    if user_id is not None and _router.registry.is_left(str(user_id)):
-        logger.info("send_media skipped: chat %s already left", user_id)
-        return jsonify({"status": "skipped", "reason": "chat already left"})
 
-    # Выбираем аккаунт
+async def _bot_fallback_async(p: Dict[str, Any]) -> Optional[dict]:
+    with tracing.span("bot_fallback"):
+        return await asyncio.get_running_loop().run_in_executor(
+            bot_fallback.executor, _try_bot_fallback,
+            p["user_id"], p["files"], p["caption"], p["parse_mode"],
+        )
+
+
+async def _failover(bridge: TelethonBridge, p: Dict[str, Any],
+                    deadline: failover.Deadline, reason: str) -> Optional[Dict[str, Any]]:
+    """Resolve получателя сразу на всех резервах, отправка — на первом успешном."""
+    chat_str = str(p["user_id"]) if p["user_id"] else (p["username"] or "")
+    candidates = _router.pool.get_all_healthy_except("send_media", exclude_key=bridge.name)
     try:
-        bridge = _router.pick_for_recipient(service="send_media", user_id=user_id, username=username)
-    except RuntimeError as e:
-        # Все аккаунты недоступны — пробуем Bot API
-        bot_result = _try_bot_fallback(user_id, files, caption, parse_mode)
-        if bot_result:
-            return jsonify(bot_result)
-        return jsonify({"status": "error", "error": str(e)}), 503
+        with tracing.span("failover"):
+            fallback, (entity, msgs) = await failover.probe_and_commit(
+                candidates,
+                probe=lambda b: _resolve_recipient(b, p["user_id"], p["username"]),
+                commit=lambda b, ent: _attempt(b, p, recipient=ent),
+                deadline=deadline,
+                reserve=config.BOT_FALLBACK_RESERVE,
+                on_error=lambda b, err: _router.handle_error(b, err, chat_str, "send_media"),
+            )
+    except failover.FailoverExhausted as e:
+        logger.warning("send_media failover for %s exhausted: %s", chat_str, e)
+        return None
+    _router.record_failover("send_media", chat_str, bridge.account_name,
+                            fallback.account_name, reason)
+    _router.handle_success(fallback, chat_str, "send_media")
+    return _ok_body(p, msgs)
+
+
+async def _deliver(bridge: TelethonBridge, p: Dict[str, Any],
+                   data: dict) -> Tuple[Dict[str, Any], int]:
+    """
+    Полный цикл /send_media в пределах REQUEST_DEADLINE:
+    основной аккаунт → параллельный failover → Bot API fallback.
+    """
+    deadline = failover.Deadline(config.REQUEST_DEADLINE["send_media"])
+    chat_str = str(p["user_id"]) if p["user_id"] else (p["username"] or "")
 
     try:
-        entity, msgs = _run(
-            run_with_retry(
-                _send_media_impl, bridge.client,
-                bridge, user_id, username,
-                files, caption, parse_mode, disable_web_page_preview,
-            ),
-            timeout=180,
+        entity, msgs = await asyncio.wait_for(
+            _attempt(bridge, p), deadline.budget(reserve=config.BOT_FALLBACK_RESERVE),
         )
-        chat_str = str(user_id) if user_id else (username or "")
         _router.handle_success(bridge, chat_str, "send_media")
-        return jsonify({
-            "status": "ok",
-            "recipient": username if username else user_id,
-            "message_ids": [m.id for m in msgs],
-            "count": len(msgs),
-        })
+        return _ok_body(p, msgs), 200
 
     except tl_errors.FloodWaitError as e:
-        chat_str = str(user_id) if user_id else (username or "")
         _router.handle_error(bridge, e, chat_str, "send_media")
-        # Failover — пробуем все оставшиеся аккаунты
-        fallbacks = _router.pool.get_all_healthy_except("send_media", exclude_key=bridge.name)
-        for fallback in fallbacks:
-            try:
-                entity, msgs = _run(
-                    run_with_retry(
-                        _send_media_impl, fallback.client,
-                        fallback, user_id, username,
-                        files, caption, parse_mode, disable_web_page_preview,
-                    ),
-                    timeout=180,
-                )
-                _router.handle_success(fallback, chat_str, "send_media")
-                return jsonify({
-                    "status": "ok",
-                    "recipient": username if username else user_id,
-                    "message_ids": [m.id for m in msgs],
-                    "count": len(msgs),
-                })
-            except Exception:
-                continue
-        # Bot API fallback
-        bot_result = _try_bot_fallback(user_id, files, caption, parse_mode)
+        result = await _failover(bridge, p, deadline, f"FloodWait {e.seconds}s")
+        if result:
+            return result, 200
+        bot_result = await _bot_fallback_async(p)
         if bot_result:
-            return jsonify(bot_result)
+            return bot_result, 200
         _save_failed(data, f"FloodWait {e.seconds}s (all accounts)")
-        return jsonify({"status": "error", "error": "FloodWait", "retry_after": e.seconds}), 429
+        return {"status": "error", "error": "FloodWait", "retry_after": e.seconds}, 429
 
     except tl_errors.FileReferenceExpiredError:
         _save_failed(data, "File reference expired")
-        return jsonify({"status": "error", "error": "File reference expired. Re-fetch the post or use a fresh link."}), 410
+        return {"status": "error", "error": "File reference expired. Re-fetch the post or use a fresh link."}, 410
 
     except tl_errors.UsernameNotOccupiedError:
         _save_failed(data, "Channel/username not found")
-        return jsonify({"status": "error", "error": "Channel/username not found"}), 404
+        return {"status": "error", "error": "Channel/username not found"}, 404
 
     except tl_errors.PeerIdInvalidError:
         _save_failed(data, "Invalid peer")
-        return jsonify({"status": "error", "error": "Invalid peer (user_id/username)"}), 400
+        return {"status": "error", "error": "Invalid peer (user_id/username)"}, 400
 
     except ValueError as e:
-        # Entity resolution failed — пробуем все оставшиеся аккаунты
-        chat_str = str(user_id) if user_id else (username or "")
         if "Cannot resolve" in str(e):
             logger.warning("send_media: entity %s not found on %s, trying failover", chat_str, bridge.name)
-            fallbacks = _router.pool.get_all_healthy_except("send_media", exclude_key=bridge.name)
-            for fallback in fallbacks:
-                try:
-                    entity, msgs = _run(
-                        run_with_retry(
-                            _send_media_impl, fallback.client,
-                            fallback, user_id, username,
-                            files, caption, parse_mode, disable_web_page_preview,
-                        ),
-                        timeout=180,
-                    )
-                    _router.handle_success(fallback, chat_str, "send_media")
-                    return jsonify({
-                        "status": "ok",
-                        "recipient": username if username else user_id,
-                        "message_ids": [m.id for m in msgs],
-                        "count": len(msgs),
-                    })
-                except Exception:
-                    continue
+            result = await _failover(bridge, p, deadline, "Cannot resolve")
+            if result:
+                return result, 200
         _router.handle_error(bridge, e, chat_str, "send_media")
         logger.error("send_media failed: %s: %s", type(e).__name__, e)
-        # Bot API fallback
-        bot_result = _try_bot_fallback(user_id, files, caption, parse_mode)
+        bot_result = await _bot_fallback_async(p)
         if bot_result:
-            return jsonify(bot_result)
+            return bot_result, 200
         _save_failed(data, str(e))
-        return jsonify({"status": "error", "error": str(e)}), 500
+        return {"status": "error", "error": str(e)}, 500
 
     except Exception as e:
         import traceback
-        chat_str = str(user_id) if user_id else (username or "")
         _router.handle_error(bridge, e, chat_str, "send_media")
         logger.error("send_media failed: %s: %s", type(e).__name__, e)
-        # Bot API fallback
-        bot_result = _try_bot_fallback(user_id, files, caption, parse_mode)
+        bot_result = await _bot_fallback_async(p)
         if bot_result:
-            return jsonify(bot_result)
-        _save_failed(data, str(e))
-        return jsonify({
+            return bot_result, 200
+        _save_failed(data, str(e) or type(e).__name__)
+        return {
             "status": "error",
-            "error": str(e),
+            "error": str(e) or type(e).__name__,
             "trace": traceback.format_exc(),
-        }), 500
+        }, 500
+
+
+async def _send_media_item(bridge: Optional[TelethonBridge], p: Dict[str, Any],
+                           data: dict) -> Tuple[Dict[str, Any], int]:
+    """Один элемент батча. bridge=None — для получателя нет ни одного аккаунта."""
+    if bridge is None:
+        bot_result = await _bot_fallback_async(p)
+        if bot_result:
+            return bot_result, 200
+        return {"status": "error", "error": "No healthy accounts for service=send_media"}, 503
+    return await _deliver(bridge, p, data)
+
+
+# === HTTP endpoint ============================================================
+
+@bp.route("/send_media", methods=["POST"])
+@idempotency.idempotent("send_media")
+def send_media():
+    if _router is None:
+        return jsonify({"status": "error", "error": "not initialized"}), 503
+
+    try:
+        raw_preview = request.get_data(as_text=True)[:500]
+        logger.info("[send_media] CT=%s RAW=%s", request.content_type, raw_preview)
+    except Exception:
+        pass
+
+    try:
+        data = request.get_json(force=True)
+    except Exception as e:
+        return jsonify({"status": "error", "error": f"Invalid JSON: {e}"}), 400
+
+    try:
+        p = _parse_payload(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    # Проверяем, не вышли ли мы уже из этого чата
+    if p["user_id"] is not None and _router.registry.is_left(str(p["user_id"])):
+        logger.info("send_media skipped: chat %s already left", p["user_id"])
+        return jsonify({"status": "skipped", "reason": "chat already left"})
+
+    # Выбираем аккаунт
+    try:
+        bridge = _router.pick_for_recipient(
+            service="send_media", user_id=p["user_id"], username=p["username"],
+        )
+    except RuntimeError as e:
+        # Все аккаунты недоступны — пробуем Bot API
+        bot_result = _try_bot_fallback(p["user_id"], p["files"], p["caption"], p["parse_mode"])
+        if bot_result:
+            return jsonify(bot_result)
+        return jsonify({"status": "error", "error": str(e)}), 503
+
+    try:
+        body, code = _run(
+            _deliver(bridge, p, data),
+            timeout=config.REQUEST_DEADLINE["send_media"] + 10,
+        )
+        return jsonify(body), code
+    except Exception as e:
+        logger.error("send_media failed: %s: %s", type(e).__name__, e)
+        _save_failed(data, str(e) or type(e).__name__)
+        return jsonify({"status": "error", "error": str(e) or type(e).__name__}), 500
+
+
+@bp.route("/send_media/batch", methods=["POST"])
+@idempotency.idempotent("send_media_batch")
+def send_media_batch():
+    """
+    Пакетная отправка: массив payload'ов /send_media (или {"items": [...]}).
+    Элементы группируются по аккаунту и выполняются конкурентно в пределах
+    лимитов аккаунта. Ответ — результат по каждому элементу в исходном порядке.
+    """
+    if _router is None:
+        return jsonify({"status": "error", "error": "not initialized"}), 503
+
+    data = request.get_json(force=True, silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "error": "items must be a non-empty list"}), 400
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return jsonify({
+            "status": "error", "error": f"too many items (max {config.BATCH_MAX_ITEMS})",
+        }), 400
+
+    results: Dict[int, Tuple[Dict[str, Any], int]] = {}
+    parsed: Dict[int, Dict[str, Any]] = {}
+    for i, item in enumerate(items):
+        try:
+            parsed[i] = _parse_payload(item)
+        except ValueError as e:
+            results[i] = ({"status": "error", "error": str(e)}, 400)
+
+    def _recipient_key(p):
+        return str(p["user_id"]) if p["user_id"] is not None else p["username"]
+
+    left = _router.registry.get_left(
+        [str(p["user_id"]) for p in parsed.values() if p["user_id"] is not None]
+    )
+    routes = _router.pick_for_chats(
+        [_recipient_key(p) for p in parsed.values()], service="send_media",
+    )
+
+    groups: Dict[str, List[batch.Job]] = {}
+    for i, p in parsed.items():
+        if p["user_id"] is not None and str(p["user_id"]) in left:
+            results[i] = ({"status": "skipped", "reason": "chat already left"}, 200)
+            continue
+        bridge = routes.get(_recipient_key(p))
+        groups.setdefault(bridge.name if bridge else "", []).append(
+            (i, lambda b=bridge, p=p, d=items[i]: _send_media_item(b, p, d))
+        )
+
+    if groups:
+        try:
+            # Дедлайн внутри батча: по истечении — частичные результаты, а не
+            # 500 при продолжающихся в loop'е отправках
+            results.update(_run(batch.run_grouped(groups, timeout=config.BATCH_TIMEOUT),
+                                timeout=config.BATCH_TIMEOUT + 30))
+        except Exception as e:
+            logger.error("send_media batch failed: %s: %s", type(e).__name__, e)
+            return jsonify({"status": "error", "error": str(e) or type(e).__name__}), 500
+
+    out = []
+    for i in range(len(items)):
+        res = results.get(i)
+        if isinstance(res, batch.DeadlineExceeded):
+            res = ({"status": "error", "error": str(res), "started": res.started}, 504)
+        elif isinstance(res, Exception):
+            res = ({"status": "error", "error": str(res) or type(res).__name__}, 500)
+        body, code = res
+        out.append({"index": i, "http_status": code, **body})
+
+    return jsonify({
+        "status": "ok",
+        "count": len(out),
+        "succeeded": sum(1 for r in out if r.get("status") == "ok"),
+        "results": out,
+    })
 
 
 # === Extra endpoints (совместимость) ==========================================
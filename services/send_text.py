@@ -20,7 +20,7 @@ JSON запрос (не меняется):
 """
 import asyncio
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from flask import Blueprint, request, jsonify
 from html import escape as _html_escape
@@ -30,7 +30,8 @@ from telethon.utils import get_peer_id
 from core.bridge import TelethonBridge
 from core.router import AccountRouter
 from core.retry import run_with_retry
-from core import bot_fallback
+from core import batch, bot_fallback, failover, idempotency, tracing
+import config
 
 logger = logging.getLogger("svc.send_text")
 
@@ -173,7 +174,8 @@ async def _send_text_impl(
 
     users_cache: Dict[int, types.User] = {}
     if not is_private:
-        users_cache = await _load_participants(bridge, chat_ent)
+        with tracing.span("load_participants"):
+            users_cache = await _load_participants(bridge, chat_ent)
 
     exclude_ids: set = set()
     for uname in exclude_usernames or []:
@@ -243,146 +245,263 @@ async def _send_text_impl(
     }
 
 
-# === HTTP endpoint ============================================================
+# === Доставка (failover с дедлайном) ==========================================
 
-@bp.route("/send_text", methods=["POST"])
-def send_text():
-    if _router is None:
-        return jsonify({"error": "telethon client not ready"}), 503
-
-    data = request.get_json(force=True, silent=True) or {}
+def _parse_payload(data: dict) -> Dict[str, Any]:
+    """Разбор одного payload'а /send_text. ValueError — некорректный запрос."""
+    if not isinstance(data, dict):
+        raise ValueError("item must be an object")
     chat = data.get("chat")
-    text = data.get("text") or ""
-    tag_client = bool(data.get("tag_client", False))
+    if chat is None:
+        raise ValueError("chat is required")
+
+    chat_ref = chat
+    if isinstance(chat_ref, str) and chat_ref.strip().lstrip("-").isdigit():
+        chat_ref = int(chat_ref)
+
     client_id = data.get("client_id")
     client_username = data.get("client_username")
     exclude_usernames = data.get("exclude_usernames") or []
-    disable_preview = bool(data.get("disable_preview", True))
     reply_to = data.get("reply_to")
-    parse_mode = (data.get("parse_mode") or "html").lower()
+    try:
+        client_id = int(client_id) if client_id is not None else None
+        reply_to = int(reply_to) if reply_to is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("client_id and reply_to must be integers")
 
-    if chat is None:
-        return jsonify({"error": "chat is required"}), 400
+    return {
+        "chat": chat,
+        "chat_ref": chat_ref,
+        "text": data.get("text") or "",
+        "tag_client": bool(data.get("tag_client", False)),
+        "client_id": client_id,
+        "client_username": client_username if isinstance(client_username, str) else None,
+        "exclude_usernames": exclude_usernames if isinstance(exclude_usernames, list) else [],
+        "disable_preview": bool(data.get("disable_preview", True)),
+        "reply_to": reply_to,
+        "parse_mode": (data.get("parse_mode") or "html").lower(),
+    }
 
-    # Проверяем, не вышли ли мы уже из этого чата
-    if _router.registry.is_left(str(chat)):
-        logger.info("send_text skipped: chat %s already left", chat)
-        return jsonify({"status": "skipped", "reason": "chat already left"})
 
-    # Нормализуем chat в int если можно
-    chat_ref = chat
-    if isinstance(chat_ref, str) and chat_ref.strip().lstrip("-").isdigit():
-        try:
-            chat_ref = int(chat_ref)
-        except Exception:
-            pass
+def _attempt(bridge: TelethonBridge, p: Dict[str, Any], chat: Any = None):
+    """Корутина одной попытки отправки. chat — уже зарезолвленный entity (failover)."""
+    return run_with_retry(
+        _send_text_impl, bridge.client,
+        bridge, p["chat_ref"] if chat is None else chat,
+        p["text"], p["tag_client"],
+        p["client_id"], p["client_username"], p["exclude_usernames"],
+        p["disable_preview"], p["reply_to"], p["parse_mode"],
+    )
 
-    try:
-        bridge = _router.pick_for_chat(chat_ref, service="send_text")
-    except RuntimeError as e:
-        # Все аккаунты недоступны — пробуем Bot API
-        bot_result = _try_bot_fallback(
-            chat_ref, text, parse_mode, disable_preview,
-            int(reply_to) if reply_to is not None else None,
+
+async def _bot_fallback_async(p: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    with tracing.span("bot_fallback"):
+        return await asyncio.get_running_loop().run_in_executor(
+            bot_fallback.executor, _try_bot_fallback,
+            p["chat_ref"], p["text"], p["parse_mode"], p["disable_preview"], p["reply_to"],
         )
-        if bot_result:
-            return jsonify(bot_result)
-        return jsonify({"error": str(e)}), 503
+
+
+async def _failover(bridge: TelethonBridge, p: Dict[str, Any],
+                    deadline: failover.Deadline, reason: str) -> Optional[Dict[str, Any]]:
+    """Resolve чата сразу на всех резервах, отправка — на первом успешном."""
+    chat_str = str(p["chat_ref"])
+    candidates = _router.pool.get_all_healthy_except("send_text", exclude_key=bridge.name)
+    try:
+        with tracing.span("failover"):
+            fallback, result = await failover.probe_and_commit(
+                candidates,
+                probe=lambda b: b.get_entity(p["chat_ref"]),
+                commit=lambda b, ent: _attempt(b, p, chat=ent),
+                deadline=deadline,
+                reserve=config.BOT_FALLBACK_RESERVE,
+                on_error=lambda b, err: _router.handle_error(b, err, chat_str, "send_text"),
+            )
+    except failover.FailoverExhausted as e:
+        logger.warning("send_text failover for %s exhausted: %s", chat_str, e)
+        return None
+    _router.record_failover("send_text", chat_str, bridge.account_name,
+                            fallback.account_name, reason)
+    _router.handle_success(fallback, chat_str, "send_text")
+    return result
+
+
+async def _deliver(bridge: TelethonBridge, p: Dict[str, Any],
+                   data: dict) -> Tuple[Dict[str, Any], int]:
+    """
+    Полный цикл /send_text в пределах REQUEST_DEADLINE:
+    основной аккаунт → параллельный failover → Bot API fallback.
+    """
+    deadline = failover.Deadline(config.REQUEST_DEADLINE["send_text"])
+    chat_str = str(p["chat_ref"])
 
     try:
-        result = _run(
-            run_with_retry(
-                _send_text_impl, bridge.client,
-                bridge, chat_ref, text, tag_client,
-                int(client_id) if client_id is not None else None,
-                client_username if isinstance(client_username, str) else None,
-                exclude_usernames if isinstance(exclude_usernames, list) else [],
-                disable_preview,
-                int(reply_to) if reply_to is not None else None,
-                parse_mode,
-            ),
-            timeout=120,
+        result = await asyncio.wait_for(
+            _attempt(bridge, p), deadline.budget(reserve=config.BOT_FALLBACK_RESERVE),
         )
-        _router.handle_success(bridge, str(chat_ref), "send_text")
-        return jsonify(result)
+        _router.handle_success(bridge, chat_str, "send_text")
+        return result, 200
 
     except tl_errors.FloodWaitError as e:
-        _router.handle_error(bridge, e, str(chat_ref), "send_text")
-        # Failover — пробуем все оставшиеся аккаунты
-        fallbacks = _router.pool.get_all_healthy_except("send_text", exclude_key=bridge.name)
-        for fallback in fallbacks:
-            try:
-                result = _run(
-                    run_with_retry(
-                        _send_text_impl, fallback.client,
-                        fallback, chat_ref, text, tag_client,
-                        int(client_id) if client_id is not None else None,
-                        client_username if isinstance(client_username, str) else None,
-                        exclude_usernames if isinstance(exclude_usernames, list) else [],
-                        disable_preview,
-                        int(reply_to) if reply_to is not None else None,
-                        parse_mode,
-                    ),
-                    timeout=120,
-                )
-                _router.handle_success(fallback, str(chat_ref), "send_text")
-                return jsonify(result)
-            except Exception:
-                continue
-        # Последний шанс — Bot API fallback
-        bot_result = _try_bot_fallback(chat_ref, text, parse_mode, disable_preview, reply_to)
+        _router.handle_error(bridge, e, chat_str, "send_text")
+        result = await _failover(bridge, p, deadline, f"FloodWait {e.seconds}s")
+        if result:
+            return result, 200
+        bot_result = await _bot_fallback_async(p)
         if bot_result:
-            return jsonify(bot_result)
+            return bot_result, 200
         _save_failed(data, f"FloodWait {e.seconds}s (all accounts)")
-        return jsonify({"status": "error", "error": "FloodWait", "retry_after": e.seconds}), 429
+        return {"status": "error", "error": "FloodWait", "retry_after": e.seconds}, 429
 
     except ValueError as e:
-        # Entity resolution failed — пробуем все оставшиеся аккаунты
         if "Cannot resolve" in str(e):
-            logger.warning("send_text: entity %s not found on %s, trying failover", chat_ref, bridge.name)
-            fallbacks = _router.pool.get_all_healthy_except("send_text", exclude_key=bridge.name)
-            for fallback in fallbacks:
-                try:
-                    result = _run(
-                        run_with_retry(
-                            _send_text_impl, fallback.client,
-                            fallback, chat_ref, text, tag_client,
-                            int(client_id) if client_id is not None else None,
-                            client_username if isinstance(client_username, str) else None,
-                            exclude_usernames if isinstance(exclude_usernames, list) else [],
-                            disable_preview,
-                            int(reply_to) if reply_to is not None else None,
-                            parse_mode,
-                        ),
-                        timeout=120,
-                    )
-                    _router.handle_success(fallback, str(chat_ref), "send_text")
-                    return jsonify(result)
-                except Exception:
-                    continue
-        _router.handle_error(bridge, e, str(chat_ref), "send_text")
+            logger.warning("send_text: entity %s not found on %s, trying failover", chat_str, bridge.name)
+            result = await _failover(bridge, p, deadline, "Cannot resolve")
+            if result:
+                return result, 200
+        _router.handle_error(bridge, e, chat_str, "send_text")
         logger.error("send_text failed: %s: %s", type(e).__name__, e)
-        # Bot API fallback
-        bot_result = _try_bot_fallback(chat_ref, text, parse_mode, disable_preview, reply_to)
+        bot_result = await _bot_fallback_async(p)
         if bot_result:
-            return jsonify(bot_result)
+            return bot_result, 200
         _save_failed(data, str(e))
-        return jsonify({"status": "error", "error": str(e)}), 500
+        return {"status": "error", "error": str(e)}, 500
 
     except Exception as e:
         import traceback
-        _router.handle_error(bridge, e, str(chat_ref), "send_text")
+        _router.handle_error(bridge, e, chat_str, "send_text")
         logger.error("send_text failed: %s: %s", type(e).__name__, e)
-        # Bot API fallback
-        bot_result = _try_bot_fallback(chat_ref, text, parse_mode, disable_preview, reply_to)
+        bot_result = await _bot_fallback_async(p)
         if bot_result:
-            return jsonify(bot_result)
-        _save_failed(data, str(e))
-        return jsonify({
+            return bot_result, 200
+        _save_failed(data, str(e) or type(e).__name__)
+        return {
             "status": "error",
-            "error": str(e),
+            "error": str(e) or type(e).__name__,
             "traceback": traceback.format_exc(),
-        }), 500
+        }, 500
+
+
+async def _send_text_item(bridge: Optional[TelethonBridge], p: Dict[str, Any],
+                          data: dict) -> Tuple[Dict[str, Any], int]:
+    """Один элемент батча. bridge=None — для чата нет ни одного аккаунта."""
+    if bridge is None:
+        bot_result = await _bot_fallback_async(p)
+        if bot_result:
+            return bot_result, 200
+        return {"status": "error", "error": "No healthy accounts for service=send_text"}, 503
+    return await _deliver(bridge, p, data)
+
+
+# === HTTP endpoint ============================================================
+
+@bp.route("/send_text", methods=["POST"])
+@idempotency.idempotent("send_text")
+def send_text():
+    if _router is None:
+        return jsonify({"error": "telethon client not ready"}), 503
+
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        p = _parse_payload(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Проверяем, не вышли ли мы уже из этого чата
+    if _router.registry.is_left(str(p["chat"])):
+        logger.info("send_text skipped: chat %s already left", p["chat"])
+        return jsonify({"status": "skipped", "reason": "chat already left"})
+
+    try:
+        bridge = _router.pick_for_chat(p["chat_ref"], service="send_text")
+    except RuntimeError as e:
+        # Все аккаунты недоступны — пробуем Bot API
+        bot_result = _try_bot_fallback(
+            p["chat_ref"], p["text"], p["parse_mode"], p["disable_preview"], p["reply_to"],
+        )
+        if bot_result:
+            return jsonify(bot_result)
+        return jsonify({"error": str(e)}), 503
+
+    try:
+        body, code = _run(
+            _deliver(bridge, p, data),
+            timeout=config.REQUEST_DEADLINE["send_text"] + 10,
+        )
+        return jsonify(body), code
+    except Exception as e:
+        logger.error("send_text failed: %s: %s", type(e).__name__, e)
+        _save_failed(data, str(e) or type(e).__name__)
+        return jsonify({"status": "error", "error": str(e) or type(e).__name__}), 500
+
+
+@bp.route("/send_text/batch", methods=["POST"])
+@idempotency.idempotent("send_text_batch")
+def send_text_batch():
+    """
+    Пакетная отправка: массив payload'ов /send_text (или {"items": [...]}).
+    Элементы группируются по аккаунту и выполняются конкурентно в пределах
+    лимитов аккаунта. Ответ — результат по каждому элементу в исходном порядке.
+    """
+    if _router is None:
+        return jsonify({"error": "telethon client not ready"}), 503
+
+    data = request.get_json(force=True, silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"too many items (max {config.BATCH_MAX_ITEMS})"}), 400
+
+    results: Dict[int, Tuple[Dict[str, Any], int]] = {}
+    parsed: Dict[int, Dict[str, Any]] = {}
+    for i, item in enumerate(items):
+        try:
+            parsed[i] = _parse_payload(item)
+        except ValueError as e:
+            results[i] = ({"status": "error", "error": str(e)}, 400)
+
+    left = _router.registry.get_left([str(p["chat"]) for p in parsed.values()])
+    routes = _router.pick_for_chats(
+        [str(p["chat_ref"]) for p in parsed.values()], service="send_text",
+    )
+
+    groups: Dict[str, List[batch.Job]] = {}
+    for i, p in parsed.items():
+        if str(p["chat"]) in left:
+            results[i] = ({"status": "skipped", "reason": "chat already left"}, 200)
+            continue
+        bridge = routes.get(str(p["chat_ref"]))
+        groups.setdefault(bridge.name if bridge else "", []).append(
+            (i, lambda b=bridge, p=p, d=items[i]: _send_text_item(b, p, d))
+        )
+
+    if groups:
+        try:
+            # Дедлайн внутри батча: по истечении — частичные результаты, а не
+            # 500 при продолжающихся в loop'е отправках
+            results.update(_run(batch.run_grouped(groups, timeout=config.BATCH_TIMEOUT),
+                                timeout=config.BATCH_TIMEOUT + 30))
+        except Exception as e:
+            logger.error("send_text batch failed: %s: %s", type(e).__name__, e)
+            return jsonify({"status": "error", "error": str(e) or type(e).__name__}), 500
+
+    out = []
+    for i in range(len(items)):
+        res = results.get(i)
+        if isinstance(res, batch.DeadlineExceeded):
+            res = ({"status": "error", "error": str(res), "started": res.started}, 504)
+        elif isinstance(res, Exception):
+            res = ({"status": "error", "error": str(res) or type(res).__name__}, 500)
+        body, code = res
+        out.append({"index": i, "http_status": code, **body})
+
+    return jsonify({
+        "status": "ok",
+        "count": len(out),
+        "succeeded": sum(1 for r in out if r.get("status") == "ok"),
+        "results": out,
+    })
 
 
 # === Extra endpoints (совместимость) ==========================================